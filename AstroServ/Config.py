@@ -7,13 +7,99 @@ PASS="<password>"
 
 # Publish every N seconds
 INTERVAL=300
+# Align publishing to wall-clock multiples of INTERVAL
+ALIGN=False
+
+# Unchanged retained messages are only republished after N seconds
+# (None = never, 0 = always)
+HEARTBEAT=3600
+
+# Additional payload encodings, published on parallel `<topic>/<suffix>`
+# topics, e.g. { 'bin': 'msgpack' } (or 'cbor')
+ENCODINGS={}
+# Decimal digits of float values, per topic and field, e.g. { 'sun': { 'position': 1 } }
+PRECISION={}
+
+# Delivery profiles by topic pattern (supports '+' and '#' wildcards),
+# overriding the built-in QoS and retain flag of matching messages:
+# - 'ephemeral' = QoS 0; 'event' = QoS 1; 'state' = QoS 1, retained;
+# - 'reliable' = QoS 2; or ( <qos>, <retain> )
+# The first matching pattern wins, so list specific ones first. Topics of
+# additional encodings take the profile of their topic; internal topics
+# (e.g. self-telemetry) are not affected.
+PROFILES={ '#': 'state' }
+# Client limits of in-flight (QoS>0) and queued messages (0 = unlimited)
+MAX_INFLIGHT=20
+MAX_QUEUED=0
+
+# While disconnected, keep the latest retained messages in this file (None
+# = disabled), up to SPOOL_SIZE bytes, and replay them after reconnecting
+# at SPOOL_RATE messages per second
+SPOOL_FILE=None
+SPOOL_SIZE=65536
+SPOOL_RATE=10
+
+# Publish self-telemetry (timings, message counts) every N seconds
+# (None = disabled) under `<TOPIC_PFX>/<STATS_TOPIC>`, and optionally
+# also write it to a Prometheus text file
+STATS_INTERVAL=None
+STATS_TOPIC="_stats"
+STATS_PROMFILE=None
+
+# Mid-night maintenance is performed in-process: optionally reload this
+# configuration (settings that can change at run-time only), and terminate
+# for a full restart only if memory grew more than N MB (None = never)
+MAINT_RELOAD=False
+MAINT_RSS_GROWTH=64
+
+# Positions and moon phase are interpolated from daily tables computed at N
+# seconds resolution (None = computed exactly on every tick). At 60 sec, the
+# error is under 0.001 degree, except for azimuth when the sun/moon is near
+# the zenith (up to ~0.5 degree in the tropics); it shrinks with N squared.
+POSITION_STEP=60
+
+# Astronomical computation engine: 'skyfield' (ephemeris below, precise) or
+# 'meeus' (low-precision analytic series, no ephemeris; positions within ~0.01
+# degree and rise/set times within seconds, see Bench/AstroEngineBench.py)
+ENGINE="skyfield"
+
+# Publish the almanac (rise/set times, moon phase) of the next N local days
+# under `almanac/daily` (0 = not published)
+ALMANAC_DAYS=7
+
+# Compute the observations of each tick ahead in a worker process, keeping
+# the publishing thread free; at a tick, wait up to PREFETCH_DEADLINE seconds
+# for them, or skip the tick. Observations finished late for an earlier tick
+# are published if at most PREFETCH_MAX_STALE seconds old, otherwise dropped
+PREFETCH=False
+PREFETCH_DEADLINE=1.0
+PREFETCH_MAX_STALE=0
+
+# Ephemeris file (downloaded if missing), and a compact excerpt of the Sun,
+# Moon and Earth from it (None = use the full ephemeris) covering the days
+# ( <before>, <after> ) today, rebuilt when less than half of either is left
+EPHEMERIS="de421.bsp"
+EPHEMERIS_CACHE="ephemeris.bsp"
+EPHEMERIS_DAYS=(366, 1098)
+
+# Timeline of the rise/set, phase and season events, computed ahead for N
+# days in background, and saved to a file to survive restarts (None = not saved)
+TIMELINE_DAYS=120
+TIMELINE_FILE="timeline.npz"
 
 # All messages will be published under this prefix
 TOPIC_PFX="/infr/astro"
 
-# Observer location on earth
+# Observer location on earth, optionally with the 'tz' (IANA name, e.g.
+# 'America/New_York') of its local days in the almanac (default = the host's)
 LOCAL_COORD={
     'lat': 38.9058115,
     'long': -77.0501575,
     'alt_m': 13.5
 }
+
+# Multiple observer sites, by name, each published under `<TOPIC_PFX>/<name>/`
+# (None = only LOCAL_COORD, published directly under TOPIC_PFX), e.g.
+# { 'home': { 'lat': 38.9058115, 'long': -77.0501575, 'alt_m': 13.5 },
+#   'cabin': { 'lat': 44.27, 'long': -71.30, 'alt_m': 1917, 'tz': 'America/New_York' }, ... }
+OBSERVERS=None
@@ -1,120 +1,272 @@
 import os
+import time
 import logging
-import json
 import signal
+import threading
 
 from common import MQPubCli
 
-import numpy as np
-
 from datetime import datetime, timezone
-from skyfield import api as sf_api, almanac
+from zoneinfo import ZoneInfo
 
 from __deploy__ import Config
-from SkyFieldCompute import *
 
 DEBUG = os.environ.get('DEBUG')
 logging.basicConfig(level=logging.NOTSET if DEBUG else logging.WARNING)
 
 DRYRUN = os.environ.get('DRYRUN')
 
-# Custom json encoder to handle numpy types
-class CusEncoder(json.JSONEncoder):
+# Convert numpy types for payload encoders
+def NumpyToPy(obj):
+    import numpy as np      # Already loaded with the astronomical computations
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not serializable" % type(obj).__name__)
 
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        else:
-            return super(CusEncoder, self).default(obj)
+# Observer sites on Earth, by name (sub-topic), default to the single
+# LOCAL_COORD published directly under the topic prefix
+OBSERVERS = getattr(Config, 'OBSERVERS', None) or { '': Config.LOCAL_COORD }
+SITES = list(OBSERVERS)
+# Time zones of the sites' local days (of their IANA 'tz' name, or None =
+# the host's)
+SITE_TZS = [ ZoneInfo(OBSERVERS[site]['tz']) if OBSERVERS[site].get('tz') else None
+             for site in SITES ]
 
-# Load observer references
-OBLOC = sf_api.Topos(latitude_degrees=Config.LOCAL_COORD['lat'],
-                     longitude_degrees=Config.LOCAL_COORD['long'],
-                     elevation_m=Config.LOCAL_COORD['alt_m'])
+# Astronomical computation engine: 'skyfield' (with the ephemeris), or
+# 'meeus' (low-precision analytic)
+ENGINE = getattr(Config, 'ENGINE', 'skyfield')
+if ENGINE not in ('skyfield', 'meeus'):
+    raise Exception("Unknown astronomical engine '%s'" % ENGINE)
 
-SUN_OBSERVER = PlanetObserver(SUN, OBLOC)
-MOON_OBSERVER = PlanetObserver(MOON, OBLOC)
+# Days of the published almanac (0 = not published)
+ALMANAC_DAYS = getattr(Config, 'ALMANAC_DAYS', 0)
 
-SUN_RISESET = PlanetRiseSet(SUN_OBSERVER, 0.5, SUN_TOP_HORIZON_APPARENT)
-SUN_DAWNDUSK = PlanetRiseSet(SUN_OBSERVER, 0.5, SUN_CIVIL_TWILIGHT)
-MOON_RISESET = PlanetRiseSet(MOON_OBSERVER, 0.5, MOON_TOP_HORIZON_APPARENT)
+# Compute the observations of each tick ahead in a worker process, see
+# MQPubCli.TickPrefetcher
+PREFETCH = getattr(Config, 'PREFETCH', False)
 
-class MQAstroService(MQPubCli.IntervalPublisher):
+# Files are resolved now, as they may be used after leaving the deployment
+# directory (e.g. when hosted)
+EPHEMERIS = os.path.abspath(getattr(Config, 'EPHEMERIS', 'de421.bsp'))
+EPHEMERIS_CACHE = getattr(Config, 'EPHEMERIS_CACHE', None)
+EPHEMERIS_CACHE = EPHEMERIS_CACHE and os.path.abspath(EPHEMERIS_CACHE)
+TIMELINE_FILE = getattr(Config, 'TIMELINE_FILE', None)
+TIMELINE_FILE = TIMELINE_FILE and os.path.abspath(TIMELINE_FILE)
 
-    def on_connected(self, unix_ts, con_count):
-        self._publish('earth/observer/coord', json.dumps(Config.LOCAL_COORD), retain=True)
+# Load the astronomical computations, returns ( <SkyFieldCompute module>,
+# <daily positions table>, <event timelines>, <daily almanac> )
+def LoadAstro():
+    import SkyFieldCompute as SF
+    if ENGINE == 'meeus':
+        SF.LoadMeeus()
+    else:
+        SF.LoadEphemeris(EPHEMERIS, cache=EPHEMERIS_CACHE,
+                         days=getattr(Config, 'EPHEMERIS_DAYS', (366, 1098)))
+    OBLOCS = [ SF.sf_api.Topos(latitude_degrees=OBSERVERS[site]['lat'],
+                               longitude_degrees=OBSERVERS[site]['long'],
+                               elevation_m=OBSERVERS[site]['alt_m']) for site in SITES ]
 
-    def on_interval(self, unix_ts):
-        # === Observer (on Earth) Info ===
-        # What is the time now
-        TIME_TS = TIMESCALE.from_datetime(datetime.fromtimestamp(unix_ts, timezone.utc))
-        TIME_DT = TIME_TS.utc_datetime()
-        TIME_ORD = TIME_TS.toordinal()
-        LOCAL_INFO = {
-            'time': ( TIME_TS.utc_iso(), "%.3f"%unix_ts )
-        }
-        # What is this season
-        SEASON_CUR = SEASONS(TIME_TS)
-        SEASON_INFO = [ ( SEASON_CUR+1, almanac.SEASONS[SEASON_CUR] ) ]
-        SEASON_INFO += SeasonProg(TIME_DT, TIME_ORD)
-        LOCAL_INFO['season'] = SEASON_INFO
-        self._publish('earth/observer', json.dumps(LOCAL_INFO, cls=CusEncoder), retain=True)
+    # Positions of all sites, and phase, interpolated from daily tables
+    SITES_OBSERVER = SF.SitesObserver([SF.SUN, SF.MOON], OBLOCS)
+    POSITIONS = SF.DailyTable([
+        (('sun_alt', 'sun_az', 'moon_alt', 'moon_az'), SITES_OBSERVER),
+        (('moon_illum',), lambda t: [SF.MOON_ILLUMOB(t)]),
+        (('moon_phdeg',), lambda t: [SF.MOON_PHDEGOB(t)]),
+    ], step=getattr(Config, 'POSITION_STEP', 60), wrapped=('sun_az', 'moon_az', 'moon_phdeg'))
+
+    # Timelines of the events, with the days needed before and after lookups
+    TIMELINES = {
+        'seasons': SF.EventTimeline(SF.SEASONS, SF.DAYS_IN_YEAR/4+2, SF.DAYS_IN_YEAR/4+2),
+        # A lunation back for the moon age, and a year ahead as it is cheap
+        'moon_phases': SF.LunationTable(SF.MOON_SYNODIC_PERIOD+2, SF.DAYS_IN_YEAR),
+    }
+    for site, obloc in zip(SITES, OBLOCS):
+        sun_observer = SF.PlanetAltitudeObserver(SF.SUN, obloc)
+        moon_observer = SF.PlanetAltitudeObserver(SF.MOON, obloc)
+        TIMELINES.update({
+            os.path.join(site, 'sun_riseset'):
+                SF.EventTimeline(SF.PlanetRiseSet(sun_observer, 0.5, SF.SUN_TOP_HORIZON_APPARENT), 1, 2),
+            os.path.join(site, 'sun_dawndusk'):
+                SF.EventTimeline(SF.PlanetRiseSet(sun_observer, 0.5, SF.SUN_CIVIL_TWILIGHT), 1, 2),
+            os.path.join(site, 'moon_riseset'):
+                SF.EventTimeline(SF.PlanetRiseSet(moon_observer, 0.5, SF.MOON_TOP_HORIZON_APPARENT), 2, 2),
+        })
+    # Almanac of the next days of each site, from their timelines
+    ALMANAC = SF.DailyAlmanac([ [ TIMELINES[os.path.join(site, name)]
+                                  for name in ('sun_riseset', 'sun_dawndusk', 'moon_riseset') ]
+                                for site in SITES ], ALMANAC_DAYS, SITE_TZS)
+    TIMELINES = SF.EventTimelines(TIMELINES, path=TIMELINE_FILE, key=repr((ENGINE, OBSERVERS)),
+                                  horizon=getattr(Config, 'TIMELINE_DAYS', 120))
+    TIMELINES.load()
+
+    astro = (SF, POSITIONS, TIMELINES, ALMANAC)
+    # Warm up the tables and timelines, so that the first tick is quick
+    Observe(astro, time.time())
+    return astro
+
+"""
+Loads the astronomical computations (numpy, skyfield and the ephemeris take
+a while) in background, started on import to overlap with connecting to the
+MQTT server (or on first use, in the prefetch worker), and awaited on first
+use.
+"""
+class AstroLoader:
+
+    def __init__(self):
+        self._ASTRO = None
+        self._ERROR = None
+        self._LOCK = threading.Lock()
+        self._THREAD = threading.Thread(target=self._load, daemon=True)
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self._ASTRO = LoadAstro()
+        except Exception as e:
+            self._ERROR = e
+        logging.getLogger(__name__).debug("Loaded astronomical computations in %.3f sec",
+                                          time.perf_counter() - start)
+
+    def start(self):
+        with self._LOCK:
+            if self._THREAD.ident is None:
+                self._THREAD.start()
+
+    def get(self):
+        self.start()
+        self._THREAD.join()
+        if self._ERROR:
+            raise Exception("Failed loading astronomical computations") from self._ERROR
+        return self._ASTRO
+
+ASTRO = AstroLoader()
+# Loaded in the worker instead, if prefetching
+if not PREFETCH:
+    ASTRO.start()
+
+# Observations at given time, as [ ( <sub-topic>, <data> ) ]
+def Observe(astro, unix_ts):
+    SF, POSITIONS, TIMELINES, ALMANAC = astro
+    OBSERVATIONS = []
+
+    # === Observer (on Earth) Info ===
+    # What is the time now
+    TIME_TS = SF.TIMESCALE.from_datetime(datetime.fromtimestamp(unix_ts, timezone.utc))
+    TIME_ORD = TIME_TS.toordinal()
+    TIMELINES.refresh(TIME_TS)
+    POS = POSITIONS.at(TIME_TS)
+    LOCAL_INFO = {
+        'time': ( TIME_TS.utc_iso(), "%.3f"%unix_ts )
+    }
+    # What is this season
+    SEASON_CUR = SF.SEASONS(TIME_TS)
+    SEASON_INFO = [ ( SEASON_CUR+1, SF.almanac.SEASONS[SEASON_CUR] ) ]
+    SEASON_INFO += SF.SeasonProg(TIMELINES['seasons'], TIME_TS, TIME_ORD)
+    LOCAL_INFO['season'] = SEASON_INFO
+
+    # === Moon Phase Info (same for all sites) ===
+    MOON_ILLUM = POS['moon_illum']
+    MOON_PHDEG = POS['moon_phdeg']
+    MOON_CURPH = SF.MoonPhaseEx(MOON_PHDEG, MOON_ILLUM)
+    MOON_PHNAME = [ MOON_CURPH+1, SF.almanac.MOON_PHASES[MOON_CURPH//2] ]
+    if MOON_CURPH & 1:
+        MOON_PHNAME.append(SF.MOON_PHASEEX_NAMES[MOON_CURPH])
+    MOON_PHINFO = [
+        MOON_PHNAME,
+        round(SF.MoonAge(TIMELINES['moon_phases'], TIME_TS, TIME_ORD),3),
+        round(MOON_ILLUM*100,2),
+        SF.MoonPhaseProg(TIMELINES['moon_phases'], TIME_TS, TIME_ORD)
+    ]
+
+    for idx, site in enumerate(SITES):
+        OBSERVATIONS.append((os.path.join(site, 'earth/observer'), LOCAL_INFO))
 
         # === Sun Info ===
-        # Location from observer
-        SUN_LOC = SUN_OBSERVER(TIME_TS).altaz()
         # Rise/set from the observability perspective
-        SUN_CUROB = SUN_RISESET(TIME_TS)
+        SUN_CUROB = POS['sun_alt'][idx] > -SF.SUN_TOP_HORIZON_APPARENT
         SUN_OBINFO = [ bool(SUN_CUROB) ]
-        SUN_OBINFO += DayNightProg(TIME_DT, TIME_ORD, SUN_RISESET)
+        SUN_OBINFO += SF.DayNightProg(TIMELINES[os.path.join(site, 'sun_riseset')], TIME_TS, TIME_ORD)
         # Dawn/dusk from the civil perspective
-        SUN_CURDD = SUN_DAWNDUSK(TIME_TS)
+        SUN_CURDD = POS['sun_alt'][idx] > -SF.SUN_CIVIL_TWILIGHT
         SUN_DDINFO = [ bool(SUN_CURDD) ]
-        SUN_DDINFO += DayNightProg(TIME_DT, TIME_ORD, SUN_DAWNDUSK)
+        SUN_DDINFO += SF.DayNightProg(TIMELINES[os.path.join(site, 'sun_dawndusk')], TIME_TS, TIME_ORD)
         SUN_INFO = {
-            'position': [ round(SUN_LOC[0].degrees,2), round(SUN_LOC[1].degrees,2) ],
+            'position': [ round(POS['sun_alt'][idx],2), round(POS['sun_az'][idx],2) ],
             'observable': SUN_OBINFO,
             'civic': SUN_DDINFO
         }
-        self._publish('sun', json.dumps(SUN_INFO, cls=CusEncoder), retain=True)
+        OBSERVATIONS.append((os.path.join(site, 'sun'), SUN_INFO))
 
         # === Moon Info ===
-        MOON_CUROB = MOON_RISESET(TIME_TS)
-        MOON_OBINFO = [ bool(MOON_CUROB) ]
-        # Location from observer
-        MOON_LOC = MOON_OBSERVER(TIME_TS).altaz()
         # Rise/set from the observability perspective
-        MOON_OBINFO += MoonRiseSetProg(TIME_DT, TIME_ORD, MOON_RISESET)
-        # Phase related information
-        MOON_ILLUM = MOON_ILLUMOB(TIME_TS)
-        MOON_PHDEG = MOON_PHDEGOB(TIME_TS)
-        MOON_CURPH = MoonPhaseEx(MOON_PHDEG, MOON_ILLUM)
-        MOON_PHNAME = [ MOON_CURPH+1, almanac.MOON_PHASES[MOON_CURPH//2] ]
-        if MOON_CURPH & 1:
-            MOON_PHNAME.append(MOON_PHASEEX_NAMES[MOON_CURPH])
-        MOON_PHINFO = [
-            MOON_PHNAME,
-            round(MoonAge(TIME_TS, TIME_DT),3),
-            round(MOON_ILLUM*100,2),
-            MoonPhaseProg(TIME_DT, TIME_ORD)
-        ]
+        MOON_CUROB = POS['moon_alt'][idx] > -SF.MOON_TOP_HORIZON_APPARENT
+        MOON_OBINFO = [ bool(MOON_CUROB) ]
+        MOON_OBINFO += SF.MoonRiseSetProg(TIMELINES[os.path.join(site, 'moon_riseset')], TIME_TS, TIME_ORD)
         MOON_INFO = {
-            'position': [ round(MOON_LOC[0].degrees,2), round(MOON_LOC[1].degrees,2) ],
+            'position': [ round(POS['moon_alt'][idx],2), round(POS['moon_az'][idx],2) ],
             'observable': MOON_OBINFO,
             'phase': MOON_PHINFO
         }
-        self._publish('moon', json.dumps(MOON_INFO, cls=CusEncoder), retain=True)
+        OBSERVATIONS.append((os.path.join(site, 'moon'), MOON_INFO))
+
+        # === Almanac of the next days (rebuilt daily) ===
+        if ALMANAC_DAYS:
+            OBSERVATIONS.append((os.path.join(site, 'almanac/daily'), ALMANAC.at(unix_ts)[idx]))
+    return OBSERVATIONS
+
+# Observations of a tick, computed in the prefetch worker
+def ObserveTick(unix_ts):
+    return Observe(ASTRO.get(), unix_ts)
+
+PREFETCHER = PREFETCH and MQPubCli.TickPrefetcher(
+    os.path.dirname(os.path.abspath(__file__)), os.path.basename(__file__), 'ObserveTick',
+    deadline=getattr(Config, 'PREFETCH_DEADLINE', 1.0),
+    max_stale=getattr(Config, 'PREFETCH_MAX_STALE', 0))
+
+class MQAstroService(MQPubCli.IntervalPublisher):
+
+    def on_connected(self, unix_ts, con_count):
+        for site in SITES:
+            self._publishData(os.path.join(site, 'earth/observer/coord'), OBSERVERS[site], retain=True)
+        if PREFETCHER:
+            # Warm up the worker before the first tick
+            PREFETCHER.prefetch(unix_ts)
+
+    def on_interval(self, unix_ts):
+        if PREFETCHER:
+            observations, outcome = PREFETCHER.get(unix_ts, unix_ts + Config.INTERVAL)
+            if outcome != MQPubCli.PREFETCH_READY:
+                self._LOGGER.info("Observations %s for this tick", outcome)
+                self._STATS.count('prefetch_' + outcome)
+            if observations is None:
+                return
+        else:
+            observations = Observe(ASTRO.get(), unix_ts)
+        for sub_topic, data in observations:
+            self._publishData(sub_topic, data, retain=True)
+
+service = MQAstroService(__name__, Config.TOPIC_PFX, DRYRUN,
+                         **MQPubCli.ConfigOptions(Config, default=NumpyToPy))
 
-service = MQAstroService(__name__, Config.TOPIC_PFX, DRYRUN)
+# Publishing schedule, also used when hosted by the service host
+SCHEDULE = {
+    'interval': Config.INTERVAL,
+    'align': getattr(Config, 'ALIGN', False)
+}
 
-# Handle keyboard interruption
-def CtrlCHandler(sig, frame):
-    service.stop()
-signal.signal(signal.SIGINT, CtrlCHandler)
+if __name__ == '__main__':
+    # Handle keyboard interruption
+    def CtrlCHandler(sig, frame):
+        service.stop()
+    signal.signal(signal.SIGINT, CtrlCHandler)
 
-service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
-            Config.CACERTS, Config.INTERVAL)
+    service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
+                Config.CACERTS, **SCHEDULE)
+    if PREFETCHER:
+        PREFETCHER.close()
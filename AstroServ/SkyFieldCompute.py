@@ -1,10 +1,21 @@
+import os
+import time
+import bisect
 import logging
+import threading
 
-from numpy import cos, ndarray
+import numpy as np
+from math import floor
+from numpy import cos
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dt_time
 from skyfield import api as sf_api, almanac
 from skyfield.nutationlib import iau2000b
+from skyfield.framelib import itrs, ecliptic_frame
+from skyfield.units import Angle
+from skyfield.functions import angle_between, mxm, mxv, rot_y, rot_z
+from jplephem.spk import SPK
+from jplephem.excerpter import write_excerpt
 
 _logger = logging.getLogger(__name__)
 
@@ -16,23 +27,393 @@ UNIX_TS_OFFSET=datetime(1970,1,1).toordinal()*SECS_IN_DAY
 DAYS_IN_YEAR=365.2422
 MOON_SYNODIC_PERIOD=29.53
 
-# Load Skyfield data
+# Load Skyfield data, the engine (and ephemeris) is loaded by LoadEphemeris()
+# or LoadMeeus()
 TIMESCALE = sf_api.load.timescale()
-PLANETS = sf_api.load('de421.bsp')
-SUN = PLANETS['sun']
-MOON = PLANETS['moon']
-EARTH = PLANETS['earth']
-SEASONS = almanac.seasons(PLANETS)
+ENGINE = None
+PLANETS = None
+SUN = None
+MOON = None
+EARTH = None
+SEASONS = None
+
+# Ephemeris segments (NAIF center, target) for the Sun, Moon and Earth:
+# solar system barycenter -> Sun, Earth-Moon barycenter -> Earth, Moon;
+# and Jupiter, Saturn barycenters for the light deflection in apparent()
+EPHEMERIS_SEGMENTS = {(0, 10), (0, 3), (3, 399), (3, 301), (0, 5), (0, 6)}
+UNIX_EPOCH_JD = 2440587.5
+
+# Time range (julian dates) covered by all segments of an ephemeris file
+def EphemerisCoverage(path):
+    spk = SPK.open(path)
+    try:
+        return ( max(s.start_jd for s in spk.segments),
+                 min(s.end_jd for s in spk.segments) )
+    finally:
+        spk.close()
+
+# Write the segments needed from an ephemeris, for given time range
+# (julian dates), to a compact excerpt file
+def ExcerptEphemeris(planets, path, start_jd, end_jd):
+    summaries = [ summary for summary, segment in zip(planets.spk.daf.summaries(), planets.spk.segments)
+                  if (segment.center, segment.target) in EPHEMERIS_SEGMENTS ]
+    # Write-then-rename, so that a crash never leaves a partial file
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w+b') as f:
+        write_excerpt(planets.spk, f, start_jd, end_jd, summaries)
+    os.replace(tmp_file, path)
+
+# Load the ephemeris, and set up the bodies and the observers depending on it.
+# With a `cache` file, only an excerpt of the Sun, Moon and Earth from `days`
+# ( <before>, <after> ) today is kept, which is (re)built from the full
+# ephemeris when less than half of either is left. Ephemeris files are
+# memory-mapped, only the pages used are read.
+def LoadEphemeris(path, *, cache=None, days=(366, 1098)):
+    global ENGINE, PLANETS, SUN, MOON, EARTH
+    start = time.perf_counter()
+    # The full ephemeris is downloaded to its directory, if missing
+    load = sf_api.Loader(os.path.dirname(os.path.abspath(path)))
+    if cache:
+        now_jd = time.time() / SECS_IN_DAY + UNIX_EPOCH_JD
+        try:
+            start_jd, end_jd = EphemerisCoverage(cache)
+            if start_jd > now_jd - days[0]/2 or end_jd < now_jd + days[1]/2:
+                _logger.info("Ephemeris cache is running out, rebuilding")
+                start_jd = None
+        except FileNotFoundError:
+            start_jd = None
+        except Exception:
+            _logger.exception("Failed reading ephemeris cache, rebuilding")
+            start_jd = None
+        if start_jd is None:
+            planets = load(os.path.basename(path))
+            ExcerptEphemeris(planets, cache, now_jd - days[0], now_jd + days[1])
+            planets.close()
+        PLANETS = sf_api.load_file(cache)
+    else:
+        PLANETS = load(os.path.basename(path))
+    SUN = PLANETS['sun']
+    MOON = PLANETS['moon']
+    EARTH = PLANETS['earth']
+    ENGINE = SkyfieldEvaluation
+    _SetupObservers()
+    _logger.debug("Loaded ephemeris '%s' in %.3f sec", PLANETS.path, time.perf_counter() - start)
+
+# Load the low-precision analytic engine, which needs no ephemeris
+def LoadMeeus():
+    global ENGINE, PLANETS, SUN, MOON, EARTH
+    PLANETS = EARTH = None
+    SUN = MEEUS_SUN
+    MOON = MEEUS_MOON
+    ENGINE = MeeusEvaluation
+    _SetupObservers()
+
+# Set up the observers depending on the engine
+def _SetupObservers():
+    global SEASONS, MOON_ILLUMOB, MOON_PHDEGOB, MOON_PHASE_EVENTS
+    SEASONS = SeasonObserver()
+    MOON_ILLUMOB = ObjectIlluminationObserver(MOON)
+    MOON_PHDEGOB = ObjectPhaseDegreeObserver(MOON)
+    MOON_PHASE_EVENTS = MoonPhaseObserver()
+
+# The evaluation of given (skyfield) time by the loaded engine, attached to
+# it on first use, so that the intermediate quantities are computed once and
+# shared by all observers evaluated at the same time (e.g. a tick, or the
+# samples of a daily table)
+def Evaluate(t):
+    evaluation = t.__dict__.get('_evaluation')
+    if evaluation is None:
+        evaluation = t._evaluation = ENGINE(t)
+    return evaluation
+
+"""
+Evaluation with the ephemeris: the (low-precision) nutation, the position of
+the Earth, and the positions of bodies observed from the geocenter.
+"""
+class SkyfieldEvaluation:
+
+    def __init__(self, t):
+        t._nutation_angles = iau2000b(t.tt)
+        self.t = t
+        self._EARTH = None
+        self._ITRS_ROT = None
+        self._ASTROMETRIC = {}
+        self._APPARENT = {}
+        self._ECLIPTIC_LON = {}
+
+    def earth(self):
+        if self._EARTH is None:
+            self._EARTH = EARTH.at(self.t)
+        return self._EARTH
+
+    # Rotation from GCRS to ITRS
+    def itrsRotation(self):
+        if self._ITRS_ROT is None:
+            self._ITRS_ROT = itrs.rotation_at(self.t)
+        return self._ITRS_ROT
+
+    def astrometric(self, body):
+        astrometric = self._ASTROMETRIC.get(body)
+        if astrometric is None:
+            astrometric = self._ASTROMETRIC[body] = self.earth().observe(body)
+        return astrometric
+
+    def apparent(self, body):
+        apparent = self._APPARENT.get(body)
+        if apparent is None:
+            apparent = self._APPARENT[body] = self.astrometric(body).apparent()
+        return apparent
+
+    # Apparent ecliptic longitude (of date) in degrees
+    def eclipticLon(self, body):
+        lon = self._ECLIPTIC_LON.get(body)
+        if lon is None:
+            lon = self._ECLIPTIC_LON[body] = self.apparent(body).frame_latlon(ecliptic_frame)[1].degrees
+        return lon
+
+    # Apparent geocentric position in ITRS (AU)
+    def geoItrs(self, body):
+        return mxv(self.itrsRotation(), self.apparent(body).position.au)
+
+    # Angle between the Sun and Earth seen from the body (radians)
+    def phaseAngle(self, body):
+        pe = self.astrometric(body)
+        t2 = self.t.ts.tt_jd(self.t.tt - pe.light_time)
+        ps = body.at(t2).observe(SUN)
+        # Rotate 180 degrees to point back at Earth
+        return angle_between(-pe.position.au, ps.position.au)
+
+# Terms of the periodic series of the Moon (Meeus, table 47.A and 47.B),
+# the largest 50 / 30 of 60 each: multiples of the arguments D, M, M', F,
+# and the coefficients of longitude (1e-6 degree), distance (1e-3 km) /
+# latitude (1e-6 degree)
+MEEUS_MOON_LR = np.array([
+    (0,  0,  1,  0,  6288774, -20905355),
+    (2,  0, -1,  0,  1274027,  -3699111),
+    (2,  0,  0,  0,   658314,  -2955968),
+    (0,  0,  2,  0,   213618,   -569925),
+    (0,  1,  0,  0,  -185116,     48888),
+    (0,  0,  0,  2,  -114332,     -3149),
+    (2,  0, -2,  0,    58793,    246158),
+    (2, -1, -1,  0,    57066,   -152138),
+    (2,  0,  1,  0,    53322,   -170733),
+    (2, -1,  0,  0,    45758,   -204586),
+    (0,  1, -1,  0,   -40923,   -129620),
+    (1,  0,  0,  0,   -34720,    108743),
+    (0,  1,  1,  0,   -30383,    104755),
+    (2,  0,  0, -2,    15327,     10321),
+    (0,  0,  1,  2,   -12528,         0),
+    (0,  0,  1, -2,    10980,     79661),
+    (4,  0, -1,  0,    10675,    -34782),
+    (0,  0,  3,  0,    10034,    -23210),
+    (4,  0, -2,  0,     8548,    -21636),
+    (2,  1, -1,  0,    -7888,     24208),
+    (2,  1,  0,  0,    -6766,     30824),
+    (1,  0, -1,  0,    -5163,     -8379),
+    (1,  1,  0,  0,     4987,    -16675),
+    (2, -1,  1,  0,     4036,    -12831),
+    (2,  0,  2,  0,     3994,    -10445),
+    (4,  0,  0,  0,     3861,    -11650),
+    (2,  0, -3,  0,     3665,     14403),
+    (0,  1, -2,  0,    -2689,     -7003),
+    (2,  0, -1,  2,    -2602,         0),
+    (2, -1, -2,  0,     2390,     10056),
+    (1,  0,  1,  0,    -2348,      6322),
+    (2, -2,  0,  0,     2236,     -9884),
+    (0,  1,  2,  0,    -2120,      5751),
+    (0,  2,  0,  0,    -2069,         0),
+    (2, -2, -1,  0,     2048,     -4950),
+    (2,  0,  1, -2,    -1773,      4130),
+    (2,  0,  0,  2,    -1595,         0),
+    (4, -1, -1,  0,     1215,     -3958),
+    (0,  0,  2,  2,    -1110,         0),
+    (3,  0, -1,  0,     -892,      3258),
+    (2,  1,  1,  0,     -810,      2616),
+    (4, -1, -2,  0,      759,     -1897),
+    (0,  2, -1,  0,     -713,     -2117),
+    (2,  2, -1,  0,     -700,      2354),
+    (2,  1, -2,  0,      691,         0),
+    (2, -1,  0, -2,      596,         0),
+    (4,  0,  1,  0,      549,     -1423),
+    (0,  0,  4,  0,      537,     -1117),
+    (4, -1,  0,  0,      520,     -1571),
+    (1,  0, -2,  0,     -487,     -1739),
+], dtype=float)
+MEEUS_MOON_B = np.array([
+    (0,  0,  0,  1,  5128122),
+    (0,  0,  1,  1,   280602),
+    (0,  0,  1, -1,   277693),
+    (2,  0,  0, -1,   173237),
+    (2,  0, -1,  1,    55413),
+    (2,  0, -1, -1,    46271),
+    (2,  0,  0,  1,    32573),
+    (0,  0,  2,  1,    17198),
+    (2,  0,  1, -1,     9266),
+    (0,  0,  2, -1,     8822),
+    (2, -1,  0, -1,     8216),
+    (2,  0, -2, -1,     4324),
+    (2,  0,  1,  1,     4200),
+    (2,  1,  0, -1,    -3359),
+    (2, -1, -1,  1,     2463),
+    (2, -1,  0,  1,     2211),
+    (2, -1, -1, -1,     2065),
+    (0,  1, -1, -1,    -1870),
+    (4,  0, -1, -1,     1828),
+    (0,  1,  0,  1,    -1794),
+    (0,  0,  0,  3,    -1749),
+    (0,  1, -1,  1,    -1565),
+    (1,  0,  0,  1,    -1491),
+    (0,  1,  1,  1,    -1475),
+    (0,  1,  1, -1,    -1410),
+    (0,  1,  0, -1,    -1344),
+    (1,  0,  0, -1,    -1335),
+    (0,  0,  3,  1,     1107),
+    (4,  0,  0, -1,     1021),
+    (4,  0, -1,  1,      833),
+], dtype=float)
+
+KM_IN_AU = 149597870.7
+MEEUS_SUN = 'sun'
+MEEUS_MOON = 'moon'
+
+"""
+Evaluation with the low-precision analytic engine: closed-form positions of
+the Sun and Moon after Meeus (Astronomical Algorithms, ch. 12, 22, 25, 47,
+48), needing no ephemeris. See Bench/AstroEngineBench.py for its errors.
+"""
+class MeeusEvaluation:
+
+    def __init__(self, t):
+        self.t = t
+        T = (t.tt - 2451545.0) / 36525
+        self._T = T
+        # Nutation in longitude, and true obliquity (degrees)
+        omega = np.radians(125.04452 - 1934.136261 * T)
+        ls = np.radians(2 * (280.4665 + 36000.7698 * T))
+        lm = np.radians(2 * (218.3165 + 481267.8813 * T))
+        self._DPSI = (-17.20 * np.sin(omega) - 1.32 * np.sin(ls)
+                      - 0.23 * np.sin(lm) + 0.21 * np.sin(2 * omega)) / 3600
+        deps = (9.20 * np.cos(omega) + 0.57 * np.cos(ls)
+                + 0.10 * np.cos(lm) - 0.09 * np.cos(2 * omega)) / 3600
+        self._EPS = 23.4392911 - 0.0130042 * T + deps
+        self._OMEGA = omega
+        self._ITRS_ROT = None
+        # Apparent ecliptic coordinates: { <body>: ( <lon>, <lat>, <distance (AU)> ) }
+        self._ECLIPTIC = {}
+
+    def _sun(self):
+        T = self._T
+        L0 = 280.46646 + 36000.76983 * T + 0.0003032 * T**2
+        M = np.radians(357.52911 + 35999.05029 * T - 0.0001537 * T**2)
+        e = 0.016708634 - 0.000042037 * T - 0.0000001267 * T**2
+        C = ((1.914602 - 0.004817 * T - 0.000014 * T**2) * np.sin(M)
+             + (0.019993 - 0.000101 * T) * np.sin(2 * M) + 0.000289 * np.sin(3 * M))
+        R = 1.000001018 * (1 - e**2) / (1 + e * np.cos(M + np.radians(C)))
+        # Aberration, and nutation
+        lon = L0 + C - 0.00569 + self._DPSI
+        return lon % 360, np.zeros_like(lon), R
+
+    def _moon(self):
+        T = self._T
+        Lp = 218.3164477 + 481267.88123421 * T - 0.0015786 * T**2 + T**3 / 538841 - T**4 / 65194000
+        D = 297.8501921 + 445267.1114034 * T - 0.0018819 * T**2 + T**3 / 545868 - T**4 / 113065000
+        M = 357.5291092 + 35999.0502909 * T - 0.0001536 * T**2 + T**3 / 24490000
+        Mp = 134.9633964 + 477198.8675055 * T + 0.0087414 * T**2 + T**3 / 69699 - T**4 / 14712000
+        F = 93.2720950 + 483202.0175233 * T - 0.0036539 * T**2 - T**3 / 3526000 + T**4 / 863310000
+        A1 = np.radians(119.75 + 131.849 * T)
+        A2 = np.radians(53.09 + 479264.290 * T)
+        A3 = np.radians(313.45 + 481266.484 * T)
+        E = 1 - 0.002516 * T - 0.0000074 * T**2
+        Lp_r, Mp_r, F_r = np.radians(Lp), np.radians(Mp), np.radians(F)
+        args = np.radians(np.stack(np.broadcast_arrays(D, M, Mp, F)))
+
+        # Periodic terms by multiples of the arguments, those with M scaled
+        # by E for the decreasing eccentricity of Earth's orbit
+        def _terms(table):
+            angles = np.tensordot(table[:, :4], args, axes=1)
+            scale = np.power(E, np.abs(table[:, 1]).reshape((-1,) + (1,) * np.ndim(T)))
+            return angles, scale
+
+        angles, scale = _terms(MEEUS_MOON_LR)
+        sl = np.tensordot(MEEUS_MOON_LR[:, 4], scale * np.sin(angles), axes=1)
+        sr = np.tensordot(MEEUS_MOON_LR[:, 5], scale * np.cos(angles), axes=1)
+        angles, scale = _terms(MEEUS_MOON_B)
+        sb = np.tensordot(MEEUS_MOON_B[:, 4], scale * np.sin(angles), axes=1)
+        sl += 3958 * np.sin(A1) + 1962 * np.sin(Lp_r - F_r) + 318 * np.sin(A2)
+        sb += (-2235 * np.sin(Lp_r) + 382 * np.sin(A3) + 175 * np.sin(A1 - F_r)
+               + 175 * np.sin(A1 + F_r) + 127 * np.sin(Lp_r - Mp_r) - 115 * np.sin(Lp_r + Mp_r))
+        lon = Lp + sl / 1e6 + self._DPSI
+        return lon % 360, sb / 1e6, (385000.56 + sr / 1000) / KM_IN_AU
+
+    def ecliptic(self, body):
+        ecliptic = self._ECLIPTIC.get(body)
+        if ecliptic is None:
+            ecliptic = self._ECLIPTIC[body] = self._sun() if body == MEEUS_SUN else self._moon()
+        return ecliptic
+
+    def eclipticLon(self, body):
+        return self.ecliptic(body)[0]
+
+    # Rotation from the true equator and equinox of date to ITRS, by the
+    # apparent sidereal time (polar motion neglected)
+    def itrsRotation(self):
+        if self._ITRS_ROT is None:
+            jd = self.t.ut1 - 2451545.0
+            T = jd / 36525
+            gmst = 280.46061837 + 360.98564736629 * jd + 0.000387933 * T**2 - T**3 / 38710000
+            gast = np.radians(gmst + self._DPSI * np.cos(np.radians(self._EPS)))
+            self._ITRS_ROT = rot_z(-gast)
+        return self._ITRS_ROT
+
+    def geoItrs(self, body):
+        lon, lat, dist = (np.radians(self.ecliptic(body)[0]),
+                          np.radians(self.ecliptic(body)[1]), self.ecliptic(body)[2])
+        eps = np.radians(self._EPS)
+        x = dist * np.cos(lat) * np.cos(lon)
+        y = dist * (np.cos(lat) * np.sin(lon) * np.cos(eps) - np.sin(lat) * np.sin(eps))
+        z = dist * (np.cos(lat) * np.sin(lon) * np.sin(eps) + np.sin(lat) * np.cos(eps))
+        return mxv(self.itrsRotation(), np.array([x, y, z]))
+
+    def phaseAngle(self, body):
+        lon, lat, dist = self.ecliptic(body)
+        slon, _, sdist = self.ecliptic(MEEUS_SUN)
+        # Geocentric elongation from the Sun
+        psi = np.arccos(np.cos(np.radians(lat)) * np.cos(np.radians(lon - slon)))
+        return np.arctan2(sdist * np.sin(psi), dist - sdist * np.cos(psi))
 
 # Generalized from skyfield/almanac.py
+# (Topocentric observations are not shared with other observers)
 def PlanetObserver(planet, topos):
     topos_at = (EARTH + topos).at
 
     def _observe_at(t):
-        t._nutation_angles = iau2000b(t.tt)
+        Evaluate(t)
         return topos_at(t).observe(planet).apparent()
     return _observe_at
 
+# Observe planets from multiple sites at once: the geocentric apparent
+# positions are computed once, and the topocentric altitude/azimuth of all
+# sites derived together, as arrays indexed by site. (Differences in light
+# time and aberration between the sites and the geocenter are neglected,
+# within 0.002 degree.)
+def SitesObserver(planets, topos_list):
+    sites_xyz = np.array([ topos.itrs_xyz.au for topos in topos_list ])
+    # Rotations from ITRS to the sites' altazimuth systems
+    sites_rot = np.array([ mxm(rot_y(topos.latitude.radians)[::-1], rot_z(-topos.longitude.radians))
+                           for topos in topos_list ])
+
+    def _observe_at(t):
+        evaluation = Evaluate(t)
+        altaz = []
+        for planet in planets:
+            geo_itrs = evaluation.geoItrs(planet)
+            topo_itrs = geo_itrs[None] - sites_xyz.reshape(sites_xyz.shape + (1,)*(geo_itrs.ndim-1))
+            x, y, z = np.einsum('sij,sj...->is...', sites_rot, topo_itrs)
+            altaz.append(np.degrees(np.arctan2(z, np.hypot(x, y))))
+            altaz.append(np.degrees(np.arctan2(y, x)) % 360)
+        return altaz
+    return _observe_at
+
 # For computing sun/moon rise/set time
 SUN_TOP_HORIZON = 0.26667
 SUN_TOP_HORIZON_APPARENT = 0.8333
@@ -43,20 +424,25 @@ SUN_ASTRONOMICAL_TWILIGHT = 18.0
 MOON_TOP_HORIZON = 0.26667
 MOON_TOP_HORIZON_APPARENT = -0.125
 
-def PlanetRiseSet(observer, rough_period, degref=0.0):
+# Altitude (degrees) of a planet from a site: observed from the site with
+# the ephemeris, or derived from the geocentric position otherwise
+def PlanetAltitudeObserver(planet, topos):
+    if ENGINE is SkyfieldEvaluation:
+        observer = PlanetObserver(planet, topos)
+        return lambda t: observer(t).altaz()[0].degrees
+    observer = SitesObserver([planet], [topos])
+    return lambda t: observer(t)[0][0]
+
+def PlanetRiseSet(alt_observer, rough_period, degref=0.0):
     def _is_planet_up_at(t):
-        return observer(t).altaz()[0].degrees > -degref
+        return alt_observer(t) > -degref
     _is_planet_up_at.rough_period = rough_period
     return _is_planet_up_at
 
 # For computing moon phase info
 def ObjectPhaseAngleObserver(obj):
     def _phase_angle_at(t):
-        pe = EARTH.at(t).observe(obj)
-        pe.position.au *= -1     # rotate 180 degrees to point back at Earth
-        t2 = t.ts.tt_jd(t.tt - pe.light_time)
-        ps = obj.at(t2).observe(SUN)
-        return pe.separation_from(ps)
+        return Angle(radians=Evaluate(t).phaseAngle(obj))
     return _phase_angle_at
 
 def ObjectIlluminationObserver(obj):
@@ -68,15 +454,27 @@ def ObjectIlluminationObserver(obj):
 
 def ObjectPhaseDegreeObserver(obj):
     def _phase_degree_at(t):
-        t._nutation_angles = iau2000b(t.tt)
-        e = EARTH.at(t)
-        _, mlon, _ = e.observe(obj).apparent().ecliptic_latlon('date')
-        _, slon, _ = e.observe(SUN).apparent().ecliptic_latlon('date')
-        return (mlon.degrees - slon.degrees) % 360
+        evaluation = Evaluate(t)
+        return (evaluation.eclipticLon(obj) - evaluation.eclipticLon(SUN)) % 360
     return _phase_degree_at
 
-MOON_ILLUMOB = ObjectIlluminationObserver(MOON)
-MOON_PHDEGOB = ObjectPhaseDegreeObserver(MOON)
+# Generalized from skyfield/almanac.py, season 0 (Spring) through 3 (Winter)
+def SeasonObserver():
+    def _season_at(t):
+        return (Evaluate(t).eclipticLon(SUN) // 90 % 4).astype(int)
+    _season_at.step_days = 90.0
+    return _season_at
+
+# Generalized from skyfield/almanac.py, moon phase 0 (New Moon) through 3
+def MoonPhaseObserver():
+    def _moon_phase_at(t):
+        return (MOON_PHDEGOB(t) // 90).astype(int)
+    _moon_phase_at.step_days = 7.0
+    return _moon_phase_at
+
+# Set up by LoadEphemeris()
+MOON_ILLUMOB = None
+MOON_PHDEGOB = None
 
 # For deriving moon phase name and progression
 
@@ -109,36 +507,383 @@ def MoonPhaseEx(phdeg, illum):
                 return 4+i
         return 0
 
-def MoonPhaseCycleObserver():
-    def _moon_cycle(t):
-        phdeg = MOON_PHDEGOB(t)
-        moon_cycle = ndarray((len(t),),int)
-        for ofs in range(len(t)):
-            moon_cycle[ofs] = phdeg[ofs] >= 0 and phdeg[ofs] < 180
-        return moon_cycle
-    _moon_cycle.rough_period = MOON_SYNODIC_PERIOD // 2
-    return _moon_cycle
+# Set up by LoadEphemeris()
+MOON_PHASE_EVENTS = None
+
+"""
+Table of observed values (e.g. altitude/azimuth) over a (TT) day, evaluated
+by a single vectorized call at `step` seconds resolution, from which values
+in between are linearly interpolated. Angles (in degrees) named in
+`wrapped` are interpolated unwrapped, and wrapped to [0, 360) after.
+The next day's table is built in background during the last hour of a day.
+If `step` is None, values are evaluated at the exact time instead.
+
+`observers` are [ ( <names>, <func> ) ], where func(t) returns the values
+of the names, each an array (over the last axis) if `t` is an array of times.
+"""
+class DailyTable:
+
+    def __init__(self, observers, *, step=60, wrapped=()):
+        self._OBSERVERS = observers
+        self._STEP = step and step / SECS_IN_DAY
+        self._WRAPPED = wrapped
+        self._LOCK = threading.Lock()
+        self._WORKER = None
+        # Tables by day: { <name>: <values> }
+        self._TABLES = {}
+
+    def _evaluate(self, t):
+        values = {}
+        for names, func in self._OBSERVERS:
+            values.update(zip(names, func(t)))
+        return values
+
+    def _build(self, day):
+        start = time.perf_counter()
+        samples = round(1 / self._STEP)
+        table = self._evaluate(TIMESCALE.tt_jd(day + np.arange(samples+1) / samples))
+        for name in self._WRAPPED:
+            table[name] = np.degrees(np.unwrap(np.radians(table[name]), axis=-1))
+        _logger.debug("Built daily table in %.3f sec", time.perf_counter() - start)
+        return table
+
+    def _table(self, day):
+        table = self._TABLES.get(day)
+        if table is None:
+            with self._LOCK:
+                table = self._TABLES.get(day)
+                if table is None:
+                    table = self._build(day)
+                    # Keep the previous day's table, which is still in use
+                    # while the next day's is built ahead
+                    tables = { d: t for d, t in self._TABLES.items() if d >= day - 1 }
+                    tables[day] = table
+                    self._TABLES = tables
+        return table
+
+    # Values at given time, as { <name>: <value> }
+    def at(self, time_ts):
+        if self._STEP is None:
+            return self._evaluate(time_ts)
+        tt = time_ts.tt
+        day = floor(tt)
+        table = self._table(day)
+        if (tt - day > 1 - 1/HOURS_IN_DAY and day+1 not in self._TABLES
+                and not (self._WORKER and self._WORKER.is_alive())):
+            self._WORKER = threading.Thread(target=self._table, args=(day+1,), daemon=True)
+            self._WORKER.start()
+        pos = (tt - day) / self._STEP
+        idx = min(int(pos), next(iter(table.values())).shape[-1] - 2)
+        frac = pos - idx
+        values = {}
+        for name, samples in table.items():
+            value = samples[..., idx] + (samples[..., idx+1] - samples[..., idx]) * frac
+            values[name] = value % 360 if name in self._WRAPPED else value
+        return values
+
+"""
+Timeline of the discrete events (e.g. rise/set, phases, seasons) of an
+almanac function. Covers from `back` days before to at least `ahead` days
+after the queried times, extended by find_discrete() searches only when
+needed, so that lookups are bisects.
+"""
+class EventTimeline:
+
+    def __init__(self, func, back, ahead):
+        self._FUNC = func
+        self.BACK = back
+        self.AHEAD = ahead
+        self._LOCK = threading.Lock()
+        # ( <TT julian dates>, <UTC ordinals>, <values>, ( <start TT>, <end TT> ) )
+        # Replaced as a whole, so that lookups need no locking
+        self._DATA = ([], [], [], None)
+
+    def _search(self, start_tt, end_tt):
+        T, V = almanac.find_discrete(TIMESCALE.tt_jd(start_tt), TIMESCALE.tt_jd(end_tt), self._FUNC)
+        return T.tt.tolist(), T.toordinal().tolist(), V.tolist()
+
+    # TT julian date until which the timeline is covered
+    def coveredUntil(self):
+        span = self._DATA[3]
+        return span[1] if span else None
+
+    # Extend the timeline to cover given range (TT julian dates)
+    def cover(self, start_tt, end_tt):
+        with self._LOCK:
+            tts, ords, vals, span = self._DATA
+            if span and span[0] <= start_tt and end_tt <= span[1]:
+                return
+            if span is None or start_tt > span[1] or end_tt < span[0]:
+                tts, ords, vals = self._search(start_tt, end_tt)
+            else:
+                if start_tt < span[0]:
+                    b_tts, b_ords, b_vals = self._search(start_tt, span[0])
+                    keep = bisect.bisect_left(b_tts, tts[0]) if tts else len(b_tts)
+                    tts, ords, vals = b_tts[:keep]+tts, b_ords[:keep]+ords, b_vals[:keep]+vals
+                else:
+                    start_tt = span[0]
+                if end_tt > span[1]:
+                    a_tts, a_ords, a_vals = self._search(span[1], end_tt)
+                    skip = bisect.bisect_right(a_tts, tts[-1]) if tts else 0
+                    tts, ords, vals = tts+a_tts[skip:], ords+a_ords[skip:], vals+a_vals[skip:]
+                else:
+                    end_tt = span[1]
+            self._DATA = (tts, ords, vals, (start_tt, end_tt))
+
+    # Drop the events before given time (TT julian date)
+    def trim(self, start_tt):
+        with self._LOCK:
+            tts, ords, vals, span = self._DATA
+            if span is None or start_tt <= span[0]:
+                return
+            idx = bisect.bisect_left(tts, start_tt)
+            self._DATA = (tts[idx:], ords[idx:], vals[idx:], (start_tt, max(start_tt, span[1])))
+
+    # Find the last event before (or at, if `inclusive`) given time,
+    # returns ( <index>, <UTC ordinals>, <values>, <TT julian dates> )
+    def find(self, time_ts, time_ordinal, inclusive=True):
+        span = self._DATA[3]
+        if span is None or time_ts.tt - self.BACK < span[0] or time_ts.tt + self.AHEAD > span[1]:
+            self.cover(time_ts.tt - self.BACK, time_ts.tt + self.AHEAD)
+        tts, ords, vals, _ = self._DATA
+        bisector = bisect.bisect_right if inclusive else bisect.bisect_left
+        return bisector(ords, time_ordinal) - 1, ords, vals, tts
+
+# Mean new moon of 2000-01-06 (TT julian date), and mean lunation (days), Meeus ch. 49
+MEAN_NEW_MOON_2000 = 2451550.09766
+MEAN_LUNATION = 29.530588861
+
+# Quarters since the mean new moon of 2000, of given TT julian date
+def MeanQuarter(tt):
+    return (tt - MEAN_NEW_MOON_2000) / MEAN_LUNATION * 4
+
+"""
+Timeline of the moon phase events (0 = New Moon through 3 = Last Quarter),
+like an EventTimeline of MoonPhaseObserver(), but solved for all quarters
+at once: starting from their mean instants (within ~0.6 day of the true
+ones), by Newton's iterations of vectorized phase degree evaluations.
+Quarters are consecutive, so the table is extended by only the missing
+ones, and the last new moon is found by index.
+"""
+class LunationTable(EventTimeline):
+
+    ITERATIONS = 10
+    EPSILON = 0.001 / SECS_IN_DAY
+    RATE_STEP = 0.01
 
-MOON_PHASE_EVENTS = almanac.moon_phases(PLANETS)
-MOON_PHASE_CYCLES = MoonPhaseCycleObserver()
+    def __init__(self, back, ahead):
+        super().__init__(None, back, ahead)
+
+    # Instants of quarters `q_start` to before `q_end`, as ( <TT julian dates>,
+    # <UTC ordinals>, <moon phases> )
+    def _solve(self, q_start, q_end):
+        if q_end <= q_start:
+            return [], [], []
+        q = np.arange(q_start, q_end)
+        phases = q % 4
+        tt = MEAN_NEW_MOON_2000 + q * (MEAN_LUNATION / 4)
+        for _ in range(self.ITERATIONS):
+            # Phase degrees at the instants, and a step after for their rates
+            phdeg = MOON_PHDEGOB(TIMESCALE.tt_jd(np.concatenate((tt, tt + self.RATE_STEP))))
+            phdeg, phdeg_after = phdeg[:len(q)], phdeg[len(q):]
+            error = (phdeg - phases * 90 + 180) % 360 - 180
+            delta = error / ((phdeg_after - phdeg) % 360 / self.RATE_STEP)
+            tt = tt - delta
+            if np.abs(delta).max() < self.EPSILON:
+                break
+        return tt.tolist(), TIMESCALE.tt_jd(tt).toordinal().tolist(), phases.tolist()
+
+    def _search(self, start_tt, end_tt):
+        tts, ords, vals = self._solve(floor(MeanQuarter(start_tt)), floor(MeanQuarter(end_tt)) + 2)
+        start = bisect.bisect_right(tts, start_tt)
+        end = bisect.bisect_right(tts, end_tt)
+        return tts[start:end], ords[start:end], vals[start:end]
+
+    def cover(self, start_tt, end_tt):
+        with self._LOCK:
+            tts, ords, vals, span = self._DATA
+            if span and span[0] <= start_tt and end_tt <= span[1]:
+                return
+            # A quarter of margin each side, so that the table spans the range
+            q_start = floor(MeanQuarter(start_tt)) - 1
+            q_end = floor(MeanQuarter(end_tt)) + 3
+            q_first = round(MeanQuarter(tts[0])) if tts else None
+            if q_first is None or q_start > q_first + len(tts) or q_end < q_first:
+                tts, ords, vals = self._solve(q_start, q_end)
+            else:
+                b_tts, b_ords, b_vals = self._solve(q_start, q_first)
+                a_tts, a_ords, a_vals = self._solve(q_first + len(tts), q_end)
+                tts, ords, vals = b_tts+tts+a_tts, b_ords+ords+a_ords, b_vals+vals+a_vals
+            self._DATA = (tts, ords, vals, (tts[0], tts[-1]))
+
+"""
+A set of event timelines, extended in background to `horizon` days ahead
+when less than `refill` days (beyond what lookups need) are left, and
+saved to a file to survive restarts. The saved timelines are only used
+if the `key` (e.g. observer location) matches.
+"""
+class EventTimelines:
+
+    def __init__(self, timelines, *, path=None, key='', horizon=120, refill=30):
+        self._TIMELINES = timelines
+        self._PATH = path
+        self._KEY = key
+        self._HORIZON = horizon
+        self._REFILL = refill
+        self._WORKER = None
+
+    def __getitem__(self, name):
+        return self._TIMELINES[name]
+
+    # Start extending timelines in background, if needed
+    def refresh(self, time_ts):
+        if self._WORKER and self._WORKER.is_alive():
+            return
+        tt = time_ts.tt
+        for timeline in self._TIMELINES.values():
+            covered = timeline.coveredUntil()
+            if covered is None or covered < tt + timeline.AHEAD + self._REFILL:
+                self._WORKER = threading.Thread(target=self._extend, args=(tt,), daemon=True)
+                self._WORKER.start()
+                break
+
+    def _extend(self, tt):
+        try:
+            for name, timeline in self._TIMELINES.items():
+                covered = timeline.coveredUntil()
+                if covered is None or covered < tt + timeline.AHEAD + self._REFILL:
+                    start = time.perf_counter()
+                    timeline.cover(tt - timeline.BACK, tt + timeline.AHEAD + self._HORIZON)
+                    _logger.debug("Extended '%s' timeline in %.3f sec", name,
+                                  time.perf_counter() - start)
+                # Keep a day of margin for lookups
+                timeline.trim(tt - timeline.BACK - 1)
+            self.save()
+        except Exception:
+            _logger.exception("Failed extending event timelines")
+
+    def save(self):
+        if not self._PATH:
+            return
+        arrays = { 'key': np.array(self._KEY) }
+        for name, timeline in self._TIMELINES.items():
+            tts, ords, vals, span = timeline._DATA
+            if span is None:
+                continue
+            arrays[name+'.tt'] = np.array(tts, dtype=float)
+            arrays[name+'.ord'] = np.array(ords, dtype=float)
+            arrays[name+'.val'] = np.array(vals, dtype=int)
+            arrays[name+'.span'] = np.array(span, dtype=float)
+        # Write-then-rename, so that a crash never leaves a partial file
+        tmp_file = self._PATH + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_file, self._PATH)
+
+    def load(self):
+        if not self._PATH or not os.path.exists(self._PATH):
+            return
+        try:
+            with np.load(self._PATH) as data:
+                if str(data['key']) != self._KEY:
+                    _logger.info("Saved event timelines are for a different key, ignored")
+                    return
+                for name, timeline in self._TIMELINES.items():
+                    if name+'.span' in data:
+                        timeline._DATA = (
+                            data[name+'.tt'].tolist(), data[name+'.ord'].tolist(),
+                            data[name+'.val'].tolist(), tuple(data[name+'.span'].tolist())
+                        )
+        except Exception:
+            _logger.exception("Failed loading saved event timelines")
+
+# Local midnights (UNIX times) of `days` days from the date of given time,
+# and of the day after, in time zone `tz` (a tzinfo, None = the host's)
+def LocalMidnights(unix_ts, days, tz=None):
+    if tz is not None:
+        date = datetime.fromtimestamp(unix_ts, tz).date()
+        return [ int(datetime.combine(date + timedelta(days=day), dt_time(), tz).timestamp())
+                 for day in range(days + 1) ]
+    date = time.localtime(unix_ts)
+    # Out of range days of month are normalized, and DST is looked up
+    return [ int(time.mktime((date.tm_year, date.tm_mon, date.tm_mday + day, 0, 0, 0, 0, 0, -1)))
+             for day in range(days + 1) ]
+
+"""
+Almanac of `days` local days from today, per site: the first rise/set,
+dawn/dusk and moon rise/set events of each day, and the moon phase and
+illumination at its midnight. Days are in the time zone of each site
+(`tzs`, tzinfo or None = the host's, by default for all sites). Built once
+a day: events are looked up in the site's timelines of ( <sun rise/set>,
+<sun dawn/dusk>, <moon rise/set> ), and the moon phases of all midnights
+evaluated at once.
+
+Each day is [ <midnight UNIX time>, <sunrise>, <sunset>, <dawn>, <dusk>,
+<moonrise>, <moonset>, <moon phase index>, <illumination %> ], with the
+events in seconds since the midnight (None = no such event that day).
+"""
+class DailyAlmanac:
+
+    def __init__(self, site_timelines, days, tzs=None):
+        self._SITE_TIMELINES = site_timelines
+        self._DAYS = days
+        self._TZS = tzs or [None] * len(site_timelines)
+        # Distinct time zones, whose midnights are computed once
+        self._ZONES = list(dict.fromkeys(self._TZS))
+        # ( <first midnight of each zone>, [ <days of each site> ] )
+        self._MEMO = (None, None)
+
+    def at(self, unix_ts):
+        midnights = { tz: LocalMidnights(unix_ts, self._DAYS, tz) for tz in self._ZONES }
+        firsts = tuple(m[0] for m in midnights.values())
+        if self._MEMO[0] != firsts:
+            start = time.perf_counter()
+            self._MEMO = (firsts, self._build(midnights))
+            _logger.debug("Built almanac of %d days in %.3f sec", self._DAYS,
+                          time.perf_counter() - start)
+        return self._MEMO[1]
+
+    # Build from the midnights of each time zone
+    def _build(self, zone_midnights):
+        all_midnights = sorted(set(sum(zone_midnights.values(), [])))
+        t = TIMESCALE.utc(1970, 1, 1, 0, 0, np.array(all_midnights, dtype=float))
+        tts = dict(zip(all_midnights, t.tt.tolist()))
+        moon = { m: [ MoonPhaseEx(phdeg, illum)+1, round(float(illum)*100, 1) ]
+                 for m, phdeg, illum in zip(all_midnights, MOON_PHDEGOB(t), MOON_ILLUMOB(t)) }
+        almanac = []
+        for timelines, tz in zip(self._SITE_TIMELINES, self._TZS):
+            midnights = zone_midnights[tz]
+            bounds_tt = [ tts[m] for m in midnights ]
+            events = [ self._events(timeline, bounds_tt) for timeline in timelines ]
+            almanac.append([ [ midnights[day], *sum((e[day] for e in events), []),
+                               *moon[midnights[day]] ] for day in range(self._DAYS) ])
+        return almanac
+
+    # The first rise (1) and set (0) events of each day in a timeline
+    @staticmethod
+    def _events(timeline, bounds_tt):
+        timeline.cover(bounds_tt[0], bounds_tt[-1])
+        tts, _, vals, _ = timeline._DATA
+        days = []
+        start = bisect.bisect_left(tts, bounds_tt[0])
+        for day_start, day_end in zip(bounds_tt, bounds_tt[1:]):
+            end = bisect.bisect_left(tts, day_end)
+            first = {}
+            for idx in range(start, end):
+                first.setdefault(vals[idx], tts[idx])
+            days.append([ round((first[val] - day_start) * SECS_IN_DAY) if val in first else None
+                          for val in (1, 0) ])
+            start = end
+        return days
 
 # For computing progression of this season
-def SeasonProg(time_dt, time_ordinal):
-    QUARTER = DAYS_IN_YEAR/4
-    period_start = TIMESCALE.utc(time_dt - timedelta(days=QUARTER+1))
-    period_end = TIMESCALE.utc(time_dt + timedelta(days=QUARTER+1))
-    ST, SI = almanac.find_discrete(period_start, period_end, SEASONS)
-    ST_ORD = ST.toordinal().tolist()
-    SI_ARR = SI.tolist()
-    if len(ST_ORD) == 3:
-        if time_ordinal >= ST_ORD[1]:
-            SI_ARR.pop(0)
-            ST_ORD.pop(0)
-    if len(ST_ORD) != 2:
-        _logger.warning("Unexpected seasons lookup - expect 2 entries, got %d", len(ST_ORD))
+def SeasonProg(timeline, time_ts, time_ordinal):
+    idx, ST_ORD, SI_ARR, _ = timeline.find(time_ts, time_ordinal)
+    if idx < 0 or idx+1 >= len(ST_ORD):
+        _logger.warning("Unexpected seasons lookup - no surrounding events")
         return []
-    season_start = ST_ORD[0]
-    season_end = ST_ORD[1]
+    season_start = ST_ORD[idx]
+    season_end = ST_ORD[idx+1]
     season_length = season_end - season_start
     season_elapsed = time_ordinal - season_start
     season_remain = season_end - time_ordinal
@@ -146,33 +891,20 @@ def SeasonProg(time_dt, time_ordinal):
     return (
         round(season_elapsed,5), round(season_elapsed/season_length*100,2),
         round(season_endts,2), round(season_remain,5),
-        almanac.SEASON_EVENTS[SI_ARR[1]]
+        almanac.SEASON_EVENTS[SI_ARR[idx+1]]
     )
 
 # For computing the Sun's day/night progression
-def DayNightProg(time_dt, time_ordinal, ob_cond):
-    period_start = TIMESCALE.utc(time_dt - timedelta(days=1))
-    period_end = TIMESCALE.utc(time_dt + timedelta(days=1))
-    ST, SI = almanac.find_discrete(period_start, period_end, ob_cond)
-    ST_ORD = ST.toordinal().tolist()
-    SI_ARR = SI.tolist()
-    while len(ST_ORD) > 1:
-        if ST_ORD[1] < time_ordinal:
-            SI_ARR.pop(0)
-            ST_ORD.pop(0)
-        else:
-            break
-    if len(ST_ORD) in [0,1]:
-        # If we are near polar regions, we may have [last_raise_set] or [] or [next_raise_set]
-        # TODO: Support polar regions by expanding time period until we find the last/next event
-        pass
-    if len(ST_ORD) < 3:
-        _logger.warning("Unexpected day-night lookup - expect 3+ entries, got %d", len(ST_ORD))
+def DayNightProg(timeline, time_ts, time_ordinal):
+    idx, ST_ORD, _, _ = timeline.find(time_ts, time_ordinal, inclusive=False)
+    if idx < 0 or idx+1 >= len(ST_ORD):
+        # If we are near polar regions, there may be no rise/set within the timeline
+        _logger.warning("Unexpected day-night lookup - no surrounding events")
         return []
 
-    # Normally, we have [last_raise_set, next_set_raise, ...]
-    day_night_start = ST_ORD[0]
-    day_night_end = ST_ORD[1]
+    # The last raise/set, and the next set/raise
+    day_night_start = ST_ORD[idx]
+    day_night_end = ST_ORD[idx+1]
     day_night_length = (day_night_end - day_night_start)*HOURS_IN_DAY
     day_night_elapsed = (time_ordinal - day_night_start)*HOURS_IN_DAY
     day_night_remain = (day_night_end - time_ordinal)*HOURS_IN_DAY
@@ -183,25 +915,15 @@ def DayNightProg(time_dt, time_ordinal, ob_cond):
     )
 
 # For computing the Moon's rise/set progression
-def MoonRiseSetProg(time_dt, time_ordinal, ob_cond):
-    period_start = TIMESCALE.utc(time_dt - timedelta(days=1, hours=1))
-    period_end = TIMESCALE.utc(time_dt + timedelta(days=1, hours=1))
-    ST, SI = almanac.find_discrete(period_start, period_end, ob_cond)
-    ST_ORD = ST.toordinal().tolist()
-    SI_ARR = SI.tolist()
-    while len(ST_ORD) > 1:
-        if ST_ORD[1] < time_ordinal:
-            SI_ARR.pop(0)
-            ST_ORD.pop(0)
-        else:
-            break
-    if len(ST_ORD) < 3:
-        _logger.warning("Unexpected moon-night lookup - expect 3+ entries, got %d", len(ST_ORD))
+def MoonRiseSetProg(timeline, time_ts, time_ordinal):
+    idx, ST_ORD, _, _ = timeline.find(time_ts, time_ordinal, inclusive=False)
+    if idx < 0 or idx+1 >= len(ST_ORD):
+        _logger.warning("Unexpected moon-night lookup - no surrounding events")
         return []
 
-    # We should have [last_raise_set, next_set_raise, ...]
-    moon_night_start = ST_ORD[0]
-    moon_night_end = ST_ORD[1]
+    # The last raise/set, and the next set/raise
+    moon_night_start = ST_ORD[idx]
+    moon_night_end = ST_ORD[idx+1]
     moon_night_length = (moon_night_end - moon_night_start)*HOURS_IN_DAY
     moon_night_elapsed = (time_ordinal - moon_night_start)*HOURS_IN_DAY
     moon_night_remain = (moon_night_end - time_ordinal)*HOURS_IN_DAY
@@ -212,29 +934,24 @@ def MoonRiseSetProg(time_dt, time_ordinal, ob_cond):
     )
 
 # For computing the Moon's phase progression
-def MoonAge(time_ts, time_dt):
-    period_start = TIMESCALE.utc(time_dt - timedelta(days=(MOON_SYNODIC_PERIOD // 1)+1))
-    PT, PI = almanac.find_discrete(period_start, time_ts, MOON_PHASE_CYCLES)
-    cycle_start = PT[-1] if PI[-1] else PT[-2]
-    return time_ts-cycle_start
-
-def MoonPhaseProg(time_dt, time_ordinal):
-    QUARTER = MOON_SYNODIC_PERIOD // 4
-    period_start = TIMESCALE.utc(time_dt - timedelta(days=QUARTER+1))
-    period_end = TIMESCALE.utc(time_dt + timedelta(days=QUARTER+1))
-    PT, PI = almanac.find_discrete(period_start, period_end, MOON_PHASE_EVENTS)
-    PT_ORD = PT.toordinal().tolist()
-    PI_ARR = PI.tolist()
-    if len(PT_ORD) == 3:
-        if time_ordinal >= PT_ORD[1]:
-            PI_ARR.pop(0)
-            PT_ORD.pop(0)
-    if len(PT_ORD) != 2:
-       _logger.warning("Unexpected moon-phase lookup - expect 2 entries, got %d", len(PT_ORD))
+def MoonAge(timeline, time_ts, time_ordinal):
+    idx, _, PI_ARR, PT_TT = timeline.find(time_ts, time_ordinal)
+    # The cycle starts at the last new moon, and phases are consecutive
+    if idx >= 0:
+        idx -= PI_ARR[idx]
+    if idx < 0:
+        _logger.warning("Unexpected moon-age lookup - no cycle start")
+        return 0
+    return time_ts.tt - PT_TT[idx]
+
+def MoonPhaseProg(timeline, time_ts, time_ordinal):
+    idx, PT_ORD, PI_ARR, _ = timeline.find(time_ts, time_ordinal)
+    if idx < 0 or idx+1 >= len(PT_ORD):
+       _logger.warning("Unexpected moon-phase lookup - no surrounding events")
        return []
 
-    phase_start = PT_ORD[0]
-    phase_end = PT_ORD[1]
+    phase_start = PT_ORD[idx]
+    phase_end = PT_ORD[idx+1]
     phase_length = phase_end - phase_start
     phase_elapsed = time_ordinal - phase_start
     phase_remain = phase_end - time_ordinal
@@ -242,5 +959,5 @@ def MoonPhaseProg(time_dt, time_ordinal):
     return (
         round(phase_elapsed,3), round(phase_elapsed/phase_length*100,2),
         round(phase_endts,2), round(phase_remain,3),
-        almanac.MOON_PHASES[PI_ARR[1]]
+        almanac.MOON_PHASES[PI_ARR[idx+1]]
     )
@@ -0,0 +1,170 @@
+# Compares the low-precision analytic (Meeus) engine of AstroServ against the
+# Skyfield engine (DE421 ephemeris): speed, and the maximum errors over a
+# multi-year grid of times and a few observer sites.
+#
+# Usage: python3 AstroEngineBench.py [<options>]
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from ServiceBench import SERVICES, BENCH_DIR
+
+ASTRO_DIR = os.path.join(BENCH_DIR, SERVICES['AstroServ'][0])
+sys.path.insert(1, ASTRO_DIR)
+
+import SkyFieldCompute as SF
+
+# Observer sites: ( <latitude>, <longitude>, <elevation (m)> )
+SITES = [
+    (0.0, 0.0, 0.0),
+    (38.9058115, -77.0501575, 13.5),
+    (-33.87, 151.21, 3.0),
+    (60.17, 24.94, 10.0),
+]
+
+# Events searched over days: ( <name>, <body>, <threshold altitude> )
+RISESET_EVENTS = [
+    ('sun rise/set', 'SUN', SF.SUN_TOP_HORIZON_APPARENT),
+    ('civil dawn/dusk', 'SUN', SF.SUN_CIVIL_TWILIGHT),
+    ('moon rise/set', 'MOON', SF.MOON_TOP_HORIZON_APPARENT),
+]
+
+def LoadEngine(engine, ephemeris):
+    if engine == 'meeus':
+        SF.LoadMeeus()
+    else:
+        SF.LoadEphemeris(ephemeris)
+
+# Angular distance (degrees) between two alt/az positions
+def SkySeparation(alt1, az1, alt2, az2):
+    alt1, az1, alt2, az2 = map(np.radians, (alt1, az1, alt2, az2))
+    cos = (np.sin(alt1) * np.sin(alt2) +
+           np.cos(alt1) * np.cos(alt2) * np.cos(az1 - az2))
+    return np.degrees(np.arccos(np.clip(cos, -1, 1)))
+
+def Wrapped(delta):
+    return (delta + 180) % 360 - 180
+
+# Evaluate the positions and phase at times (TT julian dates), vectorized
+def EvaluateGrid(jd, topos_list):
+    t = SF.TIMESCALE.tt_jd(jd)
+    sun_alt, sun_az, moon_alt, moon_az = SF.SitesObserver([SF.SUN, SF.MOON], topos_list)(t)
+    return {
+        'sun_alt': sun_alt, 'sun_az': sun_az,
+        'moon_alt': moon_alt, 'moon_az': moon_az,
+        'moon_illum': SF.MOON_ILLUMOB(t), 'moon_phdeg': SF.MOON_PHDEGOB(t),
+        'season': SF.SEASONS(t),
+    }
+
+# Evaluate the positions and phase at each time, as on ticks
+def EvaluateTicks(jd, topos_list):
+    for tt in jd:
+        EvaluateGrid(tt, topos_list)
+
+# Search the rise/set events over days from each start (TT julian dates),
+# returns { <event>: [ <TT julian dates of each search> ] }
+def SearchRiseSet(starts, days, topos):
+    events = {}
+    for name, body, degref in RISESET_EVENTS:
+        func = SF.PlanetRiseSet(SF.PlanetAltitudeObserver(getattr(SF, body), topos), 0.5, degref)
+        events[name] = [ SF.almanac.find_discrete(SF.TIMESCALE.tt_jd(start),
+                                                  SF.TIMESCALE.tt_jd(start + days), func)[0].tt
+                         for start in starts ]
+    return events
+
+# Search the seasons and moon phases over the whole range
+def SearchPhases(start, end):
+    return {
+        'seasons': SF.almanac.find_discrete(SF.TIMESCALE.tt_jd(start), SF.TIMESCALE.tt_jd(end),
+                                            SF.SEASONS)[0].tt,
+        'moon phases': SF.almanac.find_discrete(SF.TIMESCALE.tt_jd(start), SF.TIMESCALE.tt_jd(end),
+                                                SF.MOON_PHASE_EVENTS)[0].tt,
+    }
+
+# Differences (seconds) of the matching event times, and the mismatches
+def EventErrors(ref, test):
+    errors, mismatches = [], 0
+    for ref_tt, test_tt in zip(ref, test):
+        if len(ref_tt) != len(test_tt):
+            # An event near the search boundary found by one engine only
+            mismatches += 1
+            continue
+        errors.extend(np.abs(np.asarray(test_tt) - ref_tt) * SF.SECS_IN_DAY)
+    return np.array(errors), mismatches
+
+def Timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def Main():
+    parser = argparse.ArgumentParser(description="Compare AstroServ engines")
+    parser.add_argument('--years', type=int, nargs=2, default=(2000, 2040),
+                        metavar=('FROM', 'TO'), help="range of years compared")
+    parser.add_argument('--samples', type=int, default=20000,
+                        help="times in the grid of positions")
+    parser.add_argument('--ticks', type=int, default=200,
+                        help="times evaluated one at a time, as on ticks")
+    parser.add_argument('--days', type=int, default=60,
+                        help="days searched for rise/set events")
+    parser.add_argument('--ephemeris', default=os.path.join(ASTRO_DIR, '__deploy__', 'de421.bsp'),
+                        help="ephemeris of the Skyfield engine")
+    args = parser.parse_args()
+
+    start = SF.TIMESCALE.utc(args.years[0]).tt
+    end = SF.TIMESCALE.utc(args.years[1]).tt
+    rng = np.random.default_rng(0)
+    grid = np.sort(rng.uniform(start, end, args.samples))
+    ticks = rng.uniform(start, end, args.ticks)
+    starts = np.sort(rng.uniform(start, end - 1, args.days))
+    topos_list = [ SF.sf_api.Topos(latitude_degrees=lat, longitude_degrees=lon, elevation_m=alt)
+                   for lat, lon, alt in SITES ]
+
+    results, timings = {}, {}
+    for engine in ('skyfield', 'meeus'):
+        LoadEngine(engine, args.ephemeris)
+        r = results[engine] = {}
+        t = timings[engine] = {}
+        r['grid'], t['positions grid'] = Timed(EvaluateGrid, grid, topos_list)
+        _, t['ticks'] = Timed(EvaluateTicks, ticks, topos_list)
+        r['riseset'], t['rise/set days'] = Timed(SearchRiseSet, starts, 1, topos_list[1])
+        r['phases'], t['seasons, phases'] = Timed(SearchPhases, start, end)
+
+    ref, test = results['skyfield'], results['meeus']
+    print("Errors of meeus against skyfield, %d-%d (%d sites):" % (*args.years, len(SITES)))
+    print("%-20s %10s %10s" % ('quantity', 'max', 'p99'))
+    errors = {
+        'sun alt (deg)': test['grid']['sun_alt'] - ref['grid']['sun_alt'],
+        'sun sky (deg)': SkySeparation(ref['grid']['sun_alt'], ref['grid']['sun_az'],
+                                       test['grid']['sun_alt'], test['grid']['sun_az']),
+        'moon alt (deg)': test['grid']['moon_alt'] - ref['grid']['moon_alt'],
+        'moon sky (deg)': SkySeparation(ref['grid']['moon_alt'], ref['grid']['moon_az'],
+                                        test['grid']['moon_alt'], test['grid']['moon_az']),
+        'moon illum (%)': (test['grid']['moon_illum'] - ref['grid']['moon_illum']) * 100,
+        'moon phase (deg)': Wrapped(test['grid']['moon_phdeg'] - ref['grid']['moon_phdeg']),
+    }
+    for name, error in errors.items():
+        error = np.abs(error)
+        print("%-20s %10.4f %10.4f" % (name, error.max(), np.percentile(error, 99)))
+    mismatched = np.count_nonzero(test['grid']['season'] != ref['grid']['season'])
+    print("%-20s %10d %10s" % ('season (mismatch)', mismatched, ''))
+    for group in ('riseset', 'phases'):
+        for name in ref[group]:
+            ref_events = ref[group][name] if group == 'riseset' else [ref[group][name]]
+            test_events = test[group][name] if group == 'riseset' else [test[group][name]]
+            error, mismatches = EventErrors(ref_events, test_events)
+            print("%-20s %10.1f %10.1f%s" % (name + ' (s)', error.max(), np.percentile(error, 99),
+                                             "  (%d mismatched)" % mismatches if mismatches else ''))
+
+    print()
+    print("%-20s %12s %12s %8s" % ('scenario', 'skyfield ms', 'meeus ms', 'speedup'))
+    for name in timings['skyfield']:
+        sky, meeus = timings['skyfield'][name], timings['meeus'][name]
+        print("%-20s %12.1f %12.1f %7.1fx" % (name, sky, meeus, sky / meeus))
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,130 @@
+# Profile of the Skyfield calls made by AstroServ: counts the evaluations of
+# nutation, Earth's position, and observed/apparent positions, per scenario.
+# With --baseline, also counts them without the evaluation of each time
+# shared by the observers, side by side.
+#
+# Usage: python3 AstroProfile.py [--days <timeline days>] [--baseline]
+
+import os
+import sys
+import time
+import inspect
+import argparse
+import contextlib
+
+from common import MQPubHost
+
+from ServiceBench import SERVICES, BENCH_DIR
+
+# Counted calls: ( <label>, <module or class>, <attribute> )
+COUNTED = [
+    ('nutation', 'SkyFieldCompute', 'iau2000b'),
+    ('nutation', 'skyfield.almanac', 'iau2000b_radians'),
+    ('earth_at', 'skyfield.vectorlib', 'VectorSum.at'),
+    ('observe', 'skyfield.positionlib', 'Barycentric.observe'),
+    ('apparent', 'skyfield.positionlib', 'Astrometric.apparent'),
+    ('itrs_rot', 'skyfield.framelib', 'itrs.rotation_at'),
+]
+
+"""
+Counts the calls of the functions in COUNTED, from all threads
+"""
+class CallCounter:
+
+    def __init__(self):
+        self.counts = {}
+        for label, mod_name, attr in COUNTED:
+            owner = sys.modules[mod_name]
+            *path, name = attr.split('.')
+            for part in path:
+                owner = getattr(owner, part)
+            if isinstance(owner, type) or not path:
+                self._wrap(owner, name, label, attr == 'VectorSum.at')
+            else:
+                # Method of an instance, patched on its class
+                self._wrap(type(owner), name, label, False)
+
+    # With `earth_only`, only count the calls on (sums of vectors to) Earth
+    def _wrap(self, owner, name, label, earth_only):
+        func = getattr(owner, name)
+        def _counted(*args, **kwargs):
+            if not earth_only or args[0].target == 399:
+                self.counts[label] = self.counts.get(label, 0) + 1
+            return func(*args, **kwargs)
+        if isinstance(inspect.getattr_static(owner, name), staticmethod):
+            _counted = staticmethod(_counted)
+        setattr(owner, name, _counted)
+
+    def measure(self, func):
+        self.counts = {}
+        start = time.perf_counter()
+        func()
+        return dict(self.counts, ms=(time.perf_counter() - start) * 1000)
+
+# Evaluate each time anew on every observer call, and attach nothing to it
+# for the other observers, as before the evaluations were shared
+@contextlib.contextmanager
+def Unshared(SF):
+    evaluate = SF.Evaluate
+    SF.Evaluate = lambda t: SF.ENGINE(t)
+    try:
+        yield
+    finally:
+        SF.Evaluate = evaluate
+
+def Main():
+    parser = argparse.ArgumentParser(description="Profile AstroServ Skyfield calls")
+    parser.add_argument('--days', type=float, default=30,
+                        help="days of event timelines searched")
+    parser.add_argument('--baseline', action='store_true',
+                        help="also count the calls without shared evaluations, side by side")
+    args = parser.parse_args()
+
+    svc_dir, script = SERVICES['AstroServ']
+    module = MQPubHost.LoadService(os.path.join(BENCH_DIR, svc_dir), script)
+    astro = module.ASTRO.get()
+    SF, POSITIONS, TIMELINES, ALMANAC = astro
+    counter = CallCounter()
+    now = time.time()
+    tt = SF.TIMESCALE.now().tt
+
+    def _exactTick():
+        step = POSITIONS._STEP
+        POSITIONS._STEP = None
+        try:
+            module.Observe(astro, now)
+        finally:
+            POSITIONS._STEP = step
+
+    scenarios = {
+        'tick (table)': lambda: module.Observe(astro, now),
+        'tick (exact)': _exactTick,
+        'daily table': lambda: POSITIONS._build(int(tt)),
+        'daily almanac': lambda: ALMANAC._build({ tz: SF.LocalMidnights(now, 7, tz)
+                                                  for tz in ALMANAC._ZONES }),
+    }
+    for name, timeline in TIMELINES._TIMELINES.items():
+        scenarios['timeline %s' % name] = (lambda t=timeline: t._search(tt, tt + args.days))
+
+    labels = sorted(set(c[0] for c in COUNTED))
+    if args.baseline:
+        # Columns of ( <baseline>, <current> ) of each count
+        print(("%-28s" + " %19s" * (len(labels) + 1)) % ('', *labels, 'ms'))
+        print(("%-28s" + " %9s %9s" * (len(labels) + 1)) %
+              ('scenario', *(('base', 'now') * (len(labels) + 1))))
+    else:
+        print(("%-28s" + " %9s" * (len(labels) + 1)) % ('scenario', *labels, 'ms'))
+    for name, func in scenarios.items():
+        counts = counter.measure(func)
+        if args.baseline:
+            with Unshared(SF):
+                base = counter.measure(func)
+            print(("%-28s" + " %9d %9d" * len(labels) + " %9.1f %9.1f") %
+                  (name, *sum(((base.get(l, 0), counts.get(l, 0)) for l in labels), ()),
+                   base['ms'], counts['ms']))
+        else:
+            print(("%-28s" + " %9d" * len(labels) + " %9.1f") %
+                  (name, *(counts.get(l, 0) for l in labels), counts['ms']))
+
+if __name__ == '__main__':
+    sys.exit(Main())
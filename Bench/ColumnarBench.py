@@ -0,0 +1,76 @@
+# Compare payload size and encoding time of the columnar encoding of the
+# WeatherServ forecasts against their digests as published (JSON, with and
+# without float quantization), on the fixture. The fixture data are synthetic
+# and vary linearly, so the delta columns compress them better than they
+# would live data.
+#
+# Usage: python3 ColumnarBench.py [--repeat <count>] [--precision <digits>]
+
+import os
+import sys
+import json
+import zlib
+import timeit
+import argparse
+
+from common import MQPubCli
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+sys.path.insert(1, os.path.join(BENCH_DIR, '../WeatherServ'))
+
+from DarkSkyObserver import ColumnarPayloadEncoder, SeriesFromColumns, ArrayExpand
+
+TOPICS = {
+    'forecast/minutely': 'minutely',
+    'forecast/hourly': 'hourly',
+    'forecast/daily': 'daily',
+}
+
+def Encodings(precision):
+    topics = dict.fromkeys(TOPICS, precision)
+    json_enc = MQPubCli.JSONPayloadEncoder()
+    return [
+        ('json', lambda topic, data: json_enc.encode(topic, data)),
+        ('json/q', lambda topic, data: json_enc.encode(topic, MQPubCli.QuantizeFloats(data, precision))),
+        ('cols', ColumnarPayloadEncoder(dict.fromkeys(TOPICS)).encode),
+        ('cols/q', ColumnarPayloadEncoder(topics).encode),
+    ]
+
+# Check the columnar encoding decodes to the (quantized) entries
+def Verify(topic, data, payload, precision):
+    _, _, length, columns = json.loads(payload)
+    expected = json.loads(json.dumps(MQPubCli.QuantizeFloats(ArrayExpand(data[2]), precision)))
+    return SeriesFromColumns(length, columns) == expected
+
+def Bench(records, repeat, precision):
+    print("%-18s %-8s %8s %7s %8s %7s %10s" %
+          ('topic', 'encoding', 'bytes', 'ratio', 'deflate', 'ratio', 'usec/enc'))
+    for topic, name in TOPICS.items():
+        base = None
+        for encoding, encode in Encodings(precision):
+            size = packed = usec = 0
+            for record in records:
+                data = record[name]
+                payload = encode(topic, data).encode('utf-8')
+                if encoding.startswith('cols') and not Verify(topic, data, payload,
+                                                               precision if encoding == 'cols/q' else None):
+                    print("%s: %s does not decode to the digest!" % (topic, encoding))
+                size += len(payload)
+                packed += len(zlib.compress(payload))
+                usec += timeit.timeit(lambda: encode(topic, data), number=repeat) / repeat * 1e6
+            size, packed, usec = (v / len(records) for v in (size, packed, usec))
+            if base is None:
+                base = (size, packed)
+            print("%-18s %-8s %8d %6.0f%% %8d %6.0f%% %10.1f" %
+                  (topic, encoding, size, size / base[0] * 100, packed, packed / base[1] * 100, usec))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the columnar forecast encoding")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--precision', type=int, default=1,
+                        help="decimal digits of quantized floats")
+    args = parser.parse_args()
+    with open(os.path.join(FIXTURE_DIR, 'WeatherServ.json')) as f:
+        records = json.load(f)
+    Bench(records, args.repeat, args.precision)
@@ -0,0 +1,123 @@
+# Compare payload size and encoding time of the payload encodings,
+# using sample messages of each service.
+#
+# Usage: python3 EncoderBench.py [<repeat count>]
+
+import sys
+import timeit
+
+from common import MQPubCli
+
+HOURLY_ITEM = {"@": "Partly Cloudy", "H": [66, 45.7], "W": [[301, "WNW"], 6.65, 15.74],
+               "E": [50, 10, 390.8, 0], "T": [57.06, 57.06], "P": [1013.6, [0, "-", 0]]}
+DAILY_ITEM = {"@": "Light rain in the morning.", "H": [75, 47.44],
+              "W": [[326, "NW"], 8.25, [23.82, 1619382780]],
+              "E": [77, 9.013, 373.9, [5, 1619373600]],
+              "T": [[66.71, 1619385600], [66.21, 1619385600], [40.67, 1619434560], [35.52, 1619434620]],
+              "P": [1009.1, [0.97, "rain", 0.0141, [0.1292, 1619323200]]]}
+
+def _vary(item, i):
+    # Perturb float values, so that entries are not all identical
+    if isinstance(item, float):
+        return item + i * 0.37
+    if isinstance(item, dict):
+        return {k: _vary(v, i) for k, v in item.items()}
+    if isinstance(item, list):
+        return [_vary(v, i) for v in item]
+    return item
+
+# Sample messages, as published (see the README of each service)
+SAMPLES = {
+    'TimeServ': {
+        'UTC': [2021, 3, 9, 19, 10, 44, 1, 68],
+        'Local': [2021, 3, 9, 12, 10, 44, 1, 68, False],
+        'Lunar': [[2021, 3, 10, 3, 10, 44, 1, 68], [2021, 1, False, 27],
+                  [[[3, "惊蛰", "awakening of insects"], 5],
+                   [[4, "春分", "vernal equinox"], 10]]],
+    },
+    'AstroServ': {
+        'earth/observer': {"time": ["2021-03-11T05:49:38Z", "1615441777.673"],
+                           "season": [[4, "Winter"], 79.8245, 89.71, 1616233048.52, 9.15823, "Vernal Equinox"]},
+        'sun': {"position": [-54.0, 13.41], "observable": [False, 6.652, 54.32, 1615461916.16, 5.594],
+                "civic": [False, 6.208, 54.65, 1615460323.25, 5.152]},
+        'moon': {"position": [-56.59, 59.61], "observable": [False, 9.522, 64.78, 1615460415.51, 5.177],
+                 "phase": [[8, "Last Quarter", "Waning Crescent"], 27.447, 5.11,
+                           [5.18, 70.3, 1615630869.72, 2.189, "New Moon"]]},
+    },
+    'WeatherServ': {
+        'current': {"@": "Partly Cloudy", "H": [66, 44.62], "W": [[316, "NW"], 7.57, 18.07],
+                    "E": [40, 10, 391, 0], "T": [55.97, 55.97], "P": [1014.2, [0, "-", 0], 34]},
+        'forecast/minutely': ["Partly cloudy for the hour.", [1619404740, 1619408340],
+                              [["RLE", 61, [0, "-", 0]]]],
+        'forecast/hourly': ["Clear throughout the day.", [1619402400, 1619575200],
+                            [_vary(HOURLY_ITEM, i) for i in range(48)]],
+        'forecast/daily': ["Rain today through Friday.", [1619323200, 1619928000],
+                           [_vary(DAILY_ITEM, i) for i in range(8)]],
+    },
+}
+
+# Float precision used by the quantized encodings
+PRECISION = {
+    'earth/observer': { 'season': 2 },
+    'sun': 1,
+    'moon': 1,
+    'current': 1,
+    'forecast/hourly': 1,
+    'forecast/daily': 1,
+}
+
+# Fixed layouts for the struct encoding
+STRUCT_LAYOUTS = {
+    'UTC': ('<H6BH', [(i,) for i in range(8)]),
+    'Local': ('<H6BH?', [(i,) for i in range(9)]),
+    'sun': ('<2e?fd?fd', [('position', 0), ('position', 1),
+                          ('observable', 0), ('observable', 2), ('observable', 3),
+                          ('civic', 0), ('civic', 2), ('civic', 3)]),
+    'moon': ('<2e?fdBff', [('position', 0), ('position', 1),
+                           ('observable', 0), ('observable', 2), ('observable', 3),
+                           ('phase', 0, 0), ('phase', 1), ('phase', 2)]),
+}
+
+def Encoders():
+    encoders = [ ('json', MQPubCli.JSONPayloadEncoder(), False) ]
+    encoders.append(('json/q', MQPubCli.JSONPayloadEncoder(), True))
+    if MQPubCli.msgpack:
+        encoders.append(('msgpack', MQPubCli.MsgPackPayloadEncoder(), False))
+        encoders.append(('msgpack/q', MQPubCli.MsgPackPayloadEncoder(), True))
+    if MQPubCli.cbor2:
+        encoders.append(('cbor', MQPubCli.CBORPayloadEncoder(), False))
+        encoders.append(('cbor/q', MQPubCli.CBORPayloadEncoder(), True))
+    encoders.append(('struct', MQPubCli.StructPayloadEncoder(STRUCT_LAYOUTS), False))
+    return encoders
+
+def Bench(repeat):
+    print("%-12s %-18s %-12s %8s %7s %10s" %
+          ('service', 'topic', 'encoding', 'bytes', 'ratio', 'usec/enc'))
+    totals = {}
+    for service, topics in SAMPLES.items():
+        for topic, data in topics.items():
+            base_size = None
+            for name, encoder, quantize in Encoders():
+                def _encode():
+                    value = MQPubCli.QuantizeFloats(data, PRECISION.get(topic)) if quantize else data
+                    return encoder.encode(topic, value)
+                payload = _encode()
+                if payload is None:
+                    continue
+                size = len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+                if base_size is None:
+                    base_size = size
+                usec = timeit.timeit(_encode, number=repeat) / repeat * 1e6
+                print("%-12s %-18s %-12s %8d %6.0f%% %10.2f" %
+                      (service, topic, name, size, size / base_size * 100, usec))
+                total = totals.setdefault(name, [0, 0, 0.0])
+                total[0] += base_size
+                total[1] += size
+                total[2] += usec
+    print()
+    for name, (base_size, size, usec) in totals.items():
+        print("%-31s %-12s %8d %6.0f%% %10.2f" %
+              ('(all applicable topics)', name, size, size / base_size * 100, usec))
+
+if __name__ == '__main__':
+    Bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,131 @@
+# In-process stand-in of an MQTT broker, for benchmarking the services
+# without network and server overheads.
+
+import queue
+import logging
+import threading
+import paho.mqtt.client as mqtt
+
+_logger = logging.getLogger(__name__)
+
+"""
+A client that mimics the subset of paho-mqtt Client API used by the
+publishers, connected to an in-process broker. Callbacks are invoked from
+a loop thread, like the paho network thread; messages are acknowledged
+and routed to matching subscriptions as soon as the loop gets to them.
+"""
+class FakeClient:
+
+    def __init__(self):
+        self._QUEUE = queue.Queue()
+        self._THREAD = None
+        self._LOCK = threading.Lock()
+        self._MID = 0
+        # Subscriptions { <topic filter>: <qos> }, and retained messages
+        self._SUBS = {}
+        self._RETAINED = {}
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_subscribe = None
+        self.on_publish = None
+
+    # Connection settings are accepted and ignored
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def max_queued_messages_set(self, queue_size):
+        pass
+
+    def connect_async(self, host, port=1883, *args, **kwargs):
+        pass
+
+    def loop_start(self):
+        self._THREAD = threading.Thread(target=self._loop, daemon=True)
+        self._THREAD.start()
+        self._post(self.on_connect, self, None, {}, 0)
+
+    def loop_stop(self):
+        if self._THREAD:
+            self._QUEUE.put(None)
+            self._THREAD.join()
+            self._THREAD = None
+
+    def disconnect(self):
+        if self._THREAD:
+            self._post(self.on_disconnect, self, None, 0)
+        elif self.on_disconnect:
+            self.on_disconnect(self, None, 0)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        mid = self._nextMid()
+        message = self._message(mid, topic, payload, qos, retain)
+        if retain:
+            self._RETAINED[topic] = message
+        self._post(self._route, message)
+        self._post(self.on_publish, self, None, mid)
+        return mqtt.MQTTMessageInfo(mid)
+
+    def subscribe(self, topic, qos=0):
+        mid = self._nextMid()
+        self._SUBS[topic] = qos
+        self._post(self.on_subscribe, self, None, mid, (qos,))
+        for message in list(self._RETAINED.values()):
+            if mqtt.topic_matches_sub(topic, message.topic):
+                self._post(self.on_message, self, None, message)
+        return (mqtt.MQTT_ERR_SUCCESS, mid)
+
+    # Publish a message from another (simulated) client
+    def inject(self, topic, payload, qos=0, retain=False):
+        self._post(self._route, self._message(0, topic, payload, qos, retain))
+
+    # Wait until all pending callbacks are done
+    def wait_idle(self):
+        self._QUEUE.join()
+
+    def _nextMid(self):
+        with self._LOCK:
+            self._MID = self._MID % 65535 + 1
+            return self._MID
+
+    def _message(self, mid, topic, payload, qos, retain):
+        if payload is None:
+            payload = b''
+        elif isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode('ascii')
+        message = mqtt.MQTTMessage(mid, topic.encode('utf-8'))
+        message.payload = bytes(payload)
+        message.qos = qos
+        message.retain = retain
+        return message
+
+    def _route(self, message):
+        for sub in self._SUBS:
+            if mqtt.topic_matches_sub(sub, message.topic):
+                self.on_message(self, None, message)
+                break
+
+    def _post(self, func, *args):
+        if func:
+            self._QUEUE.put((func, args))
+
+    def _loop(self):
+        while True:
+            item = self._QUEUE.get()
+            try:
+                if item is None:
+                    break
+                func, args = item
+                func(*args)
+            except Exception:
+                _logger.exception("Callback failed")
+            finally:
+                self._QUEUE.task_done()
@@ -0,0 +1,404 @@
+# End-to-end benchmark of the services, publishing to an in-process fake
+# MQTT broker (or a local mosquitto server), with accelerated time.
+#
+# Usage: python3 ServiceBench.py [<options>] [<service> ...]
+#        python3 ServiceBench.py --record <count> WeatherServ
+
+import os
+import sys
+import json
+import time
+import importlib.util
+import socket
+import shutil
+import argparse
+import tracemalloc
+import subprocess
+import paho.mqtt.client as mqtt
+
+from common import MQPubCli, MQPubHost
+
+import FakeBroker
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+# Benchmarked services: ( <service directory>, <service script> )
+SERVICES = {
+    'TimeServ': ('../TimeServ', 'MQTimeService.py'),
+    'AstroServ': ('../AstroServ', 'MQAstroService.py'),
+    'WeatherServ': ('../WeatherServ', 'MQWeatherService.py'),
+    'Transcriber': ('../Transcriber', 'MQTranscriber.py'),
+}
+
+# Metrics compared against a baseline (higher is worse), with the absolute
+# values under which changes are dominated by noise
+METRICS = {
+    'cpu_ms': 0.05,
+    'cpu_ms_p95': 0.05,
+    'blocks': 64,
+    'peak_kb': 16,
+    'messages': 1,
+    'bytes': 16,
+    'latency_ms': 0.05,
+}
+
+"""
+Accelerated time: skews time.time() and time.monotonic() forward, so that
+ticks run back to back while the services observe the interval passing.
+"""
+class VirtualClock:
+
+    def __init__(self, start=None):
+        self._TIME = time.time
+        self._MONOTONIC = time.monotonic
+        self._SKEW = 0 if start is None else start - time.time()
+
+    def advance(self, seconds):
+        self._SKEW += seconds
+
+    def __enter__(self):
+        time.time = lambda: self._TIME() + self._SKEW
+        time.monotonic = lambda: self._MONOTONIC() + self._SKEW
+        return self
+
+    def __exit__(self, *exc):
+        time.time = self._TIME
+        time.monotonic = self._MONOTONIC
+
+"""
+Broker of the benchmark: a fake in-process one, or a local mosquitto server
+"""
+class FakeBenchBroker:
+    name = 'fake'
+
+    def client(self):
+        self._CLIENT = FakeBroker.FakeClient()
+        return self._CLIENT
+
+    def inject(self, topic, payload, qos):
+        self._CLIENT.inject(topic, payload, qos)
+
+    def wait_idle(self, service, delivered):
+        self._CLIENT.wait_idle()
+
+    def close(self):
+        pass
+
+class MosquittoBenchBroker:
+    name = 'mosquitto'
+
+    def __init__(self):
+        binary = shutil.which('mosquitto')
+        if not binary:
+            raise Exception("No 'mosquitto' binary found in PATH")
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self._PORT = sock.getsockname()[1]
+        self._PROC = subprocess.Popen([binary, '-p', str(self._PORT)],
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+        self._INJECTOR = mqtt.Client()
+        self._waitFor(lambda: self._INJECTOR.connect('127.0.0.1', self._PORT) == 0,
+                      "mosquitto to start", ConnectionRefusedError)
+        self._INJECTOR.loop_start()
+
+    def _waitFor(self, cond, what, *errors, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if cond():
+                    return
+            except errors:
+                pass
+            time.sleep(0.01)
+        raise Exception("Timed out waiting for %s" % what)
+
+    def client(self):
+        client = mqtt.Client()
+        client.connect_async('127.0.0.1', self._PORT)
+        return client
+
+    def inject(self, topic, payload, qos):
+        self._INJECTOR.publish(topic, payload, qos)
+
+    def wait_idle(self, service, delivered):
+        self._waitFor(lambda: (service._STATS.snapshot()['inflight'] == 0
+                               and delivered[0] >= delivered[1]),
+                      "messages to be delivered")
+
+    def close(self):
+        self._INJECTOR.loop_stop()
+        self._INJECTOR.disconnect()
+        self._PROC.terminate()
+        self._PROC.wait()
+
+"""
+Replays the weather feed data of the fixture, in place of the weather feed.
+Each snapshot is the next record, freshly refreshed.
+"""
+class FixtureFeed:
+
+    def __init__(self, records):
+        self._RECORDS = records
+        self._INDEX = -1
+        self._DATA = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def failures(self):
+        return 0
+
+    def snapshot(self, wait=0):
+        self.refresh()
+        return self._DATA, 0
+
+    def refresh(self):
+        self._INDEX = (self._INDEX + 1) % len(self._RECORDS)
+        self._DATA = self._RECORDS[self._INDEX]
+        return self.stamp()
+
+    def stamp(self):
+        return self._DATA['stamp']
+
+    def current_condition(self):
+        return self._DATA['current']
+
+    def minutely_forecast(self):
+        return self._DATA['minutely']
+
+    def hourly_forecast(self):
+        return self._DATA['hourly']
+
+    def daily_forecast(self):
+        return self._DATA['daily']
+
+    def alerts(self):
+        return self._DATA['alerts']
+
+FEED_METHODS = {
+    'stamp': 'refresh',
+    'current': 'current_condition',
+    'minutely': 'minutely_forecast',
+    'hourly': 'hourly_forecast',
+    'daily': 'daily_forecast',
+    'alerts': 'alerts',
+}
+
+def LoadWeatherServ(svc_dir, script):
+    with open(os.path.join(FIXTURE_DIR, 'WeatherServ.json')) as f:
+        records = json.load(f)
+    # Stand in for the weather feed while loading the service, keeping the
+    # rest of its module
+    spec = importlib.util.spec_from_file_location(
+        'DarkSkyObserver', os.path.join(os.path.abspath(svc_dir), 'DarkSkyObserver.py'))
+    feed_mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(feed_mod)
+    feed_mod.Feed = lambda provider, **kwargs: FixtureFeed(records)
+    saved_mod = sys.modules.get('DarkSkyObserver')
+    sys.modules['DarkSkyObserver'] = feed_mod
+    try:
+        return MQPubHost.LoadService(svc_dir, script)
+    finally:
+        if saved_mod is None:
+            del sys.modules['DarkSkyObserver']
+        else:
+            sys.modules['DarkSkyObserver'] = saved_mod
+
+# Record the live weather feed data as the fixture
+def RecordWeatherServ(count, interval):
+    svc_dir, script = SERVICES['WeatherServ']
+    module = MQPubHost.LoadService(os.path.join(BENCH_DIR, svc_dir), script)
+    records = []
+    for i in range(count):
+        if i:
+            time.sleep(interval)
+        records.append({key: getattr(module.WEATHER_FEED, method)()
+                        for key, method in FEED_METHODS.items()})
+        print("Recorded %d/%d" % (i + 1, count))
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(os.path.join(FIXTURE_DIR, 'WeatherServ.json'), 'w') as f:
+        json.dump(records, f, indent=1)
+
+# Synthetic message storm on the subscribed topics
+def MessageStorm(service, tick, size):
+    topics = []
+    for topic, _ in service._SUB_PAIRS or []:
+        if topic.endswith('#'):
+            topics.extend(topic[:-1] + 'storm/%d' % i for i in range(8))
+        else:
+            topics.append(topic)
+    for i in range(size):
+        payload = json.dumps({'val': i, 'tick': tick, 'ts': time.time()})
+        yield topics[i % len(topics)], payload
+
+def Percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+# Run a service for given ticks, and collect per-tick metrics
+def BenchService(name, broker, args):
+    svc_dir, script = SERVICES[name]
+    svc_dir = os.path.join(BENCH_DIR, svc_dir)
+    loader = LoadWeatherServ if name == 'WeatherServ' else MQPubHost.LoadService
+    module = loader(svc_dir, script)
+    service = module.service
+    interval = module.SCHEDULE['interval']
+
+    # Count the messages delivered to the service: [ <delivered>, <injected> ]
+    delivered = [0, 0]
+    on_message = service.on_message
+    def _countMessage(client, userdata, message):
+        on_message(client, userdata, message)
+        delivered[0] += 1
+    service.on_message = _countMessage
+
+    ticks = []
+    with VirtualClock(args.start) as clock:
+        MQPubCli.IntervalPublisher._PUBCLI = broker.client()
+        service._setup(None, None, None)
+        service._reset()
+        service._PUBCLI.loop_start()
+        deadline = time.monotonic() + 10
+        while not service._CONNECTED and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if not service._CONNECTED:
+            raise Exception("Service '%s' failed to connect" % name)
+        broker.wait_idle(service, delivered)
+
+        for tick in range(args.ticks):
+            clock.advance(interval)
+            before = service._STATS.snapshot()
+            if args.trace_malloc:
+                tracemalloc.reset_peak()
+            blocks = sys.getallocatedblocks()
+            cpu = time.process_time()
+
+            if name == 'Transcriber':
+                for topic, payload in MessageStorm(service, tick, args.storm):
+                    broker.inject(topic, payload, 0)
+                    delivered[1] += 1
+            service._tick(1, interval)
+            broker.wait_idle(service, delivered)
+
+            cpu = time.process_time() - cpu
+            blocks = sys.getallocatedblocks() - blocks
+            after = service._STATS.snapshot()
+            ticks.append({
+                'cpu_ms': cpu * 1000,
+                'blocks': blocks,
+                'peak_kb': tracemalloc.get_traced_memory()[1] / 1024 if args.trace_malloc else None,
+                'messages': sum(e[0] for e in after['topics'].values()) -
+                            sum(e[0] for e in before['topics'].values()),
+                'bytes': sum(e[1] for e in after['topics'].values()) -
+                         sum(e[1] for e in before['topics'].values()),
+            })
+            if service._STOP_EVT.is_set():
+                break
+
+        service._PUBCLI.disconnect()
+        service._PUBCLI.loop_stop()
+    latency = service._STATS.snapshot()['histograms'].get('publish_latency')
+
+    # The first tick warms up caches, and is reported separately
+    first, rest = ticks[0], ticks[1:] or ticks
+    result = {key: sum(t[key] for t in rest) / len(rest)
+              for key in ('cpu_ms', 'blocks', 'messages', 'bytes')}
+    result['peak_kb'] = max(t['peak_kb'] for t in ticks) if args.trace_malloc else None
+    result['cpu_ms_p95'] = Percentile([t['cpu_ms'] for t in rest], 95)
+    result['cpu_ms_max'] = max(t['cpu_ms'] for t in rest)
+    result['first_ms'] = first['cpu_ms']
+    result['latency_ms'] = latency and latency['sum'] / latency['count'] * 1000 or 0
+    result['latency_ms_max'] = latency and latency['max'] * 1000 or 0
+    result['ticks'] = len(ticks)
+    return result
+
+def Report(results):
+    print("%-12s %5s %8s %9s %8s %8s %8s %8s %8s %9s %9s" %
+          ('service', 'ticks', 'first ms', 'cpu ms', 'p95 ms', 'max ms',
+           'blocks', 'peak KB', 'msgs', 'bytes', 'lat ms'))
+    for name, r in results.items():
+        print("%-12s %5d %8.2f %9.3f %8.3f %8.3f %8.1f %8s %8.1f %9.1f %9.3f" %
+              (name, r['ticks'], r['first_ms'], r['cpu_ms'], r['cpu_ms_p95'],
+               r['cpu_ms_max'], r['blocks'],
+               '-' if r['peak_kb'] is None else '%.1f' % r['peak_kb'],
+               r['messages'], r['bytes'], r['latency_ms']))
+
+# Compare against baseline results, return the number of regressions
+def Compare(results, baseline, tolerance, metrics=METRICS):
+    regressions = 0
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, noise in metrics.items():
+            old, new = base.get(metric), r[metric]
+            # Not measured in both runs (e.g. peak memory)
+            if old is None or new is None:
+                continue
+            if new <= max(old * (1 + tolerance), noise):
+                continue
+            regressions += 1
+            print("REGRESSION %-12s %-12s %10.3f -> %10.3f (%+.0f%%)" %
+                  (name, metric, old, new, (new / old - 1) * 100 if old else 100))
+    return regressions
+
+def Main():
+    parser = argparse.ArgumentParser(description="Benchmark services end-to-end")
+    parser.add_argument('services', nargs='*', default=list(SERVICES),
+                        help="services to benchmark (default: all)")
+    parser.add_argument('--ticks', type=int, default=100,
+                        help="number of intervals to run each service")
+    parser.add_argument('--start', type=float,
+                        help="UNIX time to start at (default: now)")
+    parser.add_argument('--storm', type=int, default=1000,
+                        help="messages delivered per tick to the Transcriber")
+    parser.add_argument('--broker', choices=('fake', 'mosquitto'), default='fake',
+                        help="publish to in-process fake broker, or local mosquitto")
+    parser.add_argument('--trace-malloc', action='store_true',
+                        help="trace peak memory allocated per tick (slows down ticks)")
+    parser.add_argument('--save', metavar='FILE', help="save results to JSON file")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare against results saved in JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative increase reported as regression")
+    parser.add_argument('--record', type=int, metavar='COUNT',
+                        help="record live feed data as fixture, instead of benchmarking")
+    parser.add_argument('--record-interval', type=float, default=300,
+                        help="seconds between recordings")
+    args = parser.parse_args()
+
+    for name in args.services:
+        if name not in SERVICES:
+            parser.error("Unknown service '%s'" % name)
+    if args.record:
+        if args.services != ['WeatherServ']:
+            parser.error("Only WeatherServ feed can be recorded")
+        RecordWeatherServ(args.record, args.record_interval)
+        return 0
+
+    if args.trace_malloc:
+        tracemalloc.start()
+    broker = MosquittoBenchBroker() if args.broker == 'mosquitto' else FakeBenchBroker()
+    results = {}
+    try:
+        for name in args.services:
+            results[name] = BenchService(name, broker, args)
+    finally:
+        broker.close()
+    Report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if Compare(results, json.load(f), args.tolerance) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,121 @@
+# Startup benchmark of the services: time from spawning a fresh interpreter
+# until loaded, connected, and the first interval published, against an
+# in-process fake MQTT broker.
+#
+# Usage: python3 StartupBench.py [<options>] [<service> ...]
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+from common import MQPubCli, MQPubHost
+
+import FakeBroker
+from ServiceBench import SERVICES, BENCH_DIR, LoadWeatherServ, Compare
+
+# Metrics compared against a baseline (higher is worse), with the absolute
+# values under which changes are dominated by noise
+METRICS = {
+    'loaded_ms': 20,
+    'connected_ms': 20,
+    'published_ms': 20,
+    'rss_mb': 2,
+}
+
+# Start a service in this process, and report the times (since `spawned`)
+# it reached each stage of startup
+def StartService(name, spawned):
+    svc_dir, script = SERVICES[name]
+    svc_dir = os.path.join(BENCH_DIR, svc_dir)
+    loader = LoadWeatherServ if name == 'WeatherServ' else MQPubHost.LoadService
+    client = FakeBroker.FakeClient()
+    MQPubCli.IntervalPublisher._PUBCLI = client
+
+    module = loader(svc_dir, script)
+    service = module.service
+    loaded = time.time()
+
+    # As in run(), except that the first tick is due right after connecting
+    service._setup(None, None, None)
+    service._reset()
+    client.loop_start()
+    while not service._CONNECTED:
+        time.sleep(0.001)
+    connected = time.time()
+    client.wait_idle()
+
+    start = time.time()
+    service._tick(1, module.SCHEDULE['interval'])
+    client.wait_idle()
+    published = time.time()
+    client.disconnect()
+    client.loop_stop()
+    return {
+        'loaded_ms': (loaded - spawned) * 1000,
+        'connected_ms': (connected - spawned) * 1000,
+        'published_ms': (published - spawned) * 1000,
+        'tick_ms': (published - start) * 1000,
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+# Start a service in fresh interpreters, and collect the median times
+def BenchStartup(name, runs):
+    samples = []
+    for _ in range(runs):
+        spawned = time.time()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__),
+                               '--child', str(spawned), name],
+                              cwd=BENCH_DIR, stdout=subprocess.PIPE, check=True)
+        samples.append(json.loads(proc.stdout.decode().splitlines()[-1]))
+    result = {key: sorted(s[key] for s in samples)[len(samples) // 2]
+              for key in samples[0]}
+    result['runs'] = len(samples)
+    return result
+
+def Report(results):
+    print("%-12s %5s %10s %13s %10s %13s %8s" %
+          ('service', 'runs', 'loaded ms', 'connected ms', 'tick ms',
+           'published ms', 'RSS MB'))
+    for name, r in results.items():
+        print("%-12s %5d %10.1f %13.1f %10.1f %13.1f %8.1f" %
+              (name, r['runs'], r['loaded_ms'], r['connected_ms'], r['tick_ms'],
+               r['published_ms'], r['rss_mb']))
+
+def Main():
+    parser = argparse.ArgumentParser(description="Benchmark services startup")
+    parser.add_argument('services', nargs='*', default=list(SERVICES),
+                        help="services to benchmark (default: all)")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="number of fresh starts of each service")
+    parser.add_argument('--save', metavar='FILE', help="save results to JSON file")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare against results saved in JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative increase reported as regression")
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    for name in args.services:
+        if name not in SERVICES:
+            parser.error("Unknown service '%s'" % name)
+    if args.child:
+        print(json.dumps(StartService(args.services[0], args.child)))
+        return 0
+
+    results = { name: BenchStartup(name, args.runs) for name in args.services }
+    Report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            return 1 if Compare(results, json.load(f), args.tolerance, METRICS) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(Main())
@@ -0,0 +1,259 @@
+# Local stub of the weather service APIs, serving the WeatherServ fixture as
+# DarkSky (or OpenWeatherMap One Call) API responses, for running and
+# benchmarking WeatherServ without the live API.
+#
+# Usage: python3 WeatherStub.py [--port <port>] [--format darksky|openweathermap]
+#                               [--rotate <requests>] [--delay <seconds>]
+
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+_logger = logging.getLogger(__name__)
+
+# Reverse the digests of the fixture (see WeatherServ/DarkSkyObserver.py)
+# into DarkSky data points
+
+def _timed(value, field, point):
+    if isinstance(value, list):
+        point[field], point[field+'Time'] = value
+    else:
+        point[field] = value
+
+def _precip(digest, point):
+    point['precipProbability'] = digest[0]
+    if digest[1] != '-':
+        point['precipType'] = digest[1]
+    if isinstance(digest[2], list):
+        point['precipIntensity'], point['precipIntensityError'] = digest[2]
+    else:
+        point['precipIntensity'] = digest[2]
+    if len(digest) > 3:
+        point['precipIntensityMax'], point['precipIntensityMaxTime'] = digest[3]
+    return point
+
+def _point(digest, t):
+    point = {
+        'time': t,
+        'summary': digest['@'],
+        'humidity': (digest['H'][0] + .5) / 100,
+        'dewPoint': digest['H'][1],
+        'windBearing': digest['W'][0][0],
+        'windSpeed': digest['W'][1],
+        'cloudCover': (digest['E'][0] + .5) / 100,
+        'visibility': digest['E'][1],
+        'ozone': digest['E'][2],
+    }
+    _timed(digest['W'][2], 'windGust', point)
+    _timed(digest['E'][3], 'uvIndex', point)
+    T, P = digest['T'], digest['P']
+    if isinstance(T[0], list):
+        for field, value in zip(('temperatureHigh', 'apparentTemperatureHigh',
+                                 'temperatureLow', 'apparentTemperatureLow'), T):
+            _timed(value, field, point)
+    else:
+        point['temperature'], point['apparentTemperature'] = T
+    point['pressure'] = P[0]
+    _precip(P[1], point)
+    if len(P) > 2:
+        point['nearestStormDistance'] = P[2]
+    return point
+
+def _expand(items):
+    for item in items:
+        if isinstance(item, list) and item and item[0] == 'RLE':
+            yield from [item[2]] * item[1]
+        else:
+            yield item
+
+# Data points are `step` seconds apart, with the last one at the block's end
+def _block(digest, step, make_point):
+    summary, (start, end), items = digest
+    items = list(items)
+    times = [ start + i*step for i in range(len(items)-1) ] + [ end ]
+    return { 'summary': summary,
+             'data': [ make_point(item, t) for item, t in zip(items, times) ] }
+
+# DarkSky API response of a fixture record
+def DarkSkyResponse(record):
+    (t, (lat, long), units) = record['stamp']
+    minutely = record['minutely']
+    return {
+        'latitude': lat,
+        'longitude': long,
+        'currently': _point(record['current'], t),
+        'minutely': _block((minutely[0], minutely[1], _expand(minutely[2])), 60,
+                           lambda item, t: _precip(item, { 'time': t })),
+        'hourly': _block(record['hourly'], 3600, _point),
+        'daily': _block(record['daily'], 86400, _point),
+        'alerts': [ { 'title': title, 'time': start, 'expires': expires, 'description': desc }
+                    for title, (start, expires), desc in record['alerts'] ],
+        'flags': { 'units': units },
+    }
+
+# OpenWeatherMap One Call API response of a fixture record, assuming it is
+# in 'us' units (requested with units=imperial)
+
+def _owm_precip(point, hours=1):
+    mm = point.get('precipIntensity', 0) * 25.4 * hours
+    return { point.get('precipType', 'rain'): round(mm, 2) } if mm else {}
+
+def _owm_point(point):
+    item = {
+        'dt': point['time'],
+        'pressure': point['pressure'],
+        'humidity': int(point['humidity'] * 100),
+        'dew_point': point['dewPoint'],
+        'uvi': point['uvIndex'],
+        'clouds': int(point['cloudCover'] * 100),
+        'visibility': int(point['visibility'] * 1609.344),
+        'wind_speed': point['windSpeed'],
+        'wind_gust': point['windGust'],
+        'wind_deg': point['windBearing'],
+        'weather': [ { 'description': point['summary'].rstrip('.').lower() } ],
+    }
+    if 'temperature' in point:
+        item['temp'] = point['temperature']
+        item['feels_like'] = point['apparentTemperature']
+    return item
+
+def OneCallResponse(record):
+    ds = DarkSkyResponse(record)
+    current = _owm_point(ds['currently'])
+    current.update({ k: { '1h': v } for k, v in _owm_precip(ds['currently']).items() })
+    hourly = []
+    for point in ds['hourly']['data']:
+        item = _owm_point(point)
+        item.update({ k: { '1h': v } for k, v in _owm_precip(point).items() })
+        item['pop'] = point['precipProbability']
+        hourly.append(item)
+    daily = []
+    for point in ds['daily']['data']:
+        item = _owm_point(point)
+        item['temp'] = { 'max': point['temperatureHigh'], 'min': point['temperatureLow'] }
+        item['feels_like'] = { 'day': point['apparentTemperatureHigh'],
+                               'night': point['apparentTemperatureLow'] }
+        item['summary'] = point['summary']
+        item['pop'] = point['precipProbability']
+        item.update(_owm_precip(point, 24))
+        daily.append(item)
+    return {
+        'lat': ds['latitude'],
+        'lon': ds['longitude'],
+        'timezone': None,
+        'current': current,
+        'minutely': [ { 'dt': point['time'],
+                        'precipitation': round(point['precipIntensity'] * 25.4, 2) }
+                      for point in ds['minutely']['data'] ],
+        'hourly': hourly,
+        'daily': daily,
+        'alerts': [ { 'event': alert['title'], 'start': alert['time'], 'end': alert['expires'],
+                      'description': alert['description'] } for alert in ds['alerts'] ],
+    }
+
+FORMATS = {
+    'darksky': DarkSkyResponse,
+    'openweathermap': OneCallResponse,
+}
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        index, body, modified = self.server.respond()
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        etag = '"%d"' % index
+        # If-None-Match takes precedence over If-Modified-Since
+        match, since = self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')
+        if match == etag if match else (
+                since and parsedate_to_datetime(since).timestamp() >= modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out while delayed
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+"""
+Serves the fixture records in the given format on localhost, each for
+`rotate` requests (and unchanged in the meantime), after `delay` seconds.
+"""
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, records, fmt='darksky', port=0, *, rotate=1, delay=0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self._BODIES = [ json.dumps(FORMATS[fmt](record)).encode('utf-8') for record in records ]
+        self._STAMPS = [ record['stamp'][0] for record in records ]
+        self._ROTATE = rotate
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    # Body and modified time of the record to respond with
+    def respond(self):
+        with self.lock:
+            index = (self.requests // self._ROTATE) % len(self._BODIES)
+            self.requests += 1
+        return index, self._BODIES[index], self._STAMPS[index]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def LoadRecords():
+    with open(os.path.join(FIXTURE_DIR, 'WeatherServ.json')) as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the WeatherServ fixture as weather API responses")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--format', choices=list(FORMATS), default='darksky')
+    parser.add_argument('--rotate', type=int, default=1,
+                        help="requests served by each record before the next one")
+    parser.add_argument('--delay', type=float, default=0, help="response delay (seconds)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    server = StubServer(LoadRecords(), args.format, args.port, rotate=args.rotate, delay=args.delay)
+    print("Serving %s responses at %s" % (args.format, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
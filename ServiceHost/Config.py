@@ -0,0 +1,19 @@
+# MQTT client configurations (shared by all hosted services)
+SERVER="<MQTT server IP or DNS name>"
+PORT=8883
+CACERTS=None or "<path to SSL CA certificate>"
+USER="<username>"
+PASS="<password>"
+# Limits of in-flight (QoS>0) and queued messages in the client (0 = unlimited)
+MAX_INFLIGHT=20
+MAX_QUEUED=0
+
+# Services to host in this process, each as:
+#   ( <service directory>, <service script> )
+# Every service directory must have its own `__deploy__/Config.py`.
+# Relative paths are resolved from the working directory.
+SERVICES=[
+    ( "../../TimeServ", "MQTimeService.py" ),
+    ( "../../AstroServ", "MQAstroService.py" ),
+    ( "../../WeatherServ", "MQWeatherService.py" ),
+]
@@ -0,0 +1,31 @@
+# Host multiple MQTT services in a single process
+
+import os
+import logging
+import signal
+
+from common import MQPubHost
+
+from __deploy__ import Config
+
+DEBUG = os.environ.get('DEBUG')
+logging.basicConfig(level=logging.NOTSET if DEBUG else logging.WARNING)
+
+# Guarded, as worker processes of the services (e.g. prefetching) import
+# this script afresh
+if __name__ == '__main__':
+    host = MQPubHost.IntervalPublisherHost(__name__,
+                                          max_inflight=getattr(Config, 'MAX_INFLIGHT', None),
+                                          max_queued=getattr(Config, 'MAX_QUEUED', None))
+
+    for svc_dir, script in Config.SERVICES:
+        logging.getLogger(__name__).debug("Loading service '%s' from '%s'...", script, svc_dir)
+        module = MQPubHost.LoadService(svc_dir, script)
+        host.add(module.service, **module.SCHEDULE)
+
+    # Handle keyboard interruption
+    def CtrlCHandler(sig, frame):
+        host.stop()
+    signal.signal(signal.SIGINT, CtrlCHandler)
+
+    host.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS, Config.CACERTS)
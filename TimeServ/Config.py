@@ -7,6 +7,60 @@ PASS="<password>"
 
 # Publish every N seconds
 INTERVAL=10
+# Align publishing to wall-clock multiples of INTERVAL
+ALIGN=True
+
+# Unchanged retained messages are only republished after N seconds
+# (None = never, 0 = always)
+HEARTBEAT=3600
+
+# Additional payload encodings, published on parallel `<topic>/<suffix>`
+# topics, e.g. { 'bin': 'msgpack' } (or 'cbor')
+ENCODINGS={}
+# Decimal digits of float values, per topic and field, e.g. { 'Lunar': 0 }
+PRECISION={}
+
+# Delivery profiles by topic pattern (supports '+' and '#' wildcards),
+# overriding the built-in QoS and retain flag of matching messages:
+# - 'ephemeral' = QoS 0; 'event' = QoS 1; 'state' = QoS 1, retained;
+# - 'reliable' = QoS 2; or ( <qos>, <retain> )
+# The first matching pattern wins, so list specific ones first. Topics of
+# additional encodings take the profile of their topic; internal topics
+# (e.g. self-telemetry) are not affected.
+PROFILES={
+    'Local/tz': 'state',
+    'UTC/#': 'ephemeral',
+    'Local/#': 'ephemeral',
+    'Lunar/#': 'ephemeral'
+}
+# Client limits of in-flight (QoS>0) and queued messages (0 = unlimited)
+MAX_INFLIGHT=20
+MAX_QUEUED=0
+
+# Publish self-telemetry (timings, message counts) every N seconds
+# (None = disabled) under `<TOPIC_PFX>/<STATS_TOPIC>`, and optionally
+# also write it to a Prometheus text file
+STATS_INTERVAL=None
+STATS_TOPIC="_stats"
+STATS_PROMFILE=None
+
+# Mid-night maintenance is performed in-process: optionally reload this
+# configuration (settings that can change at run-time only), and terminate
+# for a full restart only if memory grew more than N MB (None = never)
+MAINT_RELOAD=False
+MAINT_RSS_GROWTH=64
+
+# Time sync: devices publish a nonce to `<TOPIC_PFX>/sync/<device id>`, and
+# get a reply on `<TOPIC_PFX>/sync/<device id>/reply`
+SYNC=True
+# Replies per device: up to SYNC_BURST at once, then one every SYNC_INTERVAL
+# seconds; and up to SYNC_MAX_RATE replies per second to all devices
+SYNC_BURST=4
+SYNC_INTERVAL=15
+SYNC_MAX_RATE=50
+
+# Ethnic calendars to publish, e.g. [ 'Lunar' ] (None = all available)
+CALENDARS=None
 
 # All messages will be published under this prefix
 TOPIC_PFX="/infr/clock"
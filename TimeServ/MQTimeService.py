@@ -1,13 +1,12 @@
 import os
+import json
 import logging
 import time
-import json
 import signal
 
 from common import MQPubCli
 
 import ethnic
-from ethnic import *
 
 from __deploy__ import Config
 
@@ -31,29 +30,70 @@ def ConvertStructTime(stime,tzcnt):
         tscomp.append(bool(stime[8]))
     return tscomp
 
+# Ethnic calendars to publish
+CALENDARS = ethnic.calendars(getattr(Config, 'CALENDARS', None))
+
+# Time sync requests from devices, on `sync/<device id>` sub-topics
+SYNC_SUB_TOPIC = 'sync'
+SYNC_NONCE_MAX = 64
+SYNC = getattr(Config, 'SYNC', False)
+if SYNC:
+    SYNC_LIMITER = MQPubCli.RateLimiter(1 / Config.SYNC_INTERVAL, Config.SYNC_BURST)
+    SYNC_MAX_LIMITER = MQPubCli.RateLimiter(Config.SYNC_MAX_RATE, Config.SYNC_MAX_RATE)
+
 class MQTimeService(MQPubCli.IntervalPublisher):
 
     def on_connected(self, unix_ts, con_count):
-        self._publish('Local/tz', json.dumps(CLOCK_TZS), retain=True)
+        self._publishData('Local/tz', CLOCK_TZS, retain=True)
 
     def on_interval(self, unix_ts):
         utc_info = ConvertStructTime(time.gmtime(unix_ts), 1)
-        self._publish('UTC', json.dumps(utc_info))
+        self._publishData('UTC', utc_info)
         self._publish('UTC/unix', "%.3f" % unix_ts)
 
         loc_info = ConvertStructTime(time.localtime(unix_ts), len(CLOCK_TZS))
-        self._publish('Local', json.dumps(loc_info))
+        self._publishData('Local', loc_info)
+
+        for sub_topic, calendar in CALENDARS:
+            ethnic_info = calendar.info(unix_ts, ConvertStructTime)
+            self._publishData(sub_topic, ethnic_info)
+
+    # Reply to time sync requests, NTP-style: echo the nonce, with the
+    # receive and transmit time, for the device to estimate its clock
+    # offset and the round-trip time
+    def on_receive(self, unix_ts, topic, message, qos, retain):
+        device = topic.rsplit('/', 1)[-1]
+        if not SYNC_LIMITER.allow(device):
+            self._LOGGER.debug("Time sync of '%s' rate limited", device)
+            return
+        if not SYNC_MAX_LIMITER.allow():
+            # Not the device's fault, so it keeps its token
+            SYNC_LIMITER.refund(device)
+            self._LOGGER.debug("Time sync of '%s' rate limited (all devices)", device)
+            return
+        nonce = message[:SYNC_NONCE_MAX].decode('utf-8', 'replace')
+        reply_topic = '/'.join((SYNC_SUB_TOPIC, device, 'reply'))
+        self._publish(reply_topic, json.dumps([nonce, unix_ts, time.time()]),
+                      0, False, dedup=False, profile=None)
+
+SUB_PAIRS = []
+if SYNC:
+    SUB_PAIRS.append((os.path.join(Config.TOPIC_PFX, SYNC_SUB_TOPIC, '+'), 0))
 
-        for sub_topic, func in ethnic.registry.items():
-            ethnic_info = func(unix_ts, ConvertStructTime)
-            self._publish(sub_topic, json.dumps(ethnic_info))
+service = MQTimeService(__name__, Config.TOPIC_PFX, DRYRUN, sub_pairs=SUB_PAIRS,
+                        **MQPubCli.ConfigOptions(Config))
 
-service = MQTimeService(__name__, Config.TOPIC_PFX, DRYRUN)
+# Publishing schedule, also used when hosted by the service host
+SCHEDULE = {
+    'interval': Config.INTERVAL,
+    'align': getattr(Config, 'ALIGN', False)
+}
 
-# Handle keyboard interruption
-def CtrlCHandler(sig, frame):
-    service.stop()
-signal.signal(signal.SIGINT, CtrlCHandler)
+if __name__ == '__main__':
+    # Handle keyboard interruption
+    def CtrlCHandler(sig, frame):
+        service.stop()
+    signal.signal(signal.SIGINT, CtrlCHandler)
 
-service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
-            Config.CACERTS, Config.INTERVAL)
+    service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
+                Config.CACERTS, **SCHEDULE)
@@ -1,3 +1,78 @@
-__all__ = [ 'lunar' ]
+import importlib
+from datetime import datetime
 
-registry = {}
+# Calendar plugins, as { <sub-topic>: <module> }
+# Modules are only imported on first use, and register their calendar
+PLUGINS = {
+    'Lunar': 'lunar',
+}
+
+# How often the info of a calendar changes, and is re-computed
+CHANGES_DAILY = 'daily'         # When the date rolls over, in its timezone
+CHANGES_HOURLY = 'hourly'       # When the hour rolls over, in its timezone
+CHANGES_TICK = 'tick'           # Every time
+
+_BOUNDARY_KEYS = {
+    CHANGES_DAILY: lambda t: (t.date(), ),
+    CHANGES_HOURLY: lambda t: (t.date(), t.hour, t.utcoffset()),
+    CHANGES_TICK: None,
+}
+
+"""
+An ethnic calendar, with its info memoized until the next change
+"""
+class Calendar:
+
+    def __init__(self, sub_topic, module):
+        self._SUB_TOPIC = sub_topic
+        self._MODULE = module
+        self._COMPUTE = None
+        self._MEMO = (None, None)
+
+    # Set up the calendar, called by the plugin module
+    # - `compute(local_time)`: info of given time in `timezone` (None = local);
+    # - `changes`: how often the computed info changes (CHANGES_*);
+    # - `compose(local_time, info, time_conv)`: info to publish, from the
+    #   (memoized) computed info, e.g. adding the time of day.
+    def setup(self, compute, *, changes=CHANGES_TICK, timezone=None, compose=None):
+        if changes not in _BOUNDARY_KEYS:
+            raise Exception("Unknown calendar change frequency '%s'" % changes)
+        self._COMPUTE = compute
+        self._BOUNDARY_KEY = _BOUNDARY_KEYS[changes]
+        self._TIMEZONE = timezone
+        self._COMPOSE = compose
+        self._MEMO = (None, None)
+
+    def info(self, unix_ts, time_conv):
+        if self._COMPUTE is None:
+            importlib.import_module('.' + self._MODULE, __name__)
+            if self._COMPUTE is None:
+                raise Exception("Calendar '%s' not registered by plugin '%s'" %
+                                (self._SUB_TOPIC, self._MODULE))
+        local_time = datetime.fromtimestamp(unix_ts, self._TIMEZONE)
+        if self._BOUNDARY_KEY is None:
+            info = self._COMPUTE(local_time)
+        else:
+            key = self._BOUNDARY_KEY(local_time)
+            if self._MEMO[0] != key:
+                self._MEMO = (key, self._COMPUTE(local_time))
+            info = self._MEMO[1]
+        return self._COMPOSE(local_time, info, time_conv) if self._COMPOSE else info
+
+registry = { sub_topic: Calendar(sub_topic, module)
+             for sub_topic, module in PLUGINS.items() }
+
+# Register the calendar of a sub-topic (see Calendar.setup())
+def register(sub_topic, compute, **kwargs):
+    if sub_topic not in registry:
+        registry[sub_topic] = Calendar(sub_topic, None)
+    registry[sub_topic].setup(compute, **kwargs)
+
+# The calendars with given sub-topics (None = all), as [ ( <sub-topic>, <calendar> ) ]
+def calendars(sub_topics=None):
+    if sub_topics is None:
+        return list(registry.items())
+    for sub_topic in sub_topics:
+        if sub_topic not in registry:
+            raise Exception("Unknown ethnic calendar '%s'" % sub_topic)
+    return [ (sub_topic, registry[sub_topic]) for sub_topic in sub_topics ]
@@ -1,45 +1,86 @@
-from datetime import datetime
+import bisect
+import functools
+from datetime import date, timedelta
 
 import pytz
 from lunarcalendar import Lunar
 from lunarcalendar.solarterm import solarterms
 
-from . import registry
+from . import register, CHANGES_DAILY
 
 LUNAR_TIMEZONE = pytz.timezone('Asia/Shanghai')
 LUNAR_NATIVELANG = 'zh_hans'
 
-def GetLunarInfo(unix_ts, time_conv):
-    ethnic_time = datetime.fromtimestamp(unix_ts, LUNAR_TIMEZONE)
-    lunar_date = Lunar.from_date(ethnic_time.date())
-    lunar_info = [
-        time_conv(ethnic_time.timetuple(), 1),
-        ( lunar_date.year, lunar_date.month, lunar_date.isleap, lunar_date.day )
-    ]
+# Solar terms in the order they occur in a (Gregorian) year: the two
+# January terms (23 and 24) come first, followed by terms 1 - 22
+TERM_ORDER = (22, 23, *range(22))
+
+"""
+Solar-term dates and lunar month boundaries covering a (Gregorian) year,
+for looking up any date in the year by bisect
+"""
+class LunarYearTable:
+
+    def __init__(self, year):
+        # Solar terms, extended with the last one of previous year and the
+        # first one of next year: [ ( <date>, <term index> ) ]
+        self._TERMS = [ (solarterms[21](year-1), 21) ]
+        self._TERMS+= [ (solarterms[i](year), i) for i in TERM_ORDER ]
+        self._TERMS.append((solarterms[22](year+1), 22))
+        self._TERM_DATES = [ t[0] for t in self._TERMS ]
+
+        # Lunar months overlapping the year: [ ( <first day>, <lunar month> ) ]
+        self._MONTHS = []
+        month_start = date(year, 1, 1)
+        month_start-= timedelta(days=Lunar.from_date(month_start).day-1)
+        while month_start.year <= year:
+            lunar_date = Lunar.from_date(month_start)
+            self._MONTHS.append((month_start, lunar_date))
+            # A lunar month has either 29 or 30 days
+            month_start+= timedelta(days=29)
+            if Lunar.from_date(month_start).day != 1:
+                month_start+= timedelta(days=1)
+        self._MONTH_DATES = [ m[0] for m in self._MONTHS ]
+
+    # Lunar date of given date, as ( <year>, <month>, <is leap>, <day> )
+    def lunarDate(self, the_date):
+        month_start, lunar_date = self._MONTHS[bisect.bisect_right(self._MONTH_DATES, the_date)-1]
+        return ( lunar_date.year, lunar_date.month, lunar_date.isleap,
+                 (the_date - month_start).days + 1 )
+
+    # The last passed (or current) and the next solar terms of given date,
+    # each as ( <term index>, <term date> )
+    def solarTerms(self, the_date):
+        idx = bisect.bisect_right(self._TERM_DATES, the_date)
+        return self._TERMS[idx-1], self._TERMS[idx]
+
+# Tables of recently used years, built lazily
+@functools.lru_cache(maxsize=2)
+def GetYearTable(year):
+    return LunarYearTable(year)
+
+def SolarTermInfo(term_idx):
+    term = solarterms[term_idx]
+    return ( term_idx+1, term.langs[LUNAR_NATIVELANG][0], term.langs['en'][0] )
+
+# Lunar date and solar terms of the date in China
+def GetLunarDateInfo(ethnic_time):
     ethnic_date = ethnic_time.date()
-    # Compute the progression of solar terms
-    scan_year = lunar_date.year
-    last_term = None
-    next_term = None
-    while not next_term:
-        for i in (22,23,*range(22)):
-            term = solarterms[i]
-            term_date = term(scan_year)
-            if term_date <= ethnic_date:
-                last_term = ( i+1, term, term_date )
-            else:
-                next_term = ( i+1, term, term_date )
-                break
-        scan_year += 1
-    lunar_info.append((
+    table = GetYearTable(ethnic_date.year)
+    (last_date, last_idx), (next_date, next_idx) = table.solarTerms(ethnic_date)
+    return (
+        table.lunarDate(ethnic_date),
         (
-            ( last_term[0], last_term[1].langs[LUNAR_NATIVELANG][0], last_term[1].langs['en'][0] ),
-            (ethnic_date - last_term[2]).days
-        ), (
-            ( next_term[0], next_term[1].langs[LUNAR_NATIVELANG][0], next_term[1].langs['en'][0] ),
-            (next_term[2] - ethnic_date).days
+            ( SolarTermInfo(last_idx), (ethnic_date - last_date).days ),
+            ( SolarTermInfo(next_idx), (next_date - ethnic_date).days )
         )
-    ))
-    return lunar_info
+    )
+
+def ComposeLunarInfo(ethnic_time, date_info, time_conv):
+    return [
+        time_conv(ethnic_time.timetuple(), 1),
+        *date_info
+    ]
 
-registry['Lunar'] = GetLunarInfo
+register('Lunar', GetLunarDateInfo, changes=CHANGES_DAILY,
+         timezone=LUNAR_TIMEZONE, compose=ComposeLunarInfo)
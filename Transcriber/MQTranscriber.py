@@ -77,10 +77,16 @@ class MQTranscriber(MQPubCli.IntervalPublisher):
 service = MQTranscriber(__name__, Config.TOPIC_PFX, DRYRUN,
                         tlist=Config.TLIST)
 
-# Handle keyboard interruption
-def CtrlCHandler(sig, frame):
-    service.stop()
-signal.signal(signal.SIGINT, CtrlCHandler)
-
-service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
-            Config.CACERTS, 60)
+# Publishing schedule, also used when hosted by the service host
+SCHEDULE = {
+    'interval': 60
+}
+
+if __name__ == '__main__':
+    # Handle keyboard interruption
+    def CtrlCHandler(sig, frame):
+        service.stop()
+    signal.signal(signal.SIGINT, CtrlCHandler)
+
+    service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
+                Config.CACERTS, **SCHEDULE)
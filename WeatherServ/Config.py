@@ -7,6 +7,64 @@ PASS="<password>"
 
 # Publish every N seconds
 INTERVAL=300
+# Align publishing to wall-clock multiples of INTERVAL
+ALIGN=False
+
+# Unchanged retained messages are only republished after N seconds
+# (None = never, 0 = always)
+HEARTBEAT=3600
+
+# Additional payload encodings, published on parallel `<topic>/<suffix>`
+# topics, e.g. { 'bin': 'msgpack' } (or 'cbor')
+ENCODINGS={}
+# Decimal digits of float values, per topic and field, e.g. { 'current': 1 }
+PRECISION={}
+# Forecasts also published in columnar encoding on `<topic>/cols`, with
+# floats rounded to N decimal digits (None = as is), e.g.
+# { 'forecast/hourly': 1, 'forecast/daily': 1 }
+COLUMNAR={}
+
+# Delivery profiles by topic pattern (supports '+' and '#' wildcards),
+# overriding the built-in QoS and retain flag of matching messages:
+# - 'ephemeral' = QoS 0; 'event' = QoS 1; 'state' = QoS 1, retained;
+# - 'reliable' = QoS 2; or ( <qos>, <retain> )
+# The first matching pattern wins, so list specific ones first. Topics of
+# additional encodings take the profile of their topic; internal topics
+# (e.g. self-telemetry) are not affected.
+PROFILES={ '#': 'state' }
+# Client limits of in-flight (QoS>0) and queued messages (0 = unlimited)
+MAX_INFLIGHT=20
+MAX_QUEUED=0
+
+# While disconnected, keep the latest retained messages in this file (None
+# = disabled), up to SPOOL_SIZE bytes, and replay them after reconnecting
+# at SPOOL_RATE messages per second
+SPOOL_FILE=None
+SPOOL_SIZE=65536
+SPOOL_RATE=10
+
+# Publish self-telemetry (timings, message counts) every N seconds
+# (None = disabled) under `<TOPIC_PFX>/<STATS_TOPIC>`, and optionally
+# also write it to a Prometheus text file
+STATS_INTERVAL=None
+STATS_TOPIC="_stats"
+STATS_PROMFILE=None
+
+# Mid-night maintenance is performed in-process: optionally reload this
+# configuration (settings that can change at run-time only), and terminate
+# for a full restart only if memory grew more than N MB (None = never)
+MAINT_RELOAD=False
+MAINT_RSS_GROWTH=64
+
+# Forecasts also published delta encoded (of 'hourly', 'daily'): a base
+# snapshot on `forecast/<name>/base` every DELTA_BASE_EVERY changes, and
+# patches on `forecast/<name>/patch` in between (at QoS 1, never retained
+# nor subject to PROFILES). Devices request a resync on
+# `forecast/<name>/resync`, served at most once every DELTA_RESYNC_INTERVAL
+# seconds.
+DELTA_TOPICS=[]
+DELTA_BASE_EVERY=12
+DELTA_RESYNC_INTERVAL=10
 
 # All messages will be published under this prefix
 TOPIC_PFX="/infr/weather"
@@ -17,5 +75,23 @@ LOCAL_COORD = {
     'long': -77.0501575
 }
 
+# Weather service provider: 'darksky' (or a compatible API, e.g. Pirate
+# Weather, at WS_URL) or 'openweathermap' (One Call API)
+WS_PROVIDER = 'darksky'
 # Weather Service API key
 WS_APIKEY = 'weather-service-api-key'
+# Base URL of the API (None = the provider's default)
+WS_URL = None
+# Units of the data: 'auto', 'us', 'si', 'ca' or 'uk2' (OpenWeatherMap: 'us',
+# or metric for any other)
+WS_UNITS = 'auto'
+# Connect and read timeouts (seconds) of API requests
+WS_TIMEOUT = (3.05, 10)
+# Refresh the data in the background every N seconds (None = INTERVAL), and
+# retry failed refreshes after a backoff doubling between ( <min>, <max> )
+# seconds; ticks publish the latest good data, with its age in `stamp`
+WS_REFRESH = None
+WS_BACKOFF = (30, 1800)
+# The first tick waits up to N seconds (at most half the INTERVAL) for the
+# first refresh; if not ready yet, nothing is published until the next tick
+WS_FIRST_WAIT = 5
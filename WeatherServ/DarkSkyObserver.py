@@ -1,21 +1,19 @@
+import json
 import time
+import random
 import logging
+import threading
+import itertools
 
 from pprint import pformat
 
-from darksky.api import DarkSky
-from darksky.types import languages, units, weather
+from common import MQPubCli
 
 _logger = logging.getLogger(__name__)
 
-def WeatherObserver(apikey, loc):
-    darksky = DarkSky(apikey)
-    def _forecast_fetch(units=units.AUTO, lang=languages.ENGLISH):
-        return darksky.get_forecast(loc['lat'], loc['long'], units=units, lang=lang)
-    return _forecast_fetch
-
+# Times are UNIX timestamps in the DarkSky data model
 def TimeToTS(t):
-    return 0 if t is None else int(time.mktime(t.timetuple()))
+    return 0 if t is None else int(t)
 
 def BearingToDir(deg):
     val = int((deg/22.5)+.5)
@@ -27,28 +25,139 @@ def BearingToDir(deg):
     ]
     return name[val % 16]
 
+# Run-length encode an array: runs of 3 or more equal items are expressed as
+# [ 'RLE', <count>, <item> ]
 def ArrayRLE(arr):
     out = []
-    last = arr[0]
-    count = -1
-
-    def _flush():
-        nonlocal count, out, last
-        if count < 2:
-            out.append(last)
+    for item, run in itertools.groupby(arr):
+        count = len(list(run))
+        if count < 3:
+            out.extend([item] * count)
         else:
-            out.append(['RLE', count, last])
-        count = 0
+            out.append(['RLE', count, item])
+    return out
 
+# Expand the runs of ArrayRLE
+def ArrayExpand(arr):
+    out = []
     for item in arr:
-        if last == item:
-            count += 1
-            continue
-        _flush()
-        last = item
-    _flush()
+        if isinstance(item, list) and len(item) == 3 and item[0] == 'RLE':
+            out.extend([item[2]] * item[1])
+        else:
+            out.append(item)
     return out
 
+# Column encodings: run-length encoded values, or run-length encoded deltas
+# of the values scaled to integers by 10^<digits>
+COLUMN_RLE = 'R'
+COLUMN_DELTA = 'D'
+
+def _flatten(value, path, leaves):
+    if isinstance(value, dict):
+        children = value.items()
+    elif isinstance(value, (list, tuple)):
+        children = enumerate(value)
+    else:
+        leaves[path] = value
+        return
+    for key, child in children:
+        _flatten(child, path + (key,), leaves)
+
+def _assign(node, keys, value):
+    key = keys[0]
+    if key.isdigit():
+        key = int(key)
+        node.extend([None] * (key + 1 - len(node)))
+    if len(keys) == 1:
+        node[key] = value
+        return
+    child = node.get(key) if isinstance(node, dict) else node[key]
+    if not isinstance(child, (list, dict)):
+        child = [] if keys[1].isdigit() else {}
+        node[key] = child
+    _assign(child, keys[1:], value)
+
+# Encode a column of values, with floats rounded to `precision` digits (None
+# = as is), by given `mode` (None = whichever is shorter)
+def EncodeColumn(values, precision=None, mode=None):
+    if precision is not None:
+        values = [ round(v, precision) if isinstance(v, float) else v for v in values ]
+    encoded = [ [ COLUMN_RLE, ArrayRLE(values) ] ]
+    if mode != COLUMN_RLE and all(isinstance(v, (int, float)) and not isinstance(v, bool)
+                                  for v in values):
+        digits = 0 if all(isinstance(v, int) for v in values) else precision
+        if digits is not None:
+            scaled = [ round(v * 10**digits) for v in values ]
+            deltas = scaled[:1] + [ b - a for a, b in zip(scaled, scaled[1:]) ]
+            encoded.append([ COLUMN_DELTA, digits, ArrayRLE(deltas) ])
+    if mode is not None:
+        return encoded[-1]
+    return min(encoded, key=lambda column: len(str(column[-1])))
+
+def DecodeColumn(column):
+    if column[0] == COLUMN_DELTA:
+        _, digits, deltas = column
+        values = itertools.accumulate(ArrayExpand(deltas))
+        return list(values) if digits <= 0 else [ v / 10**digits for v in values ]
+    return ArrayExpand(column[1])
+
+# Transpose a series of digests into columns of their values, by the path of
+# each value in the digest (keys and indexes joined by '.'), then encode
+# each column (see EncodeColumn); `modes` of columns by path. Values absent
+# from some digests are null in their columns.
+def ColumnarSeries(items, precision=None, modes=None):
+    rows = []
+    for item in items:
+        leaves = {}
+        _flatten(item, (), leaves)
+        rows.append(leaves)
+    columns = {}
+    for path in dict.fromkeys(path for row in rows for path in row):
+        name = '.'.join(map(str, path))
+        columns[name] = EncodeColumn([ row.get(path) for row in rows ], precision,
+                                     (modes or {}).get(name))
+    return columns
+
+# Reverse ColumnarSeries, from the number of digests and their columns
+def SeriesFromColumns(length, columns):
+    items = [ None ] * length
+    for path, column in columns.items():
+        keys = path.split('.')
+        for idx, value in enumerate(DecodeColumn(column)):
+            if value is None:
+                continue
+            if items[idx] is None:
+                items[idx] = [] if keys[0].isdigit() else {}
+            _assign(items[idx], keys, value)
+    return items
+
+# Columnar form of a forecast digest (see Feed), with RLE items expanded
+def ForecastColumns(digest, precision=None, modes=None):
+    summary, span, items = digest
+    items = ArrayExpand(items)
+    return [ summary, span, len(items), ColumnarSeries(items, precision, modes) ]
+
+"""
+Columnar ("struct of arrays") encoding of forecast digests, only for topics
+configured in `topics` = { <sub_topic>: <float precision digits> }, e.g.
+`[ "Clear throughout the day.", [ <start>, <end> ], 48, { "T.0": [ "D", 1,
+[ 571, 4, ["RLE", 3, 3], ... ] ], "W.0.1": [ "R", [ ["RLE", 10, "WNW"],
+... ] ], ... } ]`; see ForecastColumns.
+"""
+class ColumnarPayloadEncoder(MQPubCli.PayloadEncoder):
+
+    def __init__(self, topics, *, default=None, modes=None):
+        super().__init__(default=default)
+        self._TOPICS = topics
+        self._MODES = modes or {}
+
+    def encode(self, sub_topic, data):
+        if sub_topic not in self._TOPICS or data is None:
+            return None
+        return json.dumps(ForecastColumns(data, self._TOPICS[sub_topic],
+                                          self._MODES.get(sub_topic)),
+                          default=self._DEFAULT)
+
 def PrecipDigest(data):
     out = [ data.precip_probability, getattr(data, 'precip_type', '-') ]
     if hasattr(data, 'precip_intensity_error'):
@@ -106,14 +215,162 @@ def ForecastDigestEx(data):
     )
     return out
 
+"""
+Delta encoding of a forecast digest (hourly or daily, see Feed), published
+as a base snapshot every `base_every` changes, and as patches against the
+previous state in between. Each change takes the next sequence number:
+- Base: `[ <seq>, <forecast digest> ]`
+- Patch: `[ <seq>, <shift>, <length>, <summary>, [ <start>, <end> ],
+  [ [ <index>, { <changed field>: <value> } ], ... ] ]`, i.e. drop `shift`
+  entries from the front (the forecast moved `shift` steps of `step`
+  seconds on), truncate or extend to `length` entries, and update the
+  changed fields of entries at given indexes (new entries in full).
+A patch is only made if it applies to the state of the previous sequence
+number, and is smaller than a base.
+"""
+class ForecastDelta:
+
+    def __init__(self, step, base_every):
+        self._STEP = step
+        self._BASE_EVERY = base_every
+        self._SEQ = 0
+        self._LAST = None
+        self._PATCHES = 0
+
+    # The base of the current state, or None if no state yet
+    def base(self):
+        return None if self._LAST is None else [ self._SEQ, self._LAST ]
+
+    # Update the state to given digest, returning the base or the patch to
+    # publish as ( 'base' | 'patch', <data> ), or None if unchanged
+    def update(self, digest):
+        if digest is None or digest == self._LAST:
+            return None
+        patch = None
+        if self._LAST is not None and self._PATCHES + 1 < self._BASE_EVERY:
+            patch = self._patch(self._LAST, digest)
+        self._SEQ += 1
+        self._LAST = digest
+        if patch is not None:
+            patch = [ self._SEQ, *patch ]
+            if len(json.dumps(patch)) < len(json.dumps(self.base())):
+                self._PATCHES += 1
+                return 'patch', patch
+        self._PATCHES = 0
+        return 'base', self.base()
+
+    def _patch(self, last, digest):
+        summary, (start, end), items = digest
+        _, (last_start, _), last_items = last
+        shift, misaligned = divmod(start - last_start, self._STEP)
+        if misaligned or not 0 <= shift <= len(last_items):
+            return None
+        kept = last_items[shift:]
+        changes = []
+        for idx, item in enumerate(items):
+            if idx < len(kept):
+                fields = { key: value for key, value in item.items() if kept[idx].get(key) != value }
+                if fields:
+                    changes.append([ idx, fields ])
+            else:
+                changes.append([ idx, item ])
+        return [ shift, len(items), summary, [ start, end ], changes ]
+
+# Feed digests in a snapshot, by name of the digest method
+SNAPSHOT_DIGESTS = {
+    'stamp': 'stamp',
+    'current': 'current_condition',
+    'minutely': 'minutely_forecast',
+    'hourly': 'hourly_forecast',
+    'daily': 'daily_forecast',
+    'alerts': 'alerts',
+}
+
+"""
+Digests of the weather data fetched from a provider (see WeatherProviders).
+Once started, the feed refreshes in a background worker every `interval`
+seconds; failed refreshes are retried after an exponential backoff between
+`backoff` = ( <min>, <max> ) seconds. Delays are randomized by +/-`jitter`,
+so that feeds of several deployments drift apart.
+"""
 class Feed:
 
-    def __init__(self, apikey, loc):
-        self._OBSERVER = WeatherObserver(apikey, loc)
+    def __init__(self, provider, *, interval=300, backoff=(30, 1800), jitter=0.1):
+        self._PROVIDER = provider
         self._DATA = None
+        self._INTERVAL = interval
+        self._BACKOFF = backoff
+        self._JITTER = jitter
+        # Digests of the last good refresh, and when they were made
+        self._SNAPSHOT = None
+        self._SNAPSHOT_TS = None
+        self._FAILURES = 0
+        self._LOCK = threading.Lock()
+        self._THREAD = None
+        self._STOP_EVT = threading.Event()
+        # Set once the first refresh is attempted
+        self._ATTEMPTED = threading.Event()
+
+    # Start refreshing in the background, if not yet
+    def start(self):
+        with self._LOCK:
+            if self._THREAD is None:
+                self._STOP_EVT.clear()
+                self._THREAD = threading.Thread(target=self._run, daemon=True)
+                self._THREAD.start()
+
+    def stop(self):
+        self._STOP_EVT.set()
+        with self._LOCK:
+            thread, self._THREAD = self._THREAD, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._STOP_EVT.is_set():
+            if self._update():
+                self._FAILURES = 0
+                delay = self._INTERVAL
+            else:
+                self._FAILURES += 1
+                delay = min(self._BACKOFF[0] * 2**(self._FAILURES-1), self._BACKOFF[1])
+            self._ATTEMPTED.set()
+            self._STOP_EVT.wait(delay * random.uniform(1-self._JITTER, 1+self._JITTER))
+
+    # Refresh and digest the data into a new snapshot, keeping the last good
+    # one if either fails
+    def _update(self):
+        try:
+            self.refresh()
+            snapshot = { name: getattr(self, method)() for name, method in SNAPSHOT_DIGESTS.items() }
+            if snapshot['stamp'] is None:
+                raise Exception("No stamp in weather data")
+        except Exception as e:
+            _logger.warning("Failed to refresh weather data (%d failed before): %s",
+                            self._FAILURES, e)
+            return False
+        with self._LOCK:
+            self._SNAPSHOT = snapshot
+            self._SNAPSHOT_TS = time.time()
+        return True
+
+    # The digests of the last good refresh, and their age (seconds), or None
+    # if none yet. Before the first refresh is attempted, wait for it up to
+    # `wait` seconds.
+    def snapshot(self, wait=0):
+        if wait and not self._ATTEMPTED.is_set():
+            self._ATTEMPTED.wait(wait)
+        with self._LOCK:
+            if self._SNAPSHOT is None:
+                return None
+            return self._SNAPSHOT, time.time() - self._SNAPSHOT_TS
+
+    # Number of consecutive failed refreshes
+    def failures(self):
+        return self._FAILURES
 
     def refresh(self):
-        self._DATA = self._OBSERVER()
+        self._DATA = self._PROVIDER.fetch()
         return self.stamp()
 
     def stamp(self):
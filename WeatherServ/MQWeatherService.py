@@ -1,12 +1,13 @@
 import os
 import logging
 import time
-import json
 import signal
+import threading
 
 from common import MQPubCli
 
-from DarkSkyObserver import Feed as DSOFeed
+from DarkSkyObserver import Feed as DSOFeed, ForecastDelta, ColumnarPayloadEncoder
+from WeatherProviders import MakeProvider, DEFAULT_TIMEOUT
 
 from __deploy__ import Config
 
@@ -15,35 +16,119 @@ logging.basicConfig(level=logging.NOTSET if DEBUG else logging.WARNING)
 
 DRYRUN = os.environ.get('DRYRUN')
 
-WEATHER_FEED = DSOFeed(Config.WS_APIKEY, Config.LOCAL_COORD)
+WEATHER_FEED = DSOFeed(MakeProvider(getattr(Config, 'WS_PROVIDER', 'darksky'),
+                                    Config.WS_APIKEY, Config.LOCAL_COORD,
+                                    url=getattr(Config, 'WS_URL', None),
+                                    units=getattr(Config, 'WS_UNITS', 'auto'),
+                                    timeout=getattr(Config, 'WS_TIMEOUT', DEFAULT_TIMEOUT)),
+                       interval=getattr(Config, 'WS_REFRESH', None) or Config.INTERVAL,
+                       backoff=getattr(Config, 'WS_BACKOFF', (30, 1800)))
+
+# Seconds the first tick waits for the first refresh (started on connecting),
+# kept short as it holds up the loop shared by hosted services
+SNAPSHOT_WAIT = min(getattr(Config, 'WS_FIRST_WAIT', 5), Config.INTERVAL / 2)
+
+# Published topics of the feed snapshot digests
+FEED_TOPICS = {
+    'stamp': 'stamp',
+    'current': 'current',
+    'minutely': 'forecast/minutely',
+    'hourly': 'forecast/hourly',
+    'daily': 'forecast/daily',
+    'alerts': 'alerts',
+}
+
+# Delta encoded forecasts, published on `<topic>/base` and `<topic>/patch`
+# in addition to the full forecasts; devices request a resync (a base of the
+# current state) by publishing to `<topic>/resync`
+DELTA_STEPS = {
+    'hourly': 3600,
+    'daily': 86400,
+}
+DELTAS = { name: ForecastDelta(DELTA_STEPS[name], getattr(Config, 'DELTA_BASE_EVERY', 12))
+           for name in getattr(Config, 'DELTA_TOPICS', []) }
+DELTA_LOCK = threading.Lock()
+RESYNC_SUB_TOPIC = 'resync'
+RESYNC_LIMITER = MQPubCli.RateLimiter(1 / getattr(Config, 'DELTA_RESYNC_INTERVAL', 10), 1)
 
 class MQWeatherService(MQPubCli.IntervalPublisher):
 
-    def on_interval(self, unix_ts):
-        STAMP = WEATHER_FEED.refresh()
-        self._publish('stamp', json.dumps(STAMP), retain=True)
-
-        CC = WEATHER_FEED.current_condition()
-        self._publish('current', json.dumps(CC), retain=True)
-
-        MC = WEATHER_FEED.minutely_forecast()
-        self._publish('forecast/minutely', json.dumps(MC), retain=True)
-
-        HC = WEATHER_FEED.hourly_forecast()
-        self._publish('forecast/hourly', json.dumps(HC), retain=True)
-
-        DC = WEATHER_FEED.daily_forecast()
-        self._publish('forecast/daily', json.dumps(DC), retain=True)
+    def on_connected(self, unix_ts, con_count):
+        # Warm up the feed while waiting for the first tick
+        WEATHER_FEED.start()
 
-        ALERTS = WEATHER_FEED.alerts()
-        self._publish('alerts', json.dumps(ALERTS), retain=True)
-
-service = MQWeatherService(__name__, Config.TOPIC_PFX, DRYRUN)
-
-# Handle keyboard interruption
-def CtrlCHandler(sig, frame):
-    service.stop()
-signal.signal(signal.SIGINT, CtrlCHandler)
-
-service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
-            Config.CACERTS, Config.INTERVAL)
+    # Publish the latest good snapshot of the feed, which refreshes on its
+    # own schedule; only the first tick waits for the first refresh, up to
+    # SNAPSHOT_WAIT seconds (nothing is published until it is ready)
+    def on_interval(self, unix_ts):
+        WEATHER_FEED.start()
+        SNAPSHOT = WEATHER_FEED.snapshot(wait=SNAPSHOT_WAIT)
+        if WEATHER_FEED.failures():
+            self._STATS.count('feed_failing')
+        if SNAPSHOT is None:
+            self._STATS.count('feed_empty')
+            self._LOGGER.warning("No weather data to publish yet")
+            return
+        DIGESTS, AGE = SNAPSHOT
+        for name, topic in FEED_TOPICS.items():
+            DATA = DIGESTS[name]
+            if name == 'stamp':
+                DATA = [ *DATA, int(AGE) ]
+            self._publishData(topic, DATA, retain=True)
+            if name in DELTAS:
+                self._publishDelta(topic, DELTAS[name], DATA)
+
+    # Publish the base or patch of the delta encoded forecast
+    def _publishDelta(self, topic, delta, data):
+        with DELTA_LOCK:
+            update = delta.update(MQPubCli.QuantizeFloats(data, self._PRECISION.get(topic)))
+        if update is None:
+            return
+        kind, DATA = update
+        self._STATS.count('delta_' + kind)
+        if kind == 'base':
+            self._publishData('/'.join((topic, kind)), DATA, retain=True)
+        else:
+            # Patches only apply on top of the base, so are never retained
+            # whatever the delivery profile of the topic
+            self._publishData('/'.join((topic, kind)), DATA, qos=1, profile=None)
+
+    # Reply to resync requests with the base of the current state
+    def on_receive(self, unix_ts, topic, message, qos, retain):
+        name = topic.rsplit('/', 2)[-2]
+        if name not in DELTAS or not RESYNC_LIMITER.allow(name):
+            self._LOGGER.debug("Resync of '%s' ignored", name)
+            return
+        with DELTA_LOCK:
+            BASE = DELTAS[name].base()
+        # Sent even if unchanged, as the device asked for it
+        if BASE is not None and self._publishData('/'.join((FEED_TOPICS[name], 'base')), BASE,
+                                                  retain=True, dedup=False):
+            self._STATS.count('delta_resync')
+
+SUB_PAIRS = [ (os.path.join(Config.TOPIC_PFX, FEED_TOPICS[name], RESYNC_SUB_TOPIC), 0)
+              for name in DELTAS ]
+
+OPTIONS = MQPubCli.ConfigOptions(Config)
+# Forecasts also published in columnar encoding, on `<topic>/cols`
+if getattr(Config, 'COLUMNAR', None):
+    OPTIONS['encoders']['cols'] = ColumnarPayloadEncoder(Config.COLUMNAR)
+
+service = MQWeatherService(__name__, Config.TOPIC_PFX, DRYRUN, sub_pairs=SUB_PAIRS,
+                           **OPTIONS)
+
+# Publishing schedule, also used when hosted by the service host
+SCHEDULE = {
+    'interval': Config.INTERVAL,
+    'align': getattr(Config, 'ALIGN', False)
+}
+
+if __name__ == '__main__':
+    # Handle keyboard interruption
+    def CtrlCHandler(sig, frame):
+        service.stop()
+    signal.signal(signal.SIGINT, CtrlCHandler)
+
+    service.run(Config.SERVER, Config.PORT, Config.USER, Config.PASS,
+                Config.CACERTS, **SCHEDULE)
+    WEATHER_FEED.stop()
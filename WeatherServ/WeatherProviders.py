@@ -0,0 +1,230 @@
+# Weather data providers, fetching forecasts from weather service APIs and
+# normalizing them to the DarkSky data model digested by the Feed
+
+import re
+import logging
+
+from types import SimpleNamespace
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+# Connect and read timeouts (seconds) of API requests
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Forecast blocks absent from a response (e.g. no minutely forecast in the
+# region, no active alert) default to empty
+EMPTY_BLOCKS = {
+    'minutely': { 'summary': None, 'data': [] },
+    'hourly': { 'summary': None, 'data': [] },
+    'daily': { 'summary': None, 'data': [] },
+    'alerts': [],
+}
+
+def SnakeCase(name):
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+# Convert JSON data to nested namespaces, with keys renamed by `rename`
+def ToNamespace(data, rename=None):
+    if isinstance(data, dict):
+        return SimpleNamespace(**{ (rename(k) if rename else k): ToNamespace(v, rename)
+                                   for k, v in data.items() })
+    if isinstance(data, list):
+        return [ ToNamespace(v, rename) for v in data ]
+    return data
+
+"""
+Base of weather providers. Requests are made over a persistent (keep-alive)
+session with connect and read timeouts, and are conditional: when the
+upstream data is unchanged (304 Not Modified), the data normalized from the
+last response are returned as is.
+- `url`: base URL of the API (None = the provider's), e.g. of a compatible
+  API or a local stub server;
+- `units`, `lang`: units and language of the data, in DarkSky terms.
+"""
+class WeatherProvider:
+    URL = None
+
+    def __init__(self, apikey, loc, *, url=None, units='auto', lang='en',
+                 timeout=DEFAULT_TIMEOUT):
+        self._APIKEY = apikey
+        self._LOC = loc
+        self._URL = (url or self.URL).rstrip('/')
+        self._UNITS = units
+        self._LANG = lang
+        self._TIMEOUT = timeout
+        self._SESSION = requests.Session()
+        # Validators of the last response, and the data normalized from it
+        self._VALIDATORS = {}
+        self._DATA = None
+
+    # Fetch the latest data, normalized to the DarkSky data model
+    def fetch(self):
+        url, params = self._request()
+        headers = {}
+        if self._DATA is not None:
+            if 'ETag' in self._VALIDATORS:
+                headers['If-None-Match'] = self._VALIDATORS['ETag']
+            if 'Last-Modified' in self._VALIDATORS:
+                headers['If-Modified-Since'] = self._VALIDATORS['Last-Modified']
+        response = self._SESSION.get(url, params=params, headers=headers,
+                                     timeout=self._TIMEOUT)
+        if response.status_code == 304 and self._DATA is not None:
+            _logger.debug("Weather data not modified")
+            return self._DATA
+        response.raise_for_status()
+        self._VALIDATORS = { name: response.headers[name] for name in ('ETag', 'Last-Modified')
+                             if name in response.headers }
+        self._DATA = self._normalize(response.json())
+        return self._DATA
+
+    def close(self):
+        self._SESSION.close()
+
+    # Override to return the ( <URL>, <query parameters> ) of the request
+    def _request(self):
+        raise NotImplementedError()
+
+    # Override to normalize the response to the DarkSky data model
+    def _normalize(self, payload):
+        raise NotImplementedError()
+
+"""
+DarkSky API, or a compatible one (e.g. Pirate Weather) at `url`
+"""
+class DarkSkyProvider(WeatherProvider):
+    URL = 'https://api.darksky.net/forecast'
+
+    def _request(self):
+        return (
+            '%s/%s/%s,%s' % (self._URL, self._APIKEY, self._LOC['lat'], self._LOC['long']),
+            { 'units': self._UNITS, 'lang': self._LANG }
+        )
+
+    def _normalize(self, payload):
+        return ToNamespace({ **EMPTY_BLOCKS, **payload }, SnakeCase)
+
+"""
+OpenWeatherMap One Call API. Units are 'us' (imperial) or 'si' (metric, for
+any other), and values are converted to their DarkSky counterparts; those
+not provided (e.g. ozone, times of daily peaks) are None.
+"""
+class OpenWeatherMapProvider(WeatherProvider):
+    URL = 'https://api.openweathermap.org/data/3.0/onecall'
+
+    METERS_IN_MILE = 1609.344
+    MM_IN_INCH = 25.4
+
+    def _request(self):
+        return (
+            self._URL,
+            { 'lat': self._LOC['lat'], 'lon': self._LOC['long'], 'appid': self._APIKEY,
+              'units': 'imperial' if self._UNITS == 'us' else 'metric', 'lang': self._LANG }
+        )
+
+    def _distance(self, meters):
+        if meters is None:
+            return None
+        return round(meters / (self.METERS_IN_MILE if self._UNITS == 'us' else 1000), 3)
+
+    # Precipitation intensity (per hour) and type, from amounts (mm) of rain
+    # and snow over given hours
+    def _precip(self, rain, snow, hours=1):
+        intensity = (rain + snow) / hours
+        if self._UNITS == 'us':
+            intensity /= self.MM_IN_INCH
+        precip = { 'precip_intensity': round(intensity, 4) }
+        if intensity:
+            precip['precip_type'] = 'snow' if snow > rain else 'rain'
+        return precip
+
+    # Fields shared by current, hourly and daily data
+    def _point(self, item):
+        weather = (item.get('weather') or [{}])[0]
+        return {
+            'time': item['dt'],
+            'summary': item.get('summary') or weather.get('description', '').capitalize(),
+            'icon': weather.get('icon'),
+            'humidity': item['humidity'] / 100,
+            'dew_point': item['dew_point'],
+            'pressure': item['pressure'],
+            'wind_bearing': item['wind_deg'],
+            'wind_speed': item['wind_speed'],
+            'wind_gust': item.get('wind_gust', item['wind_speed']),
+            'cloud_cover': item['clouds'] / 100,
+            'visibility': self._distance(item.get('visibility')),
+            'ozone': None,
+            'uv_index': item['uvi'],
+        }
+
+    # Current or hourly data, with precipitation of the last/next hour
+    def _hourly(self, item):
+        precip = self._precip(item.get('rain', {}).get('1h', 0), item.get('snow', {}).get('1h', 0))
+        return {
+            **self._point(item),
+            'temperature': item['temp'],
+            'apparent_temperature': item['feels_like'],
+            'precip_probability': item.get('pop', 1 if precip['precip_intensity'] else 0),
+            **precip,
+        }
+
+    def _daily(self, item):
+        feels_like = item['feels_like'].values()
+        return {
+            **self._point(item),
+            'sunrise_time': item.get('sunrise'),
+            'sunset_time': item.get('sunset'),
+            'moon_phase': item.get('moon_phase'),
+            'temperature_high': item['temp']['max'],
+            'temperature_high_time': None,
+            'temperature_low': item['temp']['min'],
+            'temperature_low_time': None,
+            'apparent_temperature_high': max(feels_like),
+            'apparent_temperature_high_time': None,
+            'apparent_temperature_low': min(feels_like),
+            'apparent_temperature_low_time': None,
+            'wind_gust_time': None,
+            'uv_index_time': None,
+            'precip_probability': item.get('pop', 0),
+            **self._precip(item.get('rain', 0), item.get('snow', 0), 24),
+            'precip_intensity_max': None,
+            'precip_intensity_max_time': None,
+        }
+
+    def _minutely(self, item):
+        precip = self._precip(item['precipitation'], 0)
+        return {
+            'time': item['dt'],
+            'precip_probability': 1 if precip['precip_intensity'] else 0,
+            'precip_intensity': precip['precip_intensity'],
+        }
+
+    def _normalize(self, payload):
+        data = {
+            **EMPTY_BLOCKS,
+            'latitude': payload['lat'],
+            'longitude': payload['lon'],
+            'timezone': payload.get('timezone'),
+            'currently': self._hourly(payload['current']),
+            'alerts': [ { 'title': alert['event'], 'time': alert['start'], 'expires': alert['end'],
+                          'description': alert['description'] }
+                        for alert in payload.get('alerts', []) ],
+            'flags': { 'units': 'us' if self._UNITS == 'us' else 'si' },
+        }
+        for block, convert in (('minutely', self._minutely), ('hourly', self._hourly),
+                               ('daily', self._daily)):
+            if block in payload:
+                data[block] = { 'summary': None, 'data': [ convert(item) for item in payload[block] ] }
+        return ToNamespace(data)
+
+PROVIDERS = {
+    'darksky': DarkSkyProvider,
+    'openweathermap': OpenWeatherMapProvider,
+}
+
+# Create the weather provider of given name (see PROVIDERS)
+def MakeProvider(name, apikey, loc, **kwargs):
+    if name not in PROVIDERS:
+        raise Exception("Unknown weather provider '%s'" % name)
+    return PROVIDERS[name](apikey, loc, **kwargs)
@@ -1,10 +1,699 @@
 # Common implementatiosn of MQTT data publishers
 
 import os
+import gc
+import math
+import bisect
+import mmap
+import zlib
 import time
+import json
+import struct
+import signal
+import hashlib
 import logging
+import threading
 import paho.mqtt.client as mqtt
 
+# Optional compact payload encodings
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# Policies for ticks missed due to slow callbacks or system suspension
+MISSED_SKIP = 'skip'            # Drop missed ticks, resume at the next slot
+MISSED_CATCHUP = 'catchup'      # Run every missed tick back-to-back
+MISSED_COALESCE = 'coalesce'    # Run one tick for all missed, then resume
+
+"""
+A deadline-based tick scheduler driven by the monotonic clock
+"""
+class IntervalScheduler:
+
+    def __init__(self, interval, *, align=False, offset=0, missed=MISSED_SKIP,
+                 grace=None):
+        if interval <= 0:
+            raise Exception("Interval must be positive!")
+        if missed not in (MISSED_SKIP, MISSED_CATCHUP, MISSED_COALESCE):
+            raise Exception("Unknown missed tick policy '%s'" % missed)
+        self._INTERVAL = interval
+        # Align ticks to wall-clock multiples of interval (plus offset),
+        # e.g. interval = 10 ticks on :00, :10, :20...
+        self._ALIGN = align
+        self._OFFSET = offset
+        self._MISSED = missed
+        # A tick running later than this is considered missed
+        self._GRACE = interval / 2 if grace is None else grace
+        self._DEADLINE = None
+        self._WALLOFS = None
+        self._MISSCOUNT = 0
+
+    # The offset between wall-clock and monotonic time
+    @staticmethod
+    def _wallOffset():
+        return time.time() - time.monotonic()
+
+    # Compute the first tick deadline after `now` (monotonic time)
+    def _firstSlot(self, now):
+        if not self._ALIGN:
+            return now + self._INTERVAL
+        self._WALLOFS = self._wallOffset()
+        wall_now = now + self._WALLOFS
+        slot = math.floor((wall_now - self._OFFSET) / self._INTERVAL) + 1
+        return slot * self._INTERVAL + self._OFFSET - self._WALLOFS
+
+    # (Re)start scheduling from now
+    def start(self):
+        self._DEADLINE = self._firstSlot(time.monotonic())
+        self._MISSCOUNT = 0
+
+    # Number of ticks missed since start()
+    def missed(self):
+        return self._MISSCOUNT
+
+    # Seconds until the next tick is due
+    def remaining(self):
+        return self._DEADLINE - time.monotonic()
+
+    # Consume the due tick, if any, and advance the deadline.
+    # Returns the number of times the tick callback should run.
+    def fire(self):
+        now = time.monotonic()
+        if now < self._DEADLINE:
+            return 0
+        if self._ALIGN and abs(self._wallOffset() - self._WALLOFS) > self._GRACE:
+            # Wall-clock was stepped, re-align to the new wall-clock
+            self._DEADLINE = self._firstSlot(now)
+            return 1
+
+        # Slots passed since the deadline, and how late is the latest one
+        passed = int((now - self._DEADLINE) // self._INTERVAL)
+        late = now - self._DEADLINE - passed * self._INTERVAL
+        self._DEADLINE += (passed + 1) * self._INTERVAL
+        missed = passed + (1 if late > self._GRACE else 0)
+        if missed:
+            self._MISSCOUNT += missed
+            if self._MISSED == MISSED_SKIP:
+                return 0 if late > self._GRACE else 1
+            if self._MISSED == MISSED_CATCHUP:
+                return passed + 1
+        return 1
+
+    # Block until the next tick is due, or the stop event is set.
+    # Returns the number of times the tick callback should run (0 if stopped).
+    def wait(self, stop_evt):
+        while not stop_evt.wait(max(self.remaining(), 0)):
+            runs = self.fire()
+            if runs:
+                return runs
+        return 0
+
+# Round floats in data to given decimal digits.
+# The `spec` mirrors the data structure: an int applies to all floats within,
+# a dict or list applies per key or index, and None keeps values unchanged.
+def QuantizeFloats(data, spec):
+    if spec is None:
+        return data
+    if isinstance(spec, int):
+        if isinstance(data, float):
+            return round(data, spec)
+        if isinstance(data, dict):
+            return {k: QuantizeFloats(v, spec) for k, v in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [QuantizeFloats(v, spec) for v in data]
+        return data
+    if isinstance(spec, dict) and isinstance(data, dict):
+        return {k: QuantizeFloats(v, spec.get(k)) for k, v in data.items()}
+    if isinstance(spec, (list, tuple)) and isinstance(data, (list, tuple)):
+        return [QuantizeFloats(v, spec[i] if i < len(spec) else None)
+                for i, v in enumerate(data)]
+    return data
+
+"""
+Base of payload encoders, which turn structured data into message payloads.
+- `default`: converts objects not natively supported by the encoding.
+"""
+class PayloadEncoder:
+
+    def __init__(self, *, default=None):
+        self._DEFAULT = default
+
+    # Encode the data of a topic, returns None if not applicable
+    def encode(self, sub_topic, data):
+        raise NotImplementedError()
+
+# Human readable, the primary encoding of all topics
+class JSONPayloadEncoder(PayloadEncoder):
+
+    def encode(self, sub_topic, data):
+        return json.dumps(data, default=self._DEFAULT)
+
+class MsgPackPayloadEncoder(PayloadEncoder):
+
+    def __init__(self, *, default=None, single_float=False):
+        if msgpack is None:
+            raise Exception("MessagePack encoding requires 'msgpack' module!")
+        super().__init__(default=default)
+        self._SINGLE_FLOAT = single_float
+
+    def encode(self, sub_topic, data):
+        return msgpack.packb(data, default=self._DEFAULT,
+                             use_single_float=self._SINGLE_FLOAT)
+
+class CBORPayloadEncoder(PayloadEncoder):
+
+    def __init__(self, *, default=None):
+        if cbor2 is None:
+            raise Exception("CBOR encoding requires 'cbor2' module!")
+        super().__init__(default=default)
+
+    def _cbor_default(self, encoder, value):
+        if self._DEFAULT is None:
+            raise TypeError("Cannot encode type %s" % type(value))
+        encoder.encode(self._DEFAULT(value))
+
+    def encode(self, sub_topic, data):
+        return cbor2.dumps(data, default=self._cbor_default)
+
+# Fixed binary layout, only for topics with a layout defined.
+# - `layouts`: { <sub_topic>: ( <struct format>, [ <field path>, ... ] ) },
+#   where each field path is a tuple of keys/indices into the data.
+class StructPayloadEncoder(PayloadEncoder):
+
+    def __init__(self, layouts, *, default=None):
+        super().__init__(default=default)
+        self._LAYOUTS = {topic: (struct.Struct(fmt), fields)
+                         for topic, (fmt, fields) in layouts.items()}
+
+    def encode(self, sub_topic, data):
+        layout = self._LAYOUTS.get(sub_topic)
+        if layout is None:
+            return None
+        values = []
+        for path in layout[1]:
+            value = data
+            for key in path:
+                value = value[key]
+            values.append(value)
+        return layout[0].pack(*values)
+
+PAYLOAD_ENCODERS = {
+    'json': JSONPayloadEncoder,
+    'msgpack': MsgPackPayloadEncoder,
+    'cbor': CBORPayloadEncoder,
+}
+
+# Create payload encoders from configuration, e.g. { 'bin': 'msgpack' },
+# each publishes on a parallel topic `<topic>/<suffix>`.
+# The JSON encoder is always included for the topic itself.
+def MakeEncoders(encodings, *, default=None):
+    encoders = { '': JSONPayloadEncoder(default=default) }
+    for suffix, encoding in (encodings or {}).items():
+        if isinstance(encoding, PayloadEncoder):
+            encoders[suffix] = encoding
+        elif encoding in PAYLOAD_ENCODERS:
+            encoders[suffix] = PAYLOAD_ENCODERS[encoding](default=default)
+        else:
+            raise Exception("Unknown payload encoding '%s'" % encoding)
+    return encoders
+
+# Convert a message to its payload bytes
+def PayloadBytes(message):
+    if message is None:
+        return b''
+    if isinstance(message, bytes):
+        return message
+    return str(message).encode('utf-8')
+
+"""
+Token-bucket rate limits by key (e.g. per device): up to `burst` events at
+once, refilled at `rate` events per second. Only the `max_keys` most
+recently seen keys are tracked.
+"""
+class RateLimiter:
+
+    def __init__(self, rate, burst, *, max_keys=1024):
+        self._RATE = rate
+        self._BURST = burst
+        self._MAX_KEYS = max_keys
+        # Buckets by key, in the order last seen: ( <tokens>, <time> )
+        self._BUCKETS = {}
+
+    # Check if an event of given key is allowed, and take its token if so
+    def allow(self, key=None):
+        now = time.monotonic()
+        tokens, last = self._BUCKETS.pop(key, (self._BURST, now))
+        tokens = min(self._BURST, tokens + (now - last) * self._RATE)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._BUCKETS[key] = (tokens, now)
+        if len(self._BUCKETS) > self._MAX_KEYS:
+            del self._BUCKETS[next(iter(self._BUCKETS))]
+        return allowed
+
+    # Give back the token taken by an allowed event of given key, e.g. when
+    # another limit then denied it
+    def refund(self, key=None):
+        if key in self._BUCKETS:
+            tokens, last = self._BUCKETS[key]
+            self._BUCKETS[key] = (min(self._BURST, tokens + 1), last)
+
+"""
+A bounded spool of outbound messages, kept in a memory-mapped file.
+Only the latest message per topic is kept. Records are appended, and when
+the file is full, the live records are compacted to the beginning (the
+oldest dropped if still not fitting). Records superseded or discarded are
+marked dead in place, so that they are not recovered. Survives process
+restarts.
+"""
+class OutboundSpool:
+    # Record header: magic, sequence, crc32, payload length, qos, retain, topic length
+    _RECORD = struct.Struct('<4sIIIBBH')
+    _MAGIC = b'MQSR'
+    _MAGIC_DEAD = b'MQSD'
+
+    def __init__(self, path, size):
+        if size < self._RECORD.size * 2:
+            raise Exception("Spool size %d is too small!" % size)
+        self._LOGGER = logging.getLogger('OutboundSpool')
+        self._PATH = os.path.abspath(path)
+        self._SIZE = size
+        self._LOCK = threading.Lock()
+        # Live records by topic: [ <sequence>, <offset>, <length> ]
+        self._INDEX = {}
+        self._TAIL = 0
+        self._SEQ = 0
+        mode = 'r+b' if os.path.exists(self._PATH) else 'w+b'
+        with open(self._PATH, mode) as f:
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(0)
+                f.truncate(size)
+            self._MAP = mmap.mmap(f.fileno(), size)
+        self._recover()
+        if self._INDEX:
+            self._LOGGER.info("Recovered %d spooled messages", len(self._INDEX))
+
+    # Rebuild the index from records in the file
+    def _recover(self):
+        offset = 0
+        while offset + self._RECORD.size <= self._SIZE:
+            record = self._read(offset)
+            if record is None:
+                break
+            seq, topic, _, _, _, length, dead = record
+            live = self._INDEX.get(topic)
+            if not dead and (live is None or live[0] < seq):
+                self._INDEX[topic] = [seq, offset, length]
+            self._SEQ = max(self._SEQ, seq)
+            offset += length
+        self._TAIL = offset
+
+    # Read a record at offset, returns None if not valid
+    def _read(self, offset):
+        magic, seq, crc, pl_len, qos, retain, tp_len = \
+            self._RECORD.unpack_from(self._MAP, offset)
+        length = self._RECORD.size + tp_len + pl_len
+        if magic not in (self._MAGIC, self._MAGIC_DEAD) or offset + length > self._SIZE:
+            return None
+        body = self._MAP[offset + self._RECORD.size : offset + length]
+        if zlib.crc32(body) != crc:
+            return None
+        topic = body[:tp_len].decode('utf-8')
+        return (seq, topic, body[tp_len:], qos, bool(retain), length,
+                magic == self._MAGIC_DEAD)
+
+    # Mark the record at offset dead, keeping it for walking the records
+    def _kill(self, offset):
+        self._MAP[offset : offset + len(self._MAGIC_DEAD)] = self._MAGIC_DEAD
+
+    # Write a record at offset, and mark the end of records after it
+    def _write(self, offset, seq, topic, payload, qos, retain):
+        body = topic + payload
+        length = self._RECORD.size + len(body)
+        self._RECORD.pack_into(self._MAP, offset, self._MAGIC, seq,
+                               zlib.crc32(body), len(payload), qos,
+                               1 if retain else 0, len(topic))
+        self._MAP[offset + self._RECORD.size : offset + length] = body
+        if offset + length + 4 <= self._SIZE:
+            self._MAP[offset + length : offset + length + 4] = b'\0' * 4
+        return length
+
+    # Move live records to the beginning, making room for `reserve` bytes
+    def _compact(self, reserve):
+        live = sorted(self._INDEX.items(), key=lambda e: e[1][0])
+        records = [(topic, self._MAP[offset : offset + length])
+                   for topic, (_, offset, length) in live]
+        total = sum(len(r) for _, r in records)
+        while records and total + reserve > self._SIZE:
+            topic, record = records.pop(0)
+            total -= len(record)
+            del self._INDEX[topic]
+            self._LOGGER.warning("Spool full, dropped message for '%s'", topic)
+        offset = 0
+        for topic, record in records:
+            self._MAP[offset : offset + len(record)] = record
+            self._INDEX[topic][1] = offset
+            offset += len(record)
+        if offset + 4 <= self._SIZE:
+            self._MAP[offset : offset + 4] = b'\0' * 4
+        self._TAIL = offset
+
+    def __len__(self):
+        return len(self._INDEX)
+
+    # Stash a message, superseding any earlier one of the same topic
+    def put(self, topic, message, qos, retain):
+        topic = topic.encode('utf-8')
+        payload = PayloadBytes(message)
+        length = self._RECORD.size + len(topic) + len(payload)
+        if length > self._SIZE:
+            self._LOGGER.warning("Message too large to spool (%d bytes)", length)
+            return False
+        with self._LOCK:
+            live = self._INDEX.pop(topic.decode('utf-8'), None)
+            if live is not None:
+                self._kill(live[1])
+            if self._TAIL + length > self._SIZE:
+                self._compact(length)
+            self._SEQ += 1
+            self._write(self._TAIL, self._SEQ, topic, payload, qos, retain)
+            self._INDEX[topic.decode('utf-8')] = [self._SEQ, self._TAIL, length]
+            self._TAIL += length
+        return True
+
+    # List spooled messages in the order they were stashed, as
+    # [ ( <sequence>, <topic>, <payload>, <qos>, <retain> ), ... ]
+    def items(self):
+        with self._LOCK:
+            records = [self._read(offset) for _, offset, _ in
+                       sorted(self._INDEX.values())]
+        return [r[:5] for r in records if r is not None]
+
+    # Remove a topic's message, or only the given sequence of it, returns
+    # whether it was still spooled
+    def discard(self, topic, seq=None):
+        with self._LOCK:
+            live = self._INDEX.get(topic)
+            if live is None or (seq is not None and live[0] != seq):
+                return False
+            del self._INDEX[topic]
+            self._kill(live[1])
+            if not self._INDEX:
+                self._TAIL = 0
+                self._MAP[0:4] = b'\0' * 4
+        return True
+
+    def close(self):
+        with self._LOCK:
+            self._MAP.flush()
+            self._MAP.close()
+
+# Outcomes of getting the data of a tick from a TickPrefetcher
+PREFETCH_READY = 'ready'        # Computed ahead for the tick
+PREFETCH_STALE = 'stale'        # Computed for an earlier tick, finished late
+PREFETCH_LATE = 'late'          # Not computed by the deadline, nothing to publish
+
+# Function computing the data of a tick, in the prefetch worker process
+_PREFETCH_FUNC = None
+
+def _PrefetchInit(svc_dir, script, func):
+    global _PREFETCH_FUNC
+    # Interruptions are handled by the publisher process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .MQPubHost import LoadService
+    _PREFETCH_FUNC = getattr(LoadService(svc_dir, script), func)
+
+def _PrefetchCall(unix_ts):
+    return _PREFETCH_FUNC(unix_ts)
+
+"""
+Computes the data of upcoming ticks ahead in a worker process, so that heavy
+computations do not hold up the publishing thread (nor the other publishers
+of a host). The worker loads the service script by itself (see
+MQPubHost.LoadService()) and calls its `func(unix_ts)`, which must return
+picklable data. As the worker is spawned afresh, the main script of the
+process must not run when imported (i.e. guarded by `__main__`).
+
+At a tick, the data computed ahead are waited for up to `deadline` seconds,
+then the tick is given up (late), rather than blocking. Data finished late
+for an earlier tick are used if computed at most `max_stale` seconds before,
+otherwise dropped and computed afresh (within the deadline).
+"""
+class TickPrefetcher:
+
+    def __init__(self, svc_dir, script, func, *, deadline=1.0, max_stale=0):
+        self._WORKER_ARGS = (os.path.abspath(svc_dir), script, func)
+        self._DEADLINE = deadline
+        self._MAX_STALE = max_stale
+        self._LOCK = threading.Lock()
+        self._POOL = None
+        # ( <UNIX time>, <future> ) of the data being computed
+        self._PENDING = None
+
+    # Start computing the data of the tick at given time, unless already
+    # computing one. Returns the pending ( <UNIX time>, <future> ).
+    def prefetch(self, unix_ts):
+        with self._LOCK:
+            if self._PENDING is None:
+                if self._POOL is None:
+                    import multiprocessing
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._POOL = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_PrefetchInit,
+                                                     initargs=self._WORKER_ARGS)
+                self._PENDING = (unix_ts, self._POOL.submit(_PrefetchCall, unix_ts))
+            return self._PENDING
+
+    # Get the data of the tick at `unix_ts`, and prefetch the next tick at
+    # `next_ts`. Returns ( <data>, <PREFETCH_*> ), the data is None if late.
+    def get(self, unix_ts, next_ts):
+        from concurrent.futures import BrokenExecutor, TimeoutError
+        deadline = time.monotonic() + self._DEADLINE
+        # Computed for the same tick, if off by less than half an interval
+        tolerance = (next_ts - unix_ts) / 2
+        while True:
+            pending_ts, future = self.prefetch(unix_ts)
+            try:
+                data = future.result(max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                # Still computing, may be used by a later tick
+                return None, PREFETCH_LATE
+            except BrokenExecutor:
+                # The worker died, spawn another for the next tick
+                self.close()
+                raise
+            finally:
+                if future.done():
+                    with self._LOCK:
+                        self._PENDING = None
+            age = abs(unix_ts - pending_ts)
+            if age <= tolerance + self._MAX_STALE:
+                break
+        self.prefetch(next_ts)
+        return data, PREFETCH_STALE if age > tolerance else PREFETCH_READY
+
+    # Stop the worker process, without waiting for pending computation
+    def close(self):
+        with self._LOCK:
+            if self._POOL is not None:
+                self._POOL.shutdown(wait=False, cancel_futures=True)
+                self._POOL = None
+            self._PENDING = None
+
+"""
+Low-overhead counters and latency histograms of a publisher
+"""
+class PublisherStats:
+    # Upper bounds (in seconds) of histogram buckets
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1, 2.5, 5, 10, 30, math.inf)
+    EARLY_ACKS_MAX = 256
+
+    def __init__(self):
+        self._LOCK = threading.Lock()
+        self._START = time.time()
+        self._COUNTERS = {}
+        # Histograms by name: [ <bucket counts>, <sum>, <max> ]
+        self._HISTS = {}
+        # Per-topic [ <messages>, <bytes> ]
+        self._TOPICS = {}
+        # Publish time of messages not yet acknowledged, by message id
+        self._PENDING = {}
+        # Acknowledgements that arrived before publish() returned (or of
+        # other publishers sharing the client), only the latest kept
+        self._EARLY_ACKS = {}
+
+    def count(self, name, n=1):
+        with self._LOCK:
+            self._COUNTERS[name] = self._COUNTERS.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._LOCK:
+            hist = self._HISTS.get(name)
+            if hist is None:
+                hist = self._HISTS[name] = [[0] * len(self.BUCKETS), 0.0, 0.0]
+            hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            hist[1] += seconds
+            hist[2] = max(hist[2], seconds)
+
+    # Record a message sent to the client, `mid` to track its acknowledgement
+    def published(self, topic, size, mid=None, start=None):
+        with self._LOCK:
+            entry = self._TOPICS.get(topic)
+            if entry is None:
+                entry = self._TOPICS[topic] = [0, 0]
+            entry[0] += 1
+            entry[1] += size
+            if mid is None:
+                return
+            acked = self._EARLY_ACKS.pop(mid, None)
+            if acked is None:
+                self._PENDING[mid] = start
+                return
+        self.observe('publish_latency', acked - start)
+
+    # Record the acknowledgement (PUBACK/PUBCOMP, or sent for QoS 0)
+    def acked(self, mid):
+        now = time.monotonic()
+        with self._LOCK:
+            start = self._PENDING.pop(mid, None)
+            if start is None:
+                self._EARLY_ACKS[mid] = now
+                if len(self._EARLY_ACKS) > self.EARLY_ACKS_MAX:
+                    del self._EARLY_ACKS[next(iter(self._EARLY_ACKS))]
+                return
+        self.observe('publish_latency', now - start)
+
+    # Forget messages that will never be acknowledged
+    def dropPending(self):
+        with self._LOCK:
+            self._PENDING.clear()
+            self._EARLY_ACKS.clear()
+
+    def snapshot(self):
+        with self._LOCK:
+            return {
+                'uptime': round(time.time() - self._START, 3),
+                'counters': dict(self._COUNTERS),
+                'inflight': len(self._PENDING),
+                'histograms': {name: {
+                        'buckets': list(hist[0]), 'sum': round(hist[1], 6),
+                        'max': round(hist[2], 6), 'count': sum(hist[0])
+                    } for name, hist in self._HISTS.items()},
+                'topics': {topic: list(entry) for topic, entry in self._TOPICS.items()},
+            }
+
+    # Render a snapshot in Prometheus text exposition format
+    @classmethod
+    def prometheus(cls, snapshot, service):
+        def _labels(**labels):
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                                     for k, v in labels.items())
+        lines = []
+        lines.append('# TYPE mqpub_uptime_seconds gauge')
+        lines.append('mqpub_uptime_seconds%s %s' % (_labels(service=service), snapshot['uptime']))
+        lines.append('# TYPE mqpub_inflight_messages gauge')
+        lines.append('mqpub_inflight_messages%s %d' % (_labels(service=service), snapshot['inflight']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('# TYPE mqpub_%s_total counter' % name)
+            lines.append('mqpub_%s_total%s %s' % (name, _labels(service=service), value))
+        delivery = snapshot.get('delivery')
+        if delivery:
+            lines.append('# TYPE mqpub_qos_messages_total counter')
+            for qos, count in enumerate(delivery['messages']):
+                lines.append('mqpub_qos_messages_total%s %d' % (_labels(service=service, qos=qos), count))
+            lines.append('# TYPE mqpub_packets_saved_total counter')
+            lines.append('mqpub_packets_saved_total%s %d' % (_labels(service=service), delivery['packets_saved']))
+        if 'spooled' in snapshot:
+            lines.append('# TYPE mqpub_spooled_messages gauge')
+            lines.append('mqpub_spooled_messages%s %d' % (_labels(service=service), snapshot['spooled']))
+        for metric, idx in (('messages', 0), ('bytes', 1)):
+            lines.append('# TYPE mqpub_topic_%s_total counter' % metric)
+            for topic, entry in sorted(snapshot['topics'].items()):
+                lines.append('mqpub_topic_%s_total%s %d' %
+                             (metric, _labels(service=service, topic=topic), entry[idx]))
+        for name, hist in sorted(snapshot['histograms'].items()):
+            lines.append('# TYPE mqpub_%s_seconds histogram' % name)
+            cumulative = 0
+            for bound, count in zip(cls.BUCKETS, hist['buckets']):
+                cumulative += count
+                lines.append('mqpub_%s_seconds_bucket%s %d' %
+                             (name, _labels(service=service, le='+Inf' if bound == math.inf else bound),
+                              cumulative))
+            lines.append('mqpub_%s_seconds_sum%s %s' % (name, _labels(service=service), hist['sum']))
+            lines.append('mqpub_%s_seconds_count%s %d' % (name, _labels(service=service), hist['count']))
+        return '\n'.join(lines) + '\n'
+
+# Delivery profiles of messages, as ( <qos>, <retain> )
+DELIVERY_PROFILES = {
+    # Frequent updates that go stale quickly (e.g. clock ticks)
+    'ephemeral': (0, False),
+    # Occasional notifications
+    'event': (1, False),
+    # Latest state, kept by the server for new subscribers
+    'state': (1, True),
+    # Exactly once delivery
+    'reliable': (2, False),
+}
+
+# Number of MQTT packets exchanged per publish at each QoS level
+QOS_PACKETS = (1, 2, 4)
+
+# Publisher options taken from service configuration, if present
+CONFIG_OPTIONS = {
+    'HEARTBEAT': 'heartbeat',
+    'PRECISION': 'precision',
+    'PROFILES': 'profiles',
+    'MAX_INFLIGHT': 'max_inflight',
+    'MAX_QUEUED': 'max_queued',
+    'SPOOL_RATE': 'spool_rate',
+    'STATS_INTERVAL': 'stats_interval',
+    'STATS_TOPIC': 'stats_topic',
+    'STATS_PROMFILE': 'stats_promfile',
+    'MAINT_RELOAD': 'maint_reload',
+    'MAINT_RSS_GROWTH': 'maint_rss_growth',
+}
+
+# Publisher options applied again when the configuration is reloaded
+RELOADABLE_OPTIONS = ( 'heartbeat', 'precision', 'profiles',
+                       'stats_interval', 'stats_topic' )
+
+# Collect publisher options from a service configuration module
+# - `default`: converter of unsupported objects for payload encoders
+def ConfigOptions(config, *, default=None):
+    options = {kw: getattr(config, name) for name, kw in CONFIG_OPTIONS.items()
+               if hasattr(config, name)}
+    options['encoders'] = MakeEncoders(getattr(config, 'ENCODINGS', None),
+                                       default=default)
+    if getattr(config, 'SPOOL_FILE', None):
+        options['spool'] = OutboundSpool(config.SPOOL_FILE,
+                                         getattr(config, 'SPOOL_SIZE', 65536))
+    options['config'] = config
+    return options
+
+# Re-execute a configuration module in place, so that all references to it
+# see the new values (works regardless of how the module was imported)
+def ReloadConfig(config):
+    with open(config.__file__) as f:
+        code = compile(f.read(), config.__file__, 'exec')
+    exec(code, config.__dict__)
+
+# Resident memory size of this process, in KB
+def CurrentRSS():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        import resource
+        # Not available on this platform, use the peak instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
 """
 An MQTT client that publishes at regular interval
 """
@@ -13,17 +702,85 @@ class IntervalPublisher:
 
     def __init__(self, name, topic_pfx, dryrun, *,
                  dryrun_loglevel = logging.WARNING,
-                 sub_pairs = []):
+                 sub_pairs = [],
+                 heartbeat = 0,
+                 encoders = None,
+                 precision = None,
+                 profiles = None,
+                 max_inflight = None,
+                 max_queued = None,
+                 spool = None,
+                 spool_rate = 10,
+                 stats_interval = None,
+                 stats_topic = '_stats',
+                 stats_promfile = None,
+                 config = None,
+                 maint_reload = False,
+                 maint_rss_growth = None):
         self._LOGGER = logging.getLogger(name)
         self._PUB_TOPIC_PFX = topic_pfx or ''
         self._SUB_PAIRS = sub_pairs
         self._DRYRUN = dryrun
         self._DRYRUN_LOGLEVEL = dryrun_loglevel
+        # Payload encoders by topic suffix, see MakeEncoders()
+        self._ENCODERS = encoders or MakeEncoders(None)
+        self._applyOptions(heartbeat=heartbeat, precision=precision,
+                           profiles=profiles, stats_interval=stats_interval,
+                           stats_topic=stats_topic)
+        # Client in-flight and queued message limits
+        self._MAX_INFLIGHT = max_inflight
+        self._MAX_QUEUED = max_queued
+        # Spool of retained messages while disconnected, replayed at
+        # `spool_rate` messages per second after reconnecting
+        self._SPOOL = spool
+        self._SPOOL_RATE = spool_rate
+        self._DRAIN_LOCK = threading.Lock()
+        # Serializes publishing from the main, network and spool replay
+        # threads (see _publish())
+        self._PUB_LOCK = threading.Lock()
+        # Number of messages published at each QoS level
+        self._QOS_COUNTS = [0] * len(QOS_PACKETS)
+        # Self-telemetry, also written to a Prometheus text file
+        self._STATS = PublisherStats()
+        self._STATS_PROMFILE = stats_promfile and os.path.abspath(stats_promfile)
+        self._STATS_LAST = time.monotonic()
+        self._SCHED = None
+        # Mid-night maintenance: reload `config` module, and terminate for
+        # restart if memory grew more than `maint_rss_growth` MB
+        self._CONFIG = config
+        self._MAINT_RELOAD = maint_reload
+        self._MAINT_RSS_GROWTH = maint_rss_growth
+        self._MAINT_RSS_BASE = None
+        self._MAINT_DAY = None
+        self._STOP_EVT = threading.Event()
+        # Per-topic digest and time of the last published message
+        self._PUB_CACHE = {}
         # State variables used during run() and accessed in callbacks
-        self._STOP = None
         self._CONNECTED = None
         self._CONCOUNT = None
 
+    # Apply the options that can be changed at run-time
+    def _applyOptions(self, *, heartbeat=0, precision=None, profiles=None,
+                      stats_interval=None, stats_topic='_stats'):
+        # Unchanged messages are republished after `heartbeat` seconds
+        # (None = never, 0 = always, the default)
+        self._HEARTBEAT = heartbeat
+        # Float precision spec by sub-topic, see QuantizeFloats()
+        self._PRECISION = precision or {}
+        # Delivery profiles by sub-topic pattern, see DELIVERY_PROFILES
+        self._PROFILES = []
+        for pattern, profile in (profiles or {}).items():
+            if isinstance(profile, str):
+                if profile not in DELIVERY_PROFILES:
+                    raise Exception("Unknown delivery profile '%s'" % profile)
+                profile = DELIVERY_PROFILES[profile]
+            self._PROFILES.append((pattern, tuple(profile)))
+        self._PROFILE_CACHE = {}
+        # Self-telemetry is reported every `stats_interval` seconds
+        # to `stats_topic`
+        self._STATS_INTERVAL = stats_interval
+        self._STATS_TOPIC = stats_topic
+
     # Setup MQTT server connection information
     def _setup(self, user, passwd, cacerts):
         self._PUBCLI.username_pw_set(user, passwd)
@@ -33,62 +790,281 @@ class IntervalPublisher:
         self._PUBCLI.on_disconnect = self.on_disconnect
         self._PUBCLI.on_message = self.on_message
         self._PUBCLI.on_subscribe = self.on_subscribe
+        self._PUBCLI.on_publish = self.on_publish
+        if self._MAX_INFLIGHT is not None:
+            self._PUBCLI.max_inflight_messages_set(self._MAX_INFLIGHT)
+        if self._MAX_QUEUED is not None:
+            self._PUBCLI.max_queued_messages_set(self._MAX_QUEUED)
 
     # Start the publisher client with given MQTT server and connection info,
     # and publish data at given interval (in seconds).
+    # - `align`: tick on wall-clock multiples of interval;
+    # - `missed`: policy for ticks missed due to slow callbacks (MISSED_*);
     # Does NOT return until:
     #  - stop() method is called, or
-    #  - Mid-night maintenance window is reached.
-    def run(self, server, port, user, passwd, cacerts, interval):
+    #  - Memory growth exceeds limit at mid-night maintenance.
+    def run(self, server, port, user, passwd, cacerts, interval, *,
+            align=False, missed=MISSED_SKIP):
+        sched = IntervalScheduler(interval, align=align, missed=missed)
+        self._SCHED = sched
         self._setup(user, passwd, cacerts)
-        if interval < 1:
-            raise Exception("Avoid using interval < 1 second!")
+        self._reset()
         self._LOGGER.debug("Connecting to MQTT server '%s'...", server)
         self._PUBCLI.connect_async(server, port)
         self._PUBCLI.loop_start()
 
-        self._STOP = False
+        sched.start()
+        while True:
+            runs = sched.wait(self._STOP_EVT)
+            if not runs:
+                break
+            self._tick(runs, interval)
+        if sched.missed():
+            self._LOGGER.info("Missed %d ticks", sched.missed())
+        self._logDeliveryStats()
+
+        self._PUBCLI.loop_stop()
+        self._PUBCLI.disconnect()
+
+    # Reset run-time states before (re)starting the run-loop
+    def _reset(self):
+        self._STOP_EVT.clear()
         self._CONNECTED = False
         self._CONCOUNT = 0
-        while not self._STOP:
-            self._idleWait(interval)
+        # Freshly started, no maintenance needed today
+        local_time = time.localtime()
+        self._MAINT_DAY = (local_time.tm_year, local_time.tm_yday)
+
+    # Perform the due interval callbacks, then check for maintenance
+    def _tick(self, runs, interval):
+        for _ in range(runs):
             UNIXTS = time.time()
-            if self._CONNECTED:
+            # Keep computing while disconnected, if spooling
+            if self._CONNECTED or self._SPOOL is not None:
+                start = time.perf_counter()
                 self.on_interval(UNIXTS)
-            self._checkMaintTime(UNIXTS, interval)
+                self._STATS.observe('interval', time.perf_counter() - start)
+            self._STATS.count('ticks')
+            if self._STOP_EVT.is_set():
+                break
+        self._reportStats()
+        if self._MAINT_RSS_BASE is None:
+            # Measure after the first tick, when caches are warmed up
+            self._MAINT_RSS_BASE = CurrentRSS()
+        self._checkMaintTime(UNIXTS, interval)
 
-        self._PUBCLI.loop_stop()
-        self._PUBCLI.disconnect()
+    # Collect the self-telemetry
+    def stats(self):
+        stats = self._STATS.snapshot()
+        stats['counters']['missed_ticks'] = self._SCHED.missed() if self._SCHED else 0
+        stats['delivery'] = self.deliveryStats()
+        if self._SPOOL is not None:
+            stats['spooled'] = len(self._SPOOL)
+        return stats
+
+    # Report the self-telemetry, if it is time to
+    def _reportStats(self):
+        now = time.monotonic()
+        if not self._STATS_INTERVAL or now - self._STATS_LAST < self._STATS_INTERVAL:
+            return
+        self._STATS_LAST = now
+        stats = self.stats()
+        if self._STATS_TOPIC and self._CONNECTED:
+            self._publish(self._STATS_TOPIC, json.dumps(stats), 0, False, dedup=False,
+                          profile=None)
+        if self._STATS_PROMFILE:
+            # Write-then-rename, so that scrapers never see a partial file
+            tmp_file = self._STATS_PROMFILE + '.tmp'
+            with open(tmp_file, 'w') as f:
+                f.write(PublisherStats.prometheus(stats, self._LOGGER.name))
+            os.replace(tmp_file, self._STATS_PROMFILE)
 
     # Signal the run-loop to stop
     def stop(self):
         self._LOGGER.warning('Stop signal received')
-        self._STOP = True
-
-    # Wait for a given interval (in seconds) or stop signal
-    def _idleWait(self, timeout):
-        while timeout > 0 and not self._STOP:
-            time.sleep(1)
-            timeout-= 1
+        self._STOP_EVT.set()
 
     # Check if we are at mid-night maintenance window
     def _checkMaintTime(self, unix_ts, interval):
         local_time = time.localtime(unix_ts)
         if local_time.tm_hour*3600 + local_time.tm_min*60 < interval*1.5:
-            self._LOGGER.info("Scheduled maintenance termination at midnight")
-            self._STOP = True
+            maint_day = (local_time.tm_year, local_time.tm_yday)
+            if self._MAINT_DAY != maint_day:
+                self._MAINT_DAY = maint_day
+                self._maintain(unix_ts)
+
+    # Perform mid-night maintenance in process, keeping the connection and
+    # loaded resources; terminate for a full restart only if memory grew
+    # beyond the limit.
+    def _maintain(self, unix_ts):
+        rss = CurrentRSS()
+        growth = (rss - self._MAINT_RSS_BASE) / 1024
+        if self._MAINT_RSS_GROWTH is not None and growth > self._MAINT_RSS_GROWTH:
+            self._LOGGER.info("Scheduled maintenance termination at midnight "
+                              "(memory grew %.1f MB)", growth)
+            self._STOP_EVT.set()
+            return
+        self._LOGGER.info("Scheduled maintenance at midnight (memory grew %.1f MB)",
+                          growth)
+        for handler in logging.getLogger().handlers:
+            if hasattr(handler, 'doRollover'):
+                handler.doRollover()
+        if self._MAINT_RELOAD and self._CONFIG is not None:
+            self._reloadConfig()
+        with self._PUB_LOCK:
+            self._PUB_CACHE.clear()
+        self._PROFILE_CACHE.clear()
+        self.on_maintenance(unix_ts)
+        gc.collect()
+
+    # Reload the configuration, and apply the options changeable at run-time
+    def _reloadConfig(self):
+        try:
+            ReloadConfig(self._CONFIG)
+        except Exception:
+            self._LOGGER.exception("Failed to reload configuration")
+            return
+        try:
+            self._applyOptions(**{kw: getattr(self._CONFIG, name)
+                                  for name, kw in CONFIG_OPTIONS.items()
+                                  if kw in RELOADABLE_OPTIONS and hasattr(self._CONFIG, name)})
+        except Exception:
+            self._LOGGER.exception("Failed to apply reloaded configuration")
+            return
+        self._LOGGER.info("Configuration reloaded")
+
+    # Check whether a message is identical to the last one on the topic
+    # within the heartbeat period, and remember it if not.
+    def _isUnchanged(self, topic, message):
+        if self._HEARTBEAT == 0:
+            return False
+        digest = hashlib.blake2b(PayloadBytes(message), digest_size=16).digest()
+        now = time.monotonic()
+        cached = self._PUB_CACHE.get(topic)
+        if cached and cached[0] == digest:
+            if self._HEARTBEAT is None or now - cached[1] < self._HEARTBEAT:
+                return True
+        self._PUB_CACHE[topic] = (digest, now)
+        return False
+
+    # Replay spooled messages, rate limited, while staying connected
+    def _drainSpool(self):
+        if not self._DRAIN_LOCK.acquire(blocking=False):
+            return
+        try:
+            items = self._SPOOL.items()
+            self._LOGGER.info("Replaying %d spooled messages...", len(items))
+            for seq, topic, payload, qos, retain in items:
+                if not self._CONNECTED or self._STOP_EVT.is_set():
+                    break
+                start = time.monotonic()
+                with self._PUB_LOCK:
+                    # Skip messages superseded (and discarded) by fresh ones
+                    # since listed
+                    if not self._SPOOL.discard(topic, seq):
+                        continue
+                    self._LOGGER.debug("MQTT [%s(%d%s)] <-- (spooled) '%s'",
+                                       topic, qos, "+R" if retain else "", payload)
+                    info = self._PUBCLI.publish(topic, payload, qos, retain)
+                    self._QOS_COUNTS[qos]+= 1
+                    self._isUnchanged(topic, payload)
+                self._STATS.published(topic, len(payload), info.mid, start)
+                self._STATS.count('replayed')
+                self._STOP_EVT.wait(1 / self._SPOOL_RATE)
+        finally:
+            self._DRAIN_LOCK.release()
+
+    # Find the delivery profile of a sub-topic, None if not configured
+    def _profile(self, sub_topic):
+        try:
+            return self._PROFILE_CACHE[sub_topic]
+        except KeyError:
+            pass
+        profile = None
+        for pattern, pattern_profile in self._PROFILES:
+            if mqtt.topic_matches_sub(pattern, sub_topic or ''):
+                profile = pattern_profile
+                break
+        self._PROFILE_CACHE[sub_topic] = profile
+        return profile
+
+    # Summarize the messages published and the handshake packets saved,
+    # compared to publishing everything at QoS 2
+    def deliveryStats(self):
+        with self._PUB_LOCK:
+            counts = list(self._QOS_COUNTS)
+        packets = sum(c * p for c, p in zip(counts, QOS_PACKETS))
+        return {
+            'messages': counts,
+            'packets': packets,
+            'packets_saved': sum(counts) * QOS_PACKETS[2] - packets,
+        }
+
+    def _logDeliveryStats(self):
+        stats = self.deliveryStats()
+        self._LOGGER.info("Published %s messages at QoS 0/1/2, %d packets (%d saved)",
+                          '/'.join(map(str, stats['messages'])),
+                          stats['packets'], stats['packets_saved'])
 
     # Publish a message to specified MQTT topic
-    def _publish(self, sub_topic=None, message=None, qos=2, retain=False):
+    # - `qos`, `retain`: overridden by the matching delivery profile, if any;
+    # - `dedup`: skip if unchanged since last publish (default for retained);
+    # - `profile`: sub-topic whose delivery profile applies (True = this one,
+    #   None = none, for internal topics with their own `qos` and `retain`)
+    # Returns whether the message was sent (not skipped nor spooled).
+    def _publish(self, sub_topic=None, message=None, qos=2, retain=False, *,
+                 dedup=None, profile=True):
+        profile = self._profile(sub_topic if profile is True else profile) \
+                  if profile is not None else None
+        if profile:
+            qos, retain = profile
         if sub_topic:
             topic = os.path.join(self._PUB_TOPIC_PFX, sub_topic)
         else:
             topic = self._PUB_TOPIC_PFX
-        log_level = self._DRYRUN_LOGLEVEL if self._DRYRUN else logging.DEBUG
-        self._LOGGER.log(log_level, "MQTT [%s(%d%s)] <-- '%s'",
-                         topic, qos, "+R" if retain else "", message)
-        if not self._DRYRUN:
-            self._PUBCLI.publish(topic, message, qos, retain)
+        # Replies to requests are published from the network thread, so the
+        # dedup cache and counts are updated under the lock
+        with self._PUB_LOCK:
+            if (retain if dedup is None else dedup) and self._isUnchanged(topic, message):
+                self._LOGGER.debug("MQTT [%s] unchanged, skipped", topic)
+                self._STATS.count('unchanged')
+                return False
+            log_level = self._DRYRUN_LOGLEVEL if self._DRYRUN else logging.DEBUG
+            self._LOGGER.log(log_level, "MQTT [%s(%d%s)] <-- '%s'",
+                             topic, qos, "+R" if retain else "", message)
+            if self._SPOOL is not None and not self._CONNECTED and not self._DRYRUN:
+                # Only the latest states are worth replaying
+                if retain:
+                    self._SPOOL.put(topic, message, qos, retain)
+                    self._STATS.count('spooled')
+                return False
+            mid = None
+            start = time.monotonic()
+            if not self._DRYRUN:
+                if self._SPOOL is not None:
+                    # Supersedes the spooled message not yet replayed
+                    self._SPOOL.discard(topic)
+                mid = self._PUBCLI.publish(topic, message, qos, retain).mid
+            self._QOS_COUNTS[qos]+= 1
+        self._STATS.published(topic, len(PayloadBytes(message)), mid, start)
+        return True
+
+    # Encode and publish data to specified MQTT topic, and its parallel
+    # topics of additional encodings, all with the delivery profile of the
+    # topic (see _publish()). Returns whether any message was sent.
+    def _publishData(self, sub_topic, data, qos=2, retain=False, *,
+                     dedup=None, profile=True):
+        data = QuantizeFloats(data, self._PRECISION.get(sub_topic))
+        if profile is True:
+            profile = sub_topic
+        sent = False
+        for suffix, encoder in self._ENCODERS.items():
+            message = encoder.encode(sub_topic, data)
+            if message is None:
+                continue
+            topic = os.path.join(sub_topic, suffix) if suffix else sub_topic
+            sent |= self._publish(topic, message, qos, retain, dedup=dedup, profile=profile)
+        return sent
 
     # Override to handle new connection (e.g. subscribe to topics)
     # Note that topic subscription is already handled.
@@ -99,6 +1075,10 @@ class IntervalPublisher:
     def on_disconnected(self, unix_ts, final):
         pass
 
+    # Override to perform additional mid-night maintenance (e.g. flush caches)
+    def on_maintenance(self, unix_ts):
+        pass
+
     # Override to perform periodical publish
     def on_interval(self, unix_ts):
         pass
@@ -112,7 +1092,13 @@ class IntervalPublisher:
         if rc == 0:
             self._CONNECTED = True
             self._CONCOUNT+= 1
+            # Server may have lost retained messages, publish all afresh
+            with self._PUB_LOCK:
+                self._PUB_CACHE.clear()
+            if self._SPOOL:     # Not empty
+                threading.Thread(target=self._drainSpool, daemon=True).start()
             self._LOGGER.debug("Connected to MQTT server (#%d)", self._CONCOUNT)
+            self._STATS.count('connects')
 
             for topic, qos in self._SUB_PAIRS or []:
                 result, mid = self._PUBCLI.subscribe(topic, qos)
@@ -125,11 +1111,18 @@ class IntervalPublisher:
     # Handle disconnection events
     def on_disconnect(self, client, userdata, rc):
         self._CONNECTED = False
+        self._STATS.count('disconnects')
+        # Messages in-flight are not going to be acknowledged
+        self._STATS.dropPending()
         if rc != 0:
             self._LOGGER.warning("Disconnected from MQTT server - %s",
                                  mqtt.connack_string(rc))
         self.on_disconnected(time.time(), rc == 0)
 
+    # Handle publish acknowledgements
+    def on_publish(self, client, userdata, mid):
+        self._STATS.acked(mid)
+
     # Handle subscription events
     def on_subscribe(self, client, userdata, mid, granted_qos):
         self._LOGGER.debug("Subscription %d granted (QoS=%s)", mid,
@@ -137,9 +1130,11 @@ class IntervalPublisher:
 
     # Handle messages from subscriptions
     def on_message(self, client, userdata, message):
+        # Time of receipt, taken as early as possible
+        unix_ts = time.time()
         self._LOGGER.info("MQTT [%s(%d%s)] --> '%s'",
                          message.topic, message.qos, "+R" if message.retain else "",
-                         message.payload.decode('utf-8'))
-        self.on_receive(time.time(), message.topic, message.payload,
+                         message.payload.decode('utf-8', 'replace'))
+        self.on_receive(unix_ts, message.topic, message.payload,
                         message.qos, message.retain)
 
@@ -0,0 +1,157 @@
+# Hosting multiple MQTT data publishers in a single process
+
+import os
+import sys
+import types
+import logging
+import threading
+import importlib.util
+import paho.mqtt.client as mqtt
+
+from . import MQPubCli
+
+"""
+Runs several IntervalPublishers in one process, sharing a single MQTT
+client connection and run-loop. Each publisher keeps its own schedule
+and topic prefix, and failures in one do not disrupt the others.
+"""
+class IntervalPublisherHost:
+    _PUBCLI = MQPubCli.IntervalPublisher._PUBCLI
+
+    def __init__(self, name, *, max_inflight=None, max_queued=None):
+        self._LOGGER = logging.getLogger(name)
+        # Client in-flight and queued message limits
+        self._MAX_INFLIGHT = max_inflight
+        self._MAX_QUEUED = max_queued
+        self._STOP_EVT = threading.Event()
+        # List of [publisher, scheduler, interval]
+        self._ENTRIES = []
+
+    # Add a publisher to be hosted, with its publishing schedule
+    # (see IntervalPublisher.run() for the parameter meanings)
+    def add(self, publisher, interval, *, align=False,
+            missed=MQPubCli.MISSED_SKIP):
+        sched = MQPubCli.IntervalScheduler(interval, align=align, missed=missed)
+        # Stopping any publisher (e.g. for maintenance) stops the host
+        publisher._STOP_EVT = self._STOP_EVT
+        publisher._SCHED = sched
+        self._ENTRIES.append([publisher, sched, interval])
+
+    # Setup MQTT server connection information
+    def _setup(self, user, passwd, cacerts):
+        self._PUBCLI.username_pw_set(user, passwd)
+        if cacerts:
+            self._PUBCLI.tls_set(cacerts)
+        self._PUBCLI.on_connect = self.on_connect
+        self._PUBCLI.on_disconnect = self.on_disconnect
+        self._PUBCLI.on_message = self.on_message
+        self._PUBCLI.on_subscribe = self.on_subscribe
+        self._PUBCLI.on_publish = self.on_publish
+        if self._MAX_INFLIGHT is not None:
+            self._PUBCLI.max_inflight_messages_set(self._MAX_INFLIGHT)
+        if self._MAX_QUEUED is not None:
+            self._PUBCLI.max_queued_messages_set(self._MAX_QUEUED)
+
+    # Start the shared client with given MQTT server and connection info,
+    # and run all hosted publishers on their own schedules.
+    # Does NOT return until any publisher or the host is stopped.
+    def run(self, server, port, user, passwd, cacerts):
+        if not self._ENTRIES:
+            raise Exception("No publisher to host!")
+        self._setup(user, passwd, cacerts)
+        for pub, sched, _ in self._ENTRIES:
+            pub._reset()
+        self._LOGGER.debug("Connecting to MQTT server '%s'...", server)
+        self._PUBCLI.connect_async(server, port)
+        self._PUBCLI.loop_start()
+
+        for _, sched, _ in self._ENTRIES:
+            sched.start()
+        while not self._STOP_EVT.is_set():
+            entry = min(self._ENTRIES, key=lambda e: e[1].remaining())
+            if self._STOP_EVT.wait(max(entry[1].remaining(), 0)):
+                break
+            runs = entry[1].fire()
+            if runs:
+                self._isolate(entry[0], entry[0]._tick, runs, entry[2])
+        for pub, sched, _ in self._ENTRIES:
+            if sched.missed():
+                pub._LOGGER.info("Missed %d ticks", sched.missed())
+            pub._logDeliveryStats()
+
+        self._PUBCLI.loop_stop()
+        self._PUBCLI.disconnect()
+
+    # Signal the run-loop to stop
+    def stop(self):
+        self._LOGGER.warning('Stop signal received')
+        self._STOP_EVT.set()
+
+    # Invoke a publisher method, containing any failure within the publisher
+    def _isolate(self, pub, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            pub._LOGGER.exception("Publisher failed in %s()", func.__name__)
+
+    # Handle connection events
+    def on_connect(self, client, userdata, flags, rc):
+        for pub, _, _ in self._ENTRIES:
+            self._isolate(pub, pub.on_connect, client, userdata, flags, rc)
+
+    # Handle disconnection events
+    def on_disconnect(self, client, userdata, rc):
+        for pub, _, _ in self._ENTRIES:
+            self._isolate(pub, pub.on_disconnect, client, userdata, rc)
+
+    # Handle publish acknowledgements
+    def on_publish(self, client, userdata, mid):
+        # Message ids are unique across publishers of the shared client
+        for pub, _, _ in self._ENTRIES:
+            pub.on_publish(client, userdata, mid)
+
+    # Handle subscription events
+    def on_subscribe(self, client, userdata, mid, granted_qos):
+        self._LOGGER.debug("Subscription %d granted (QoS=%s)", mid,
+                           ','.join([str(qos) for qos in granted_qos]))
+
+    # Route messages to the publishers subscribed to the topic
+    def on_message(self, client, userdata, message):
+        for pub, _, _ in self._ENTRIES:
+            for topic, _ in pub._SUB_PAIRS or []:
+                if mqtt.topic_matches_sub(topic, message.topic):
+                    self._isolate(pub, pub.on_message, client, userdata, message)
+                    break
+
+# Load a service script from its directory, without running it.
+# The service is configured by `<svc_dir>/__deploy__/Config.py`, and must
+# expose its publisher as `service` and the schedule as `SCHEDULE`.
+def LoadService(svc_dir, script):
+    svc_dir = os.path.abspath(svc_dir)
+    deploy_dir = os.path.join(svc_dir, '__deploy__')
+    mod_name = os.path.splitext(os.path.basename(script))[0]
+
+    # Temporarily point `__deploy__` to the service's own deployment
+    saved_mods = {n: sys.modules.pop(n) for n in list(sys.modules)
+                  if n == '__deploy__' or n.startswith('__deploy__.')}
+    deploy_pkg = types.ModuleType('__deploy__')
+    deploy_pkg.__path__ = [deploy_dir]
+    sys.modules['__deploy__'] = deploy_pkg
+    # Service local modules are resolved from its directory
+    if svc_dir not in sys.path:
+        sys.path.insert(1, svc_dir)
+
+    spec = importlib.util.spec_from_file_location(mod_name, os.path.join(svc_dir, script))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[mod_name] = module
+    cwd = os.getcwd()
+    os.chdir(deploy_dir)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+        for n in [n for n in sys.modules
+                  if n == '__deploy__' or n.startswith('__deploy__.')]:
+            del sys.modules[n]
+        sys.modules.update(saved_mods)
+    return module
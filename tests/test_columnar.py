@@ -0,0 +1,78 @@
+# Run-length and columnar encodings of the WeatherServ forecasts
+# (WeatherServ/DarkSkyObserver.py): payloads decode back to the digests
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'WeatherServ'))
+
+from DarkSkyObserver import (ArrayRLE, ArrayExpand, EncodeColumn, DecodeColumn,
+                             ColumnarSeries, SeriesFromColumns, ForecastColumns,
+                             COLUMN_RLE, COLUMN_DELTA)
+
+class ArrayRLETest(unittest.TestCase):
+
+    def test_exact_counts(self):
+        self.assertEqual(ArrayRLE([ 1, 1, 2, 2, 2, 3 ]), [ 1, 1, [ 'RLE', 3, 2 ], 3 ])
+        self.assertEqual(ArrayRLE([ [0, '-', 0] ] * 61), [ [ 'RLE', 61, [0, '-', 0] ] ])
+        self.assertEqual(ArrayRLE([]), [])
+
+    def test_round_trip(self):
+        arr = [ 'a', 'a', None, None, None, [0, '-', 0], 1.5, 1.5, 1.5, 1.5, 'a' ]
+        self.assertEqual(ArrayExpand(ArrayRLE(arr)), arr)
+
+class ColumnTest(unittest.TestCase):
+
+    def assertRoundTrip(self, values, precision=None, mode=None, expected=None):
+        column = EncodeColumn(values, precision, mode)
+        self.assertEqual(DecodeColumn(column), values if expected is None else expected)
+        return column
+
+    def test_ints_delta(self):
+        column = self.assertRoundTrip([ 10, 12, 14, 16, 18, 20, 21 ])
+        self.assertEqual(column, [ COLUMN_DELTA, 0, [ 10, [ 'RLE', 5, 2 ], 1 ] ])
+
+    def test_floats_rounded(self):
+        values = [ 57.800000000000004, 58.17, 58.54, 58.91, 59.28 ]
+        column = self.assertRoundTrip(values, 1, expected=[ 57.8, 58.2, 58.5, 58.9, 59.3 ])
+        self.assertEqual(column[:2], [ COLUMN_DELTA, 1 ])
+        # Floats are only delta encoded with a precision
+        self.assertEqual(self.assertRoundTrip(values)[0], COLUMN_RLE)
+
+    def test_values_rle(self):
+        for values in ([ 'S', 'S', 'S', 'SW' ], [ True, True, False ], [ 1, None, 1 ]):
+            self.assertEqual(self.assertRoundTrip(values)[0], COLUMN_RLE)
+
+    def test_mode(self):
+        self.assertEqual(self.assertRoundTrip([ 1, 2, 3 ], mode=COLUMN_RLE)[0], COLUMN_RLE)
+        self.assertEqual(self.assertRoundTrip([ 5, 5, 5 ], mode=COLUMN_DELTA)[0], COLUMN_DELTA)
+
+class ColumnarSeriesTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        items = [
+            { '@': 'Clear', 'W': [[180, 'S'], 5, 7], 'P': [1013, [0, '-', 0]] },
+            { '@': 'Clear', 'W': [[190, 'S'], 6, 8], 'P': [1012, [0, '-', 0], 12] },
+            { '@': 'Rain', 'W': [[200, 'SSW'], 7, 9], 'P': [1011, [0.5, 'rain', 1]] },
+        ]
+        columns = ColumnarSeries(items)
+        self.assertEqual(columns['W.0.1'], [ COLUMN_RLE, [ 'S', 'S', 'SSW' ] ])
+        # Absent from some entries
+        self.assertEqual(DecodeColumn(columns['P.2']), [ None, 12, None ])
+        self.assertEqual(SeriesFromColumns(len(items), columns), items)
+
+    def test_forecast(self):
+        item = { '@': 'Clear', 'T': [50.25, 49] }
+        digest = [ "Clear.", [ 0, 7200 ], [ [ 'RLE', 3, item ] ] ]
+        summary, span, length, columns = ForecastColumns(digest, 1)
+        self.assertEqual((summary, span, length), ("Clear.", [ 0, 7200 ], 3))
+        self.assertEqual(SeriesFromColumns(length, columns),
+                         [ { '@': 'Clear', 'T': [50.2, 49] } ] * 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# Delta encoding of the WeatherServ forecasts (WeatherServ/DarkSkyObserver.py):
+# patches applied as devices do must reproduce the forecast
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import sys
+import copy
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'WeatherServ'))
+
+from DarkSkyObserver import ForecastDelta
+
+STEP = 3600
+
+# Forecast digest of `count` hourly entries from hour `start`
+def Forecast(start, count, summary="Clear throughout the day.", **overrides):
+    items = [ { '@': 'Clear', 'T': [50 + start + i, 49], 'W': [[180, 'S'], 5] }
+              for i in range(count) ]
+    for idx, item in overrides.items():
+        items[int(idx[1:])].update(item)
+    return [ summary, [ start * STEP, (start + count - 1) * STEP ], items ]
+
+# Apply a patch to the state of a device, as documented for devices
+def ApplyPatch(state, patch):
+    _, shift, length, summary, span, changes = patch
+    items = copy.deepcopy(state[2])[shift:][:length]
+    for idx, fields in changes:
+        if idx < len(items):
+            items[idx].update(fields)
+        else:
+            items.append(fields)
+    return [ summary, span, items ]
+
+class ForecastDeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self._DELTA = ForecastDelta(STEP, 4)
+        self._STATE = None
+        self._SEQ = 0
+
+    # Update with a forecast, check the device ends up with it, and
+    # return the kind of update published
+    def update(self, digest):
+        update = self._DELTA.update(digest)
+        if update is None:
+            return None
+        kind, data = update
+        self.assertEqual(data[0], self._SEQ + 1)
+        self._SEQ = data[0]
+        self._STATE = data[1] if kind == 'base' else ApplyPatch(self._STATE, data)
+        self.assertEqual(self._STATE, digest)
+        return kind
+
+    def test_first_base_then_unchanged(self):
+        self.assertIsNone(self._DELTA.base())
+        self.assertEqual(self.update(Forecast(0, 48)), 'base')
+        self.assertIsNone(self.update(Forecast(0, 48)))
+        self.assertIsNone(self._DELTA.update(None))
+        self.assertEqual(self._DELTA.base(), [ 1, Forecast(0, 48) ])
+
+    def test_patch_changed_fields(self):
+        self.update(Forecast(0, 48))
+        self.assertEqual(self.update(Forecast(0, 48, h3={ '@': 'Rain' })), 'patch')
+        patch = self._DELTA._patch(Forecast(0, 48), Forecast(0, 48, h3={ '@': 'Rain' }))
+        self.assertEqual(patch[-1], [ [ 3, { '@': 'Rain' } ] ])
+
+    def test_patch_shift_and_length(self):
+        self.update(Forecast(0, 48))
+        # Moved on an hour, with a new last entry
+        self.assertEqual(self.update(Forecast(1, 48)), 'patch')
+        # Moved on two hours, with fewer entries
+        self.assertEqual(self.update(Forecast(3, 40, "Rain tonight.")), 'patch')
+        shift, length = self._DELTA._patch(Forecast(1, 48), Forecast(3, 40))[:2]
+        self.assertEqual((shift, length), (2, 40))
+
+    def test_base_when_not_patchable(self):
+        self.update(Forecast(0, 48))
+        # Not moved by whole steps
+        self.assertEqual(self.update(Forecast(0.5, 48)), 'base')
+        # Moved past all entries
+        self.assertEqual(self.update(Forecast(60, 48)), 'base')
+        # Moved back
+        self.assertEqual(self.update(Forecast(59, 48)), 'base')
+
+    def test_base_when_patch_larger(self):
+        self.update(Forecast(0, 4))
+        # All fields of all entries changed
+        changed = { 'h%d' % i: { '@': 'Rain', 'T': [40, 39], 'W': [[90, 'E'], 9] }
+                    for i in range(4) }
+        self.assertEqual(self.update(Forecast(0, 4, **changed)), 'base')
+
+    def test_base_every(self):
+        kinds = [ self.update(Forecast(hour, 48)) for hour in range(9) ]
+        self.assertEqual(kinds, [ 'base', 'patch', 'patch', 'patch' ] * 2 + [ 'base' ])
+
+if __name__ == '__main__':
+    unittest.main()
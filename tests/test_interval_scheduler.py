@@ -0,0 +1,105 @@
+# Missed tick policies and alignment of the tick scheduler
+# (common/MQPubCli.py), on a fake clock
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.MQPubCli import (IntervalScheduler, MISSED_SKIP, MISSED_CATCHUP,
+                             MISSED_COALESCE)
+
+# Monotonic time set by the tests, and wall-clock time `wall_offset` ahead
+class FakeClock:
+
+    def __init__(self, now=0.0, wall_offset=1000.0):
+        self.now = now
+        self.wall_offset = wall_offset
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now + self.wall_offset
+
+class IntervalSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._CLOCK = FakeClock()
+        for name in ('monotonic', 'time'):
+            patcher = mock.patch('time.' + name, getattr(self._CLOCK, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def scheduler(self, missed=MISSED_SKIP, **kwargs):
+        sched = IntervalScheduler(10, missed=missed, **kwargs)
+        sched.start()
+        return sched
+
+    def fire_at(self, sched, now):
+        self._CLOCK.now = now
+        return sched.fire()
+
+    def test_on_time(self):
+        sched = self.scheduler()
+        self.assertEqual(self.fire_at(sched, 9.9), 0)
+        self.assertEqual(self.fire_at(sched, 10), 1)
+        self.assertEqual(self.fire_at(sched, 10), 0)
+        # Late within the grace period (half the interval)
+        self.assertEqual(self.fire_at(sched, 24), 1)
+        self.assertEqual(sched.missed(), 0)
+        self.assertAlmostEqual(sched.remaining(), 6)
+
+    def test_skip(self):
+        sched = self.scheduler(MISSED_SKIP)
+        # Slots 10, 20 and 30 passed, the latest one too late to run
+        self.assertEqual(self.fire_at(sched, 37), 0)
+        self.assertEqual(sched.missed(), 3)
+        self.assertEqual(self.fire_at(sched, 40), 1)
+        # Slots 50 and 60 passed, the latest one still within grace
+        self.assertEqual(self.fire_at(sched, 62), 1)
+        self.assertEqual(sched.missed(), 4)
+
+    def test_catchup(self):
+        sched = self.scheduler(MISSED_CATCHUP)
+        self.assertEqual(self.fire_at(sched, 37), 3)
+        self.assertEqual(sched.missed(), 3)
+        self.assertEqual(self.fire_at(sched, 39), 0)
+        self.assertEqual(self.fire_at(sched, 40), 1)
+
+    def test_coalesce(self):
+        sched = self.scheduler(MISSED_COALESCE)
+        self.assertEqual(self.fire_at(sched, 37), 1)
+        self.assertEqual(sched.missed(), 3)
+        self.assertEqual(self.fire_at(sched, 40), 1)
+
+    def test_aligned(self):
+        self._CLOCK.wall_offset = 1003.5
+        sched = self.scheduler(align=True, offset=2)
+        # Ticks on wall-clock multiples of 10, plus 2
+        self.assertAlmostEqual(sched.remaining(), 8.5)
+        self.assertEqual(self.fire_at(sched, 8.5), 1)
+        self.assertAlmostEqual(self._CLOCK.time() + sched.remaining(), 1022)
+
+    def test_aligned_wall_clock_stepped(self):
+        sched = self.scheduler(align=True)
+        self.assertEqual(self.fire_at(sched, 10), 1)
+        # Wall-clock set back a minute: tick once, then re-align
+        self._CLOCK.wall_offset -= 60
+        self.assertEqual(self.fire_at(sched, 20), 1)
+        self.assertAlmostEqual((self._CLOCK.time() + sched.remaining()) % 10, 0)
+        self.assertEqual(sched.missed(), 0)
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            IntervalScheduler(0)
+        with self.assertRaises(Exception):
+            IntervalScheduler(10, missed='later')
+
+if __name__ == '__main__':
+    unittest.main()
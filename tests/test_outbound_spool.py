@@ -0,0 +1,125 @@
+# Recovery of the outbound spool (common/MQPubCli.py) after restarts, and
+# replaying it after reconnecting
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import paho.mqtt.client as mqtt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.MQPubCli import IntervalPublisher, OutboundSpool
+
+class OutboundSpoolRecoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._DIR = tempfile.mkdtemp()
+        self._PATH = os.path.join(self._DIR, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self._DIR)
+
+    def reopen(self, spool, size=4096):
+        spool.close()
+        return OutboundSpool(self._PATH, size)
+
+    def topics(self, spool):
+        return [ (topic, payload) for _, topic, payload, _, _ in spool.items() ]
+
+    def test_discarded_not_recovered(self):
+        spool = OutboundSpool(self._PATH, 4096)
+        spool.put('a', 'A1', 1, True)
+        spool.put('b', 'B1', 1, True)
+        spool.discard('a')
+        spool = self.reopen(spool)
+        self.assertEqual(self.topics(spool), [ ('b', b'B1') ])
+        spool.close()
+
+    def test_superseded_not_recovered_after_discard(self):
+        spool = OutboundSpool(self._PATH, 4096)
+        spool.put('a', 'A1', 1, True)
+        spool.put('b', 'B1', 1, True)
+        spool.put('a', 'A2', 1, True)
+        spool.discard('a')
+        spool = self.reopen(spool)
+        self.assertEqual(self.topics(spool), [ ('b', b'B1') ])
+        spool.close()
+
+    def test_latest_recovered(self):
+        spool = OutboundSpool(self._PATH, 4096)
+        spool.put('a', 'A1', 1, True)
+        spool.put('b', 'B1', 1, True)
+        spool.put('a', 'A2', 1, True)
+        spool = self.reopen(spool)
+        self.assertEqual(self.topics(spool), [ ('b', b'B1'), ('a', b'A2') ])
+        # Records after the dead ones are still appended and recovered
+        spool.put('c', 'C1', 0, False)
+        spool = self.reopen(spool)
+        self.assertEqual(self.topics(spool), [ ('b', b'B1'), ('a', b'A2'), ('c', b'C1') ])
+        spool.close()
+
+    def test_discard_after_compaction(self):
+        spool = OutboundSpool(self._PATH, 256)
+        for i in range(20):
+            spool.put('t%d' % (i % 3), 'x' * 20, 1, True)
+        spool.discard('t0')
+        expected = self.topics(spool)
+        spool = self.reopen(spool, 256)
+        self.assertEqual(self.topics(spool), expected)
+        self.assertNotIn('t0', [ t for t, _ in expected ])
+        spool.close()
+
+# Records the messages published, in place of the paho client
+class RecordingClient:
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+        return mqtt.MQTTMessageInfo(len(self.published))
+
+class OutboundSpoolReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self._DIR = tempfile.mkdtemp()
+        self._SPOOL = OutboundSpool(os.path.join(self._DIR, 'spool'), 4096)
+        self._PUB = IntervalPublisher('test', 'pfx', False, heartbeat=None,
+                                      spool=self._SPOOL, spool_rate=1000)
+        self._PUB._PUBCLI = RecordingClient()
+
+    def tearDown(self):
+        self._SPOOL.close()
+        shutil.rmtree(self._DIR)
+
+    def test_stale_sequence_not_discarded(self):
+        self._SPOOL.put('a', 'A1', 1, True)
+        (seq, *_), = self._SPOOL.items()
+        self._SPOOL.put('a', 'A2', 1, True)
+        self.assertFalse(self._SPOOL.discard('a', seq))
+        self.assertEqual(len(self._SPOOL), 1)
+
+    def test_replay_skips_superseded(self):
+        self._PUB._CONNECTED = False
+        self._PUB._publish('a', 'A1', 1, True)
+        self._PUB._publish('b', 'B1', 1, True)
+        # A fresh message published while the spool is being replayed
+        items = self._SPOOL.items()
+        self._SPOOL.items = lambda: items
+        self._PUB._CONNECTED = True
+        self._PUB._publish('a', 'A2', 1, True)
+        self._PUB._drainSpool()
+        self.assertEqual(self._PUB._PUBCLI.published,
+                         [ ('pfx/a', 'A2'), ('pfx/b', b'B1') ])
+        self.assertEqual(len(self._SPOOL), 0)
+        # The dedup cache holds the fresh message, not the spooled one
+        self._PUB._publish('a', 'A2', 1, True)
+        self.assertEqual(len(self._PUB._PUBCLI.published), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# Token-bucket rate limits of the RateLimiter (common/MQPubCli.py), on a
+# fake clock
+#
+# Usage: python3 -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.MQPubCli import RateLimiter
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._NOW = 0.0
+        patcher = mock.patch('time.monotonic', lambda: self._NOW)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def allowed(self, limiter, count, key=None):
+        return [ limiter.allow(key) for _ in range(count) ]
+
+    def test_burst_then_refill(self):
+        limiter = RateLimiter(0.5, 2)
+        self.assertEqual(self.allowed(limiter, 3), [ True, True, False ])
+        self._NOW = 1
+        self.assertEqual(self.allowed(limiter, 1), [ False ])
+        self._NOW = 2
+        self.assertEqual(self.allowed(limiter, 2), [ True, False ])
+        # Refilled up to the burst only
+        self._NOW = 100
+        self.assertEqual(self.allowed(limiter, 3), [ True, True, False ])
+
+    def test_keys_independent(self):
+        limiter = RateLimiter(0.1, 1)
+        self.assertEqual(self.allowed(limiter, 2, 'a'), [ True, False ])
+        self.assertEqual(self.allowed(limiter, 2, 'b'), [ True, False ])
+
+    def test_least_recent_keys_forgotten(self):
+        limiter = RateLimiter(0.1, 1, max_keys=2)
+        for key in ('a', 'b', 'a', 'c'):
+            limiter.allow(key)
+        # 'b' was dropped, so starts with a full bucket again
+        self.assertEqual(self.allowed(limiter, 1, 'b'), [ True ])
+        self.assertEqual(self.allowed(limiter, 1, 'c'), [ False ])
+
+    def test_refund(self):
+        limiter = RateLimiter(0.1, 2)
+        self.assertEqual(self.allowed(limiter, 2, 'a'), [ True, True ])
+        limiter.refund('a')
+        self.assertEqual(self.allowed(limiter, 2, 'a'), [ True, False ])
+        # Not beyond the burst, nor for unknown keys
+        limiter.refund('b')
+        self._NOW = 100
+        limiter.refund('a')
+        self.assertEqual(self.allowed(limiter, 3, 'a'), [ True, True, False ])
+        self.assertEqual(self.allowed(limiter, 3, 'b'), [ True, True, False ])
+
+if __name__ == '__main__':
+    unittest.main()